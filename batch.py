@@ -0,0 +1,95 @@
+import asyncio
+import json
+import logging
+import time
+from typing import Any, AsyncIterator, Awaitable, Callable, Dict, Hashable, List
+
+from config import env_int
+from streaming import SSE_HEADERS, sse_event
+
+logger = logging.getLogger(__name__)
+
+BATCH_MAX_ITEMS = env_int("BATCH_MAX_ITEMS", 50)
+BATCH_MAX_CONCURRENCY = env_int("BATCH_MAX_CONCURRENCY", 8)
+
+BATCH_MEDIA_TYPES = {
+    "ndjson": "application/x-ndjson",
+    "sse": "text/event-stream",
+}
+BATCH_HEADERS = {
+    "ndjson": {"Cache-Control": "no-cache", "X-Accel-Buffering": "no"},
+    "sse": SSE_HEADERS,
+}
+
+
+# Per-batch memo of shared lookups (e.g. one search per distinct query).
+# Waiters go through asyncio.shield so a failed or cancelled item never cancels
+# a lookup another item is still waiting on; close() cancels what is left.
+class SharedCalls:
+    def __init__(self):
+        self._tasks: Dict[Hashable, asyncio.Task] = {}
+        self.calls = 0
+        self.shared = 0
+
+    async def do(self, key: Hashable, fn: Callable[[], Awaitable[Any]]) -> Any:
+        task = self._tasks.get(key)
+        if task is None:
+            self.calls += 1
+            task = self._tasks[key] = asyncio.ensure_future(fn())
+        else:
+            self.shared += 1
+        return await asyncio.shield(task)
+
+    def close(self):
+        for task in self._tasks.values():
+            if not task.done():
+                task.cancel()
+
+
+def _error_result(e: BaseException) -> Dict:
+    status_code = getattr(e, "status_code", None) or 500
+    detail = getattr(e, "detail", None) or str(e) or type(e).__name__
+    return {"status": "error", "status_code": status_code, "error": detail}
+
+
+# Run every item with at most `concurrency` in flight and yield results as they
+# finish, not in submission order. One failing item becomes an error result; it
+# never fails the batch. Closing the generator (client disconnect) cancels the rest.
+async def run_batch(items: List[Any], run_item: Callable[[Any], Awaitable[Dict]],
+                    concurrency: int) -> AsyncIterator[Dict]:
+    semaphore = asyncio.Semaphore(max(1, concurrency))
+
+    async def run_one(index: int, item: Any) -> Dict:
+        async with semaphore:
+            start = time.perf_counter()
+            try:
+                result = {"status": "ok", "status_code": 200, **await run_item(item)}
+            except Exception as e:
+                logger.warning(f"Batch item {index} failed: {e}")
+                result = _error_result(e)
+            result["elapsed_ms"] = round((time.perf_counter() - start) * 1000, 1)
+            return {"index": index, "id": getattr(item, "id", None), **result}
+
+    tasks = [asyncio.ensure_future(run_one(index, item)) for index, item in enumerate(items)]
+    try:
+        for finished in asyncio.as_completed(tasks):
+            yield await finished
+    finally:
+        for task in tasks:
+            if not task.done():
+                task.cancel()
+
+
+# Encode item results and a closing summary line as NDJSON or SSE
+async def encode_batch(results: AsyncIterator[Dict], fmt: str) -> AsyncIterator[str]:
+    summary = {"done": True, "ok": 0, "failed": 0}
+    async for result in results:
+        summary["ok" if result["status"] == "ok" else "failed"] += 1
+        if fmt == "sse":
+            yield sse_event(result, event="item")
+        else:
+            yield json.dumps(result, ensure_ascii=False) + "\n"
+    if fmt == "sse":
+        yield sse_event(summary, event="done")
+    else:
+        yield json.dumps(summary) + "\n"
@@ -0,0 +1,135 @@
+"""Cold-start benchmark: how long a fresh app process takes to answer.
+
+    python -m bench.cold_start --runs 5 --output bench/results/cold-head.json
+    python -m bench.cold_start --runs 5 --baseline bench/results/cold-base.json --max-regression 0.15
+
+Each run starts a new server process (as a deploy or scale-up would) for every
+STARTUP_MODE, polls until it accepts connections and then sends one /api/ds
+request to a local DeepSeek stub. Reported per mode, as medians over the runs:
+time until the port answers, time until the first chat completion is served,
+and the app's own /api/startup-stats breakdown. With --baseline the command
+exits non-zero when a median is slower than the baseline by more than
+--max-regression.
+"""
+import argparse
+import json
+import os
+import statistics
+import subprocess
+import sys
+import time
+from typing import Dict, List
+
+import httpx
+
+from bench.run import ROOT, free_port, stop, wait_until_ready
+
+MODES = ("eager", "lazy", "background")
+TRACKED = ("listen_s", "first_chat_s")
+
+
+def cold_start(args, stub_url: str, mode: str) -> Dict:
+    port = free_port()
+    env = dict(os.environ)
+    env.update({
+        "STARTUP_MODE": mode,
+        "DEEPSEEK_BASE_URL": stub_url,
+        "DEEPSEEK_API_KEY": "bench",
+        "LOG_PAYLOADS": "false",
+    })
+    if args.server == "hypercorn":
+        command = [sys.executable, "-m", "hypercorn", "main:app", "--bind", f"127.0.0.1:{port}"]
+    else:
+        command = [sys.executable, "-m", "uvicorn", "main:app", "--port", str(port), "--log-level", "warning"]
+    base_url = f"http://127.0.0.1:{port}"
+    spawned = time.perf_counter()
+    process = subprocess.Popen(command, cwd=ROOT, env=env, stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL)
+    try:
+        with httpx.Client(base_url=base_url, timeout=30.0) as client:
+            while True:
+                try:
+                    client.get("/api/startup-stats", timeout=0.5)
+                    break
+                except httpx.TransportError:
+                    if time.perf_counter() - spawned > 60 or process.poll() is not None:
+                        raise RuntimeError(f"Server in {mode} mode did not start")
+                    time.sleep(0.01)
+            listen = time.perf_counter() - spawned
+            response = client.post("/api/ds", json={
+                "model": "deepseek-chat", "messages": [{"role": "user", "content": "cold start"}],
+            })
+            response.raise_for_status()
+            first_chat = time.perf_counter() - spawned
+            report = client.get("/api/startup-stats").json()
+    finally:
+        stop(process)
+    return {"listen_s": listen, "first_chat_s": first_chat, "report": report}
+
+
+def summarize(mode: str, runs: List[Dict]) -> Dict:
+    summary = {"mode": mode, "runs": len(runs)}
+    for name in TRACKED:
+        summary[name] = round(statistics.median(run[name] for run in runs), 3)
+    for name in ("import_s", "ready_s", "warmup_s"):
+        values = [run["report"][name] for run in runs if run["report"].get(name) is not None]
+        summary[f"app_{name}"] = round(statistics.median(values), 3) if values else None
+    summary["import_ms_by_module"] = runs[-1]["report"]["import_ms_by_module"]
+    return summary
+
+
+def regressions(results: List[Dict], baseline: List[Dict], max_regression: float) -> List[str]:
+    failures = []
+    base_by_mode = {result["mode"]: result for result in baseline}
+    for result in results:
+        base = base_by_mode.get(result["mode"])
+        if base is None:
+            continue
+        for name in TRACKED:
+            if base.get(name) and result[name] > base[name] * (1 + max_regression):
+                failures.append(f"{result['mode']} {name}: {base[name]:.3f}s -> {result[name]:.3f}s")
+    return failures
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--runs", type=int, default=5)
+    parser.add_argument("--modes", nargs="+", choices=MODES, default=list(MODES))
+    parser.add_argument("--server", choices=("uvicorn", "hypercorn"), default="hypercorn")
+    parser.add_argument("--output", help="Write the summary as JSON to this path")
+    parser.add_argument("--baseline", help="Summary JSON from an earlier run to compare against")
+    parser.add_argument("--max-regression", type=float, default=0.15, help="Allowed slowdown as a fraction")
+    args = parser.parse_args()
+
+    stub_port = free_port()
+    stub = subprocess.Popen(
+        [sys.executable, "-m", "bench.stubs", "--kind", "deepseek", "--port", str(stub_port), "--latency", "fixed:0"],
+        cwd=ROOT,
+    )
+    try:
+        stub_url = f"http://127.0.0.1:{stub_port}"
+        wait_until_ready(f"{stub_url}/stub/stats")
+        # Interleave modes so drift on the machine affects them all alike
+        runs: Dict[str, List[Dict]] = {mode: [] for mode in args.modes}
+        for _ in range(args.runs):
+            for mode in args.modes:
+                runs[mode].append(cold_start(args, stub_url, mode))
+    finally:
+        stop(stub)
+
+    results = [summarize(mode, mode_runs) for mode, mode_runs in runs.items()]
+    for result in results:
+        print(json.dumps({name: value for name, value in result.items() if name != "import_ms_by_module"}))
+    if args.output:
+        with open(args.output, "w") as f:
+            json.dump(results, f, indent=2)
+    if args.baseline:
+        with open(args.baseline) as f:
+            failures = regressions(results, json.load(f), args.max_regression)
+        for failure in failures:
+            print(f"REGRESSION {failure}")
+        if failures:
+            sys.exit(1)
+
+
+if __name__ == "__main__":
+    main()
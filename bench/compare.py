@@ -0,0 +1,55 @@
+"""Compare two benchmark reports and flag regressions.
+
+    python -m bench.compare bench/results/base.json bench/results/head.json --threshold 0.10
+
+Cells are matched on endpoint, concurrency, cache state and stream mode. Exits
+with status 1 when p95 latency grows or throughput drops by more than the threshold.
+"""
+import argparse
+import json
+import sys
+from typing import Dict, Tuple
+
+
+def _key(result: Dict) -> Tuple:
+    return (result["endpoint"], result["concurrency"], result["cache_state"], result.get("stream", False))
+
+
+def _change(base, head):
+    if not base or head is None:
+        return None
+    return (head - base) / base
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("base")
+    parser.add_argument("head")
+    parser.add_argument("--threshold", type=float, default=0.10, help="Allowed relative regression")
+    args = parser.parse_args()
+
+    with open(args.base) as base_file, open(args.head) as head_file:
+        base = {_key(result): result for result in json.load(base_file)["results"]}
+        head = {_key(result): result for result in json.load(head_file)["results"]}
+
+    regressions = 0
+    print(f"{'endpoint':<18} {'cache':<5} {'conc':>4} {'stream':>6}  {'p95 ms':>17}  {'req/s':>17}")
+    for key in sorted(base.keys() & head.keys()):
+        before, after = base[key], head[key]
+        p95_change = _change(before["latency_ms"]["p95"], after["latency_ms"]["p95"])
+        rps_change = _change(before["throughput_rps"], after["throughput_rps"])
+        regressed = (p95_change is not None and p95_change > args.threshold) or \
+                    (rps_change is not None and rps_change < -args.threshold)
+        regressions += regressed
+        endpoint, concurrency, cache_state, stream = key
+        print(
+            f"{endpoint:<18} {cache_state:<5} {concurrency:>4} {str(stream):>6}  "
+            f"{before['latency_ms']['p95']:>7} -> {after['latency_ms']['p95']:<7}  "
+            f"{before['throughput_rps']:>7} -> {after['throughput_rps']:<7}"
+            f"{'  REGRESSION' if regressed else ''}"
+        )
+    sys.exit(1 if regressions else 0)
+
+
+if __name__ == "__main__":
+    main()
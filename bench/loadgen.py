@@ -0,0 +1,162 @@
+"""Closed-loop load generator for the chat endpoints.
+
+Runs a fixed number of requests against one endpoint with N concurrent workers and
+reports throughput, latency percentiles, time to first byte and server memory:
+
+    python -m bench.loadgen --base-url http://127.0.0.1:9100 --endpoint /api/ds --concurrency 8
+"""
+import argparse
+import asyncio
+import json
+import time
+import uuid
+from typing import Dict, List, Optional
+
+import httpx
+
+CHAT_ENDPOINTS = ("/api/ds", "/api/dswithsearch", "/api/ppxty")
+DEFAULT_MODELS = {"/api/ds": "deepseek-chat", "/api/dswithsearch": "deepseek-chat", "/api/ppxty": "r1-1776"}
+WARM_QUESTION = "Compare AIA and Manulife critical illness plans"
+
+
+def percentile(values: List[float], pct: float) -> Optional[float]:
+    if not values:
+        return None
+    ordered = sorted(values)
+    index = min(int(round((len(ordered) - 1) * pct)), len(ordered) - 1)
+    return ordered[index]
+
+
+# Resident and peak memory of a local process in MiB, from /proc (Linux only)
+def process_memory(pid: Optional[int]) -> Dict[str, Optional[float]]:
+    memory = {"rss_mib": None, "peak_rss_mib": None}
+    if pid is None:
+        return memory
+    try:
+        with open(f"/proc/{pid}/status") as status:
+            for line in status:
+                if line.startswith("VmRSS:"):
+                    memory["rss_mib"] = round(int(line.split()[1]) / 1024, 1)
+                elif line.startswith("VmHWM:"):
+                    memory["peak_rss_mib"] = round(int(line.split()[1]) / 1024, 1)
+    except OSError:
+        pass
+    return memory
+
+
+# Cold requests use a unique question each time so no cache can answer them;
+# warm requests repeat one question that was primed before measuring
+def build_payload(endpoint: str, model: str, cache_state: str, stream: bool) -> Dict:
+    question = WARM_QUESTION if cache_state == "warm" else f"{WARM_QUESTION} ({uuid.uuid4().hex[:12]})"
+    return {"model": model, "stream": stream, "messages": [{"role": "user", "content": question}]}
+
+
+async def _timed_request(client: httpx.AsyncClient, endpoint: str, payload: Dict) -> Dict:
+    start = time.perf_counter()
+    first_byte = None
+    async with client.stream("POST", endpoint, json=payload) as response:
+        async for _ in response.aiter_raw():
+            if first_byte is None:
+                first_byte = time.perf_counter() - start
+        status = response.status_code
+    total = time.perf_counter() - start
+    return {"status": status, "latency": total, "ttfb": first_byte if first_byte is not None else total}
+
+
+async def run_load(
+    base_url: str,
+    endpoint: str,
+    concurrency: int,
+    requests: int,
+    cache_state: str = "cold",
+    stream: bool = False,
+    model: Optional[str] = None,
+    server_pid: Optional[int] = None,
+    timeout: float = 120.0,
+) -> Dict:
+    model = model or DEFAULT_MODELS.get(endpoint, "deepseek-chat")
+    limits = httpx.Limits(max_connections=concurrency, max_keepalive_connections=concurrency)
+    async with httpx.AsyncClient(base_url=base_url, limits=limits, timeout=timeout) as client:
+        if cache_state == "warm":
+            await _timed_request(client, endpoint, build_payload(endpoint, model, cache_state, stream))
+
+        samples: List[Dict] = []
+        remaining = requests
+
+        async def worker():
+            nonlocal remaining
+            while remaining > 0:
+                remaining -= 1
+                payload = build_payload(endpoint, model, cache_state, stream)
+                try:
+                    samples.append(await _timed_request(client, endpoint, payload))
+                except httpx.HTTPError as e:
+                    samples.append({"status": type(e).__name__, "latency": None, "ttfb": None})
+
+        memory_before = process_memory(server_pid)
+        start = time.perf_counter()
+        await asyncio.gather(*[worker() for _ in range(concurrency)])
+        elapsed = time.perf_counter() - start
+        memory_after = process_memory(server_pid)
+
+    ok = [sample for sample in samples if sample["status"] == 200]
+    latencies = [sample["latency"] for sample in ok]
+    ttfbs = [sample["ttfb"] for sample in ok]
+    errors: Dict[str, int] = {}
+    for sample in samples:
+        if sample["status"] != 200:
+            errors[str(sample["status"])] = errors.get(str(sample["status"]), 0) + 1
+
+    def ms(value: Optional[float]) -> Optional[float]:
+        return round(value * 1000, 2) if value is not None else None
+
+    return {
+        "endpoint": endpoint,
+        "model": model,
+        "concurrency": concurrency,
+        "cache_state": cache_state,
+        "stream": stream,
+        "requests": len(samples),
+        "ok": len(ok),
+        "errors": errors,
+        "duration_s": round(elapsed, 3),
+        "throughput_rps": round(len(ok) / elapsed, 2) if elapsed else None,
+        "latency_ms": {
+            "p50": ms(percentile(latencies, 0.50)),
+            "p95": ms(percentile(latencies, 0.95)),
+            "p99": ms(percentile(latencies, 0.99)),
+            "max": ms(max(latencies) if latencies else None),
+        },
+        "ttfb_ms": {
+            "p50": ms(percentile(ttfbs, 0.50)),
+            "p95": ms(percentile(ttfbs, 0.95)),
+            "p99": ms(percentile(ttfbs, 0.99)),
+        },
+        "memory": {
+            "rss_before_mib": memory_before["rss_mib"],
+            "rss_after_mib": memory_after["rss_mib"],
+            "peak_rss_mib": memory_after["peak_rss_mib"],
+        },
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--base-url", required=True)
+    parser.add_argument("--endpoint", choices=CHAT_ENDPOINTS, required=True)
+    parser.add_argument("--concurrency", type=int, default=8)
+    parser.add_argument("--requests", type=int, default=100)
+    parser.add_argument("--cache-state", choices=("cold", "warm"), default="cold")
+    parser.add_argument("--stream", action="store_true")
+    parser.add_argument("--model")
+    parser.add_argument("--server-pid", type=int, help="Local server PID to sample memory from")
+    args = parser.parse_args()
+    result = asyncio.run(run_load(
+        args.base_url, args.endpoint, args.concurrency, args.requests,
+        cache_state=args.cache_state, stream=args.stream, model=args.model, server_pid=args.server_pid,
+    ))
+    print(json.dumps(result, indent=2))
+
+
+if __name__ == "__main__":
+    main()
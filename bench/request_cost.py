@@ -0,0 +1,128 @@
+"""Per-request CPU time and allocations of the non-streaming /api/ppxty paths.
+
+    python -m bench.request_cost --requests 300 --words 400 --turns 8
+
+Starts a Perplexity stub, runs the app in this process over ASGI and sends the
+same request through the pass-through fast path (PPXTY_PASSTHROUGH) and through
+the OpenAI SDK path. CPU time is process time spent in the app and its HTTP
+client (the stub runs in another process); allocations are the tracemalloc peak
+and the number of blocks allocated while serving one request.
+"""
+import argparse
+import asyncio
+import json
+import os
+import statistics
+import subprocess
+import sys
+import time
+import tracemalloc
+from typing import Dict, List
+
+import httpx
+
+from bench.loadgen import percentile
+from bench.run import ROOT, free_port, stop, wait_until_ready
+
+
+def build_payload(turns: int) -> Dict:
+    messages = [{"role": "system", "content": "You are an insurance assistant for Hong Kong customers."}]
+    for turn in range(turns):
+        messages.append({"role": "user", "content": f"Question {turn}: compare AIA and Manulife critical illness plans, 危疾保障"})
+        messages.append({"role": "assistant", "content": "An earlier answer about premiums and coverage. " * 20})
+    messages.append({"role": "user", "content": "Which plan covers early stage cancer?"})
+    return {"model": "r1-1776", "messages": messages}
+
+
+async def measure(main, client: httpx.AsyncClient, payload: Dict, requests: int, passthrough: bool) -> Dict:
+    main.PPXTY_PASSTHROUGH = passthrough
+    body = json.dumps(payload).encode("utf-8")
+    headers = {"Content-Type": "application/json", "Accept-Encoding": "gzip"}
+    for _ in range(10):
+        (await client.post("/api/ppxty", content=body, headers=headers)).raise_for_status()
+
+    cpu: List[float] = []
+    for _ in range(requests):
+        start = time.process_time()
+        response = await client.post("/api/ppxty", content=body, headers=headers)
+        cpu.append(time.process_time() - start)
+        response.raise_for_status()
+
+    peaks: List[int] = []
+    blocks: List[int] = []
+    tracemalloc.start()
+    for _ in range(max(requests // 5, 20)):
+        tracemalloc.reset_peak()
+        before_size, _ = tracemalloc.get_traced_memory()
+        before = tracemalloc.take_snapshot()
+        response = await client.post("/api/ppxty", content=body, headers=headers)
+        after = tracemalloc.take_snapshot()
+        _, peak = tracemalloc.get_traced_memory()
+        response.raise_for_status()
+        peaks.append(peak - before_size)
+        blocks.append(sum(max(stat.count_diff, 0) for stat in after.compare_to(before, "lineno")))
+    tracemalloc.stop()
+
+    return {
+        "path": "passthrough" if passthrough else "sdk",
+        "response_bytes": len(response.content),
+        "cpu_ms_mean": round(statistics.mean(cpu) * 1000, 3),
+        "cpu_ms_p50": round(percentile(cpu, 0.50) * 1000, 3),
+        "cpu_ms_p95": round(percentile(cpu, 0.95) * 1000, 3),
+        "alloc_peak_kib_mean": round(statistics.mean(peaks) / 1024, 1),
+        "alloc_blocks_retained_mean": round(statistics.mean(blocks), 1),
+    }
+
+
+async def run(args, stub_url: str) -> List[Dict]:
+    os.environ.update({
+        "PERPLEXITY_BASE_URL": stub_url,
+        "DEEPSEEK_API_KEY": "bench",
+        "COMPLETION_CACHE_ENABLED": "false",
+        "RESPONSE_COMPRESSION": "true" if args.compress else "false",
+        "LOG_PAYLOADS": "false",
+    })
+    sys.path.insert(0, ROOT)
+    import main
+
+    await main.app.router.startup()
+    try:
+        transport = httpx.ASGITransport(app=main.app)
+        async with httpx.AsyncClient(transport=transport, base_url="http://app") as client:
+            payload = build_payload(args.turns)
+            return [await measure(main, client, payload, args.requests, passthrough) for passthrough in (False, True)]
+    finally:
+        await main.app.router.shutdown()
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--requests", type=int, default=300)
+    parser.add_argument("--words", type=int, default=400, help="Words in each stub completion")
+    parser.add_argument("--turns", type=int, default=8, help="Earlier conversation turns sent with each request")
+    parser.add_argument("--compress", action="store_true", help="Enable RESPONSE_COMPRESSION for the fast path")
+    parser.add_argument("--output", help="Write the results as JSON to this path")
+    args = parser.parse_args()
+
+    port = free_port()
+    stub = subprocess.Popen(
+        [sys.executable, "-m", "bench.stubs", "--kind", "perplexity", "--port", str(port),
+         "--latency", "fixed:0", "--stream-chunks", str(args.words)],
+        cwd=ROOT,
+    )
+    try:
+        stub_url = f"http://127.0.0.1:{port}"
+        wait_until_ready(f"{stub_url}/stub/stats")
+        results = asyncio.run(run(args, stub_url))
+    finally:
+        stop(stub)
+
+    for result in results:
+        print(json.dumps(result))
+    if args.output:
+        with open(args.output, "w") as f:
+            json.dump(results, f, indent=2)
+
+
+if __name__ == "__main__":
+    main()
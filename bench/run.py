@@ -0,0 +1,173 @@
+"""Offline benchmark: start upstream stubs and the app, run a load matrix, write JSON.
+
+    python -m bench.run --output bench/results/$(git rev-parse --short HEAD).json
+    python -m bench.compare bench/results/base.json bench/results/head.json
+
+The app is started with its upstream base URLs pointed at local stubs, so no
+SerpAPI, Google, Perplexity or DeepSeek quota is used.
+"""
+import argparse
+import asyncio
+import json
+import os
+import platform
+import socket
+import subprocess
+import sys
+import time
+from datetime import datetime, timezone
+from typing import Dict, List
+
+import httpx
+
+from bench.loadgen import CHAT_ENDPOINTS, run_load
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+
+def free_port() -> int:
+    with socket.socket() as sock:
+        sock.bind(("127.0.0.1", 0))
+        return sock.getsockname()[1]
+
+
+def wait_until_ready(url: str, timeout: float = 30.0):
+    deadline = time.monotonic() + timeout
+    while time.monotonic() < deadline:
+        try:
+            if httpx.get(url, timeout=1.0).status_code < 500:
+                return
+        except httpx.HTTPError:
+            pass
+        time.sleep(0.2)
+    raise RuntimeError(f"{url} did not become ready within {timeout}s")
+
+
+def git_commit() -> str:
+    try:
+        return subprocess.check_output(["git", "rev-parse", "HEAD"], cwd=ROOT, text=True).strip()
+    except (OSError, subprocess.CalledProcessError):
+        return "unknown"
+
+
+def start_stubs(args) -> Dict[str, Dict]:
+    stubs = {}
+    profiles = {
+        "serpapi": args.search_latency,
+        "google": args.search_latency,
+        "perplexity": args.llm_latency,
+        "deepseek": args.llm_latency,
+    }
+    for kind, latency in profiles.items():
+        port = free_port()
+        command = [
+            sys.executable, "-m", "bench.stubs", "--kind", kind, "--port", str(port),
+            "--latency", latency, "--error-rate", str(args.error_rate),
+            "--stream-chunks", str(args.stream_chunks), "--chunk-delay", args.chunk_delay,
+        ]
+        process = subprocess.Popen(command, cwd=ROOT)
+        stubs[kind] = {"process": process, "url": f"http://127.0.0.1:{port}"}
+    for stub in stubs.values():
+        wait_until_ready(f"{stub['url']}/stub/stats")
+    return stubs
+
+
+def start_app(args, stubs: Dict[str, Dict], extra_env: Dict[str, str]):
+    port = free_port()
+    env = dict(os.environ)
+    env.update({
+        "SERPAPI_BASE_URL": stubs["serpapi"]["url"],
+        "GOOGLE_CSE_BASE_URL": stubs["google"]["url"],
+        "PERPLEXITY_BASE_URL": stubs["perplexity"]["url"],
+        "DEEPSEEK_BASE_URL": stubs["deepseek"]["url"],
+        "SERPAPI_API_KEY": "bench",
+        "DEEPSEEK_API_KEY": "bench",
+        "GOOGLE_API_KEY": "bench",
+        "GOOGLE_CX": "bench",
+    })
+    env.update(extra_env)
+    if args.server == "hypercorn":
+        command = [sys.executable, "-m", "hypercorn", "main:app", "--bind", f"127.0.0.1:{port}"]
+    else:
+        command = [sys.executable, "-m", "uvicorn", "main:app", "--port", str(port), "--log-level", "warning"]
+    process = subprocess.Popen(command, cwd=ROOT, env=env, stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL)
+    base_url = f"http://127.0.0.1:{port}"
+    wait_until_ready(f"{base_url}/api/pool-stats")
+    return process, base_url
+
+
+def stop(process: subprocess.Popen):
+    process.terminate()
+    try:
+        process.wait(timeout=10)
+    except subprocess.TimeoutExpired:
+        process.kill()
+
+
+def parse_env(pairs: List[str]) -> Dict[str, str]:
+    env = {}
+    for pair in pairs:
+        key, _, value = pair.partition("=")
+        env[key] = value
+    return env
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--endpoints", nargs="+", default=list(CHAT_ENDPOINTS))
+    parser.add_argument("--concurrency", nargs="+", type=int, default=[1, 8, 32])
+    parser.add_argument("--cache-states", nargs="+", choices=("cold", "warm"), default=["cold", "warm"])
+    parser.add_argument("--stream", action="store_true", help="Benchmark the SSE streaming mode")
+    parser.add_argument("--requests", type=int, default=200, help="Requests per matrix cell")
+    parser.add_argument("--search-latency", default="lognormal:0.05,0.3")
+    parser.add_argument("--llm-latency", default="lognormal:0.2,0.3")
+    parser.add_argument("--chunk-delay", default="fixed:0.002")
+    parser.add_argument("--stream-chunks", type=int, default=40)
+    parser.add_argument("--error-rate", type=float, default=0.0)
+    parser.add_argument("--server", choices=("hypercorn", "uvicorn"), default="hypercorn")
+    parser.add_argument("--app-env", nargs="*", default=["COMPLETION_CACHE_ENABLED=1"],
+                        help="Extra KEY=VALUE settings for the app under test")
+    parser.add_argument("--output", default=os.path.join(ROOT, "bench", "results", "latest.json"))
+    args = parser.parse_args()
+
+    stubs = start_stubs(args)
+    try:
+        app_process, base_url = start_app(args, stubs, parse_env(args.app_env))
+        try:
+            results = []
+            for endpoint in args.endpoints:
+                for cache_state in args.cache_states:
+                    for concurrency in args.concurrency:
+                        result = asyncio.run(run_load(
+                            base_url, endpoint, concurrency, args.requests,
+                            cache_state=cache_state, stream=args.stream, server_pid=app_process.pid,
+                        ))
+                        results.append(result)
+                        print(
+                            f"{endpoint:<18} {cache_state:<5} c={concurrency:<3} "
+                            f"{result['throughput_rps']} req/s  p50={result['latency_ms']['p50']}ms  "
+                            f"p95={result['latency_ms']['p95']}ms  p99={result['latency_ms']['p99']}ms  "
+                            f"errors={result['errors']}"
+                        )
+        finally:
+            stop(app_process)
+    finally:
+        for stub in stubs.values():
+            stop(stub["process"])
+
+    report = {
+        "commit": git_commit(),
+        "created_at": datetime.now(timezone.utc).isoformat(),
+        "python": platform.python_version(),
+        "platform": platform.platform(),
+        "config": {key: value for key, value in vars(args).items() if key != "output"},
+        "results": results,
+    }
+    os.makedirs(os.path.dirname(os.path.abspath(args.output)), exist_ok=True)
+    with open(args.output, "w") as output:
+        json.dump(report, output, indent=2)
+    print(f"Wrote {args.output}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,212 @@
+"""Local stand-ins for SerpAPI, Google Custom Search and the OpenAI-compatible chat APIs.
+
+Each stub serves one upstream with a configurable latency distribution, error rate
+and streaming behaviour, so the app can be benchmarked without spending quota:
+
+    python -m bench.stubs --kind serpapi --port 9101 --latency lognormal:0.6,0.3
+    python -m bench.stubs --kind deepseek --port 9103 --latency uniform:0.2,0.8 --error-rate 0.02
+"""
+import argparse
+import asyncio
+import json
+import math
+import random
+import time
+from dataclasses import dataclass
+from typing import Callable
+
+from fastapi import FastAPI, Request
+from fastapi.responses import JSONResponse, StreamingResponse
+
+KINDS = ("serpapi", "google", "perplexity", "deepseek")
+
+
+# Parse "fixed:S", "uniform:LOW,HIGH" or "lognormal:MEDIAN,SIGMA" (seconds) into a sampler
+def parse_latency(spec: str) -> Callable[[], float]:
+    kind, _, args = spec.partition(":")
+    values = [float(value) for value in args.split(",") if value]
+    if kind == "fixed":
+        return lambda: values[0]
+    if kind == "uniform":
+        return lambda: random.uniform(values[0], values[1])
+    if kind == "lognormal":
+        mu = math.log(values[0])
+        return lambda: random.lognormvariate(mu, values[1])
+    raise ValueError(f"Unknown latency distribution: {spec}")
+
+
+@dataclass
+class StubProfile:
+    kind: str
+    latency: Callable[[], float]
+    error_rate: float = 0.0
+    error_status: int = 503
+    stream_chunks: int = 40
+    chunk_delay: Callable[[], float] = lambda: 0.01
+    reasoning_chunks: int = 20
+    results: int = 5
+
+
+def _search_items(query: str, count: int):
+    # Deterministic per query so repeated searches return identical context
+    seed = abs(hash(query)) % 10000
+    return [
+        {
+            "title": f"Result {seed}-{index} for {query[:40]}",
+            "snippet": f"Stub snippet {index} describing critical illness cover, premiums and benefits.",
+            "link": f"https://www.aia.com.hk/stub/{seed}/{index}",
+        }
+        for index in range(count)
+    ]
+
+
+def _completion_chunk(model: str, delta: dict, finish_reason=None) -> str:
+    chunk = {
+        "id": "chatcmpl-stub",
+        "object": "chat.completion.chunk",
+        "created": int(time.time()),
+        "model": model,
+        "choices": [{"index": 0, "delta": delta, "finish_reason": finish_reason}],
+    }
+    return f"data: {json.dumps(chunk)}\n\n"
+
+
+# DeepSeek-style usage with a crude prefix cache: leading messages already seen,
+# in the same order, in an earlier request count as cache-hit tokens
+def _usage(prefixes: set, messages: list, completion_tokens: int, kind: str) -> dict:
+    prompt_tokens = 0
+    hit_tokens = 0
+    prefix_key = None
+    for message in messages:
+        content = str(message.get("content", ""))
+        # Each key covers the message and everything before it
+        prefix_key = hash((prefix_key, message.get("role"), content))
+        if prefix_key in prefixes:
+            hit_tokens += len(content) // 4
+        prompt_tokens += len(content) // 4
+        prefixes.add(prefix_key)
+    usage = {
+        "prompt_tokens": prompt_tokens,
+        "completion_tokens": completion_tokens,
+        "total_tokens": prompt_tokens + completion_tokens,
+    }
+    if kind == "deepseek":
+        usage["prompt_cache_hit_tokens"] = hit_tokens
+        usage["prompt_cache_miss_tokens"] = prompt_tokens - hit_tokens
+    return usage
+
+
+def _usage_chunk(model: str, usage: dict) -> str:
+    chunk = {"id": "chatcmpl-stub", "object": "chat.completion.chunk", "created": int(time.time()),
+             "model": model, "choices": [], "usage": usage}
+    return f"data: {json.dumps(chunk)}\n\n"
+
+
+def create_stub_app(profile: StubProfile) -> FastAPI:
+    app = FastAPI()
+    app.state.calls = 0
+    app.state.prefixes = set()
+
+    async def maybe_fail():
+        app.state.calls += 1
+        await asyncio.sleep(profile.latency())
+        if random.random() < profile.error_rate:
+            return JSONResponse({"error": {"message": "stub failure"}}, status_code=profile.error_status)
+        return None
+
+    @app.get("/stub/stats")
+    async def stats():
+        return {"kind": profile.kind, "calls": app.state.calls}
+
+    if profile.kind == "serpapi":
+        @app.get("/search")
+        async def serpapi(q: str = ""):
+            failure = await maybe_fail()
+            if failure:
+                return failure
+            return {"organic_results": _search_items(q, profile.results)}
+
+    if profile.kind == "google":
+        @app.get("/customsearch/v1")
+        async def google(q: str = ""):
+            failure = await maybe_fail()
+            if failure:
+                return failure
+            return {"items": _search_items(q, profile.results)}
+
+    if profile.kind in ("perplexity", "deepseek"):
+        @app.post("/chat/completions")
+        async def chat(request: Request):
+            body = await request.json()
+            failure = await maybe_fail()
+            if failure:
+                return failure
+            model = body.get("model", "stub")
+            words = [f"word{index} " for index in range(profile.stream_chunks)]
+            reasoning = "reasoner" in model or model == "r1-1776"
+            if not body.get("stream"):
+                content = "".join(words)
+                if reasoning and profile.kind == "perplexity":
+                    content = "<think>stub reasoning</think>" + content
+                completion = {
+                    "id": "chatcmpl-stub",
+                    "object": "chat.completion",
+                    "created": int(time.time()),
+                    "model": model,
+                    "choices": [{"index": 0, "message": {"role": "assistant", "content": content}, "finish_reason": "stop"}],
+                    "usage": _usage(app.state.prefixes, body.get("messages", []), len(words), profile.kind),
+                }
+                if profile.kind == "perplexity":
+                    completion["citations"] = [item["link"] for item in _search_items(model, profile.results)]
+                return completion
+
+            async def stream():
+                if reasoning and profile.kind == "deepseek":
+                    for index in range(profile.reasoning_chunks):
+                        yield _completion_chunk(model, {"reasoning_content": f"thought{index} "})
+                        await asyncio.sleep(profile.chunk_delay())
+                elif reasoning:
+                    yield _completion_chunk(model, {"content": "<thi"})
+                    yield _completion_chunk(model, {"content": "nk>stub reasoning</th"})
+                    yield _completion_chunk(model, {"content": "ink>"})
+                for word in words:
+                    yield _completion_chunk(model, {"content": word})
+                    await asyncio.sleep(profile.chunk_delay())
+                yield _completion_chunk(model, {}, finish_reason="stop")
+                yield _usage_chunk(model, _usage(app.state.prefixes, body.get("messages", []), len(words), profile.kind))
+                yield "data: [DONE]\n\n"
+
+            return StreamingResponse(stream(), media_type="text/event-stream")
+
+    return app
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--kind", choices=KINDS, required=True)
+    parser.add_argument("--host", default="127.0.0.1")
+    parser.add_argument("--port", type=int, required=True)
+    parser.add_argument("--latency", default="fixed:0.05", help="Response latency distribution")
+    parser.add_argument("--error-rate", type=float, default=0.0)
+    parser.add_argument("--error-status", type=int, default=503)
+    parser.add_argument("--stream-chunks", type=int, default=40)
+    parser.add_argument("--chunk-delay", default="fixed:0.01", help="Delay between streamed chunks")
+    parser.add_argument("--reasoning-chunks", type=int, default=20)
+    args = parser.parse_args()
+
+    import uvicorn
+
+    profile = StubProfile(
+        kind=args.kind,
+        latency=parse_latency(args.latency),
+        error_rate=args.error_rate,
+        error_status=args.error_status,
+        stream_chunks=args.stream_chunks,
+        chunk_delay=parse_latency(args.chunk_delay),
+        reasoning_chunks=args.reasoning_chunks,
+    )
+    uvicorn.run(create_stub_app(profile), host=args.host, port=args.port, log_level="warning")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,202 @@
+import asyncio
+import json
+import math
+import os
+import time
+from collections import deque
+from contextlib import asynccontextmanager
+from typing import AsyncIterator, Dict
+
+from fastapi import HTTPException
+
+from config import env_float, env_int
+
+# Default concurrency limits; the reasoners are slow and expensive so they get a small share
+DEFAULT_MODEL_LIMITS = {
+    "deepseek-reasoner": 8,
+    "r1-1776": 8,
+}
+DEFAULT_UPSTREAM_LIMITS = {
+    "deepseek": 48,
+    "perplexity": 16,
+    "grok": 16,
+    "serpapi": 16,
+    "google": 16,
+}
+
+
+# Raised when a bulkhead refuses admission; FastAPI turns it into the HTTP response
+class BulkheadRejected(HTTPException):
+    def __init__(self, status_code: int, detail: str, retry_after: int):
+        super().__init__(status_code=status_code, detail=detail, headers={"Retry-After": str(retry_after)})
+
+
+# Concurrency limit with a bounded FIFO admission queue.
+# Up to `limit` callers run at once; up to `max_queue` more wait at most `max_wait`
+# seconds. A full queue is rejected at once with 429, a wait that runs out with 503.
+# A limit of 0 means unlimited and only counts active callers.
+class Bulkhead:
+    def __init__(self, name: str, limit: int, max_queue: int, max_wait: float):
+        self.name = name
+        self.limit = limit
+        self.max_queue = max_queue
+        self.max_wait = max_wait
+        self._semaphore = asyncio.Semaphore(limit) if limit > 0 else None
+        self.active = 0
+        self.queued = 0
+        self.admitted = 0
+        self.rejected_queue_full = 0
+        self.rejected_timeout = 0
+        self.wait_times = deque(maxlen=500)
+        self.hold_times = deque(maxlen=500)
+
+    def retry_after(self) -> int:
+        # Rough time until a queued caller would be admitted, from recent hold times
+        if not self.hold_times or not self.limit:
+            return 1
+        mean_hold = sum(self.hold_times) / len(self.hold_times)
+        return max(1, math.ceil(mean_hold * (self.queued + 1) / self.limit))
+
+    async def acquire(self):
+        if self._semaphore is not None and not self._semaphore.locked():
+            # Free capacity: Semaphore.acquire returns without suspending
+            await self._semaphore.acquire()
+            self.wait_times.append(0.0)
+        elif self._semaphore is not None:
+            if self.queued >= self.max_queue:
+                self.rejected_queue_full += 1
+                raise BulkheadRejected(429, f"Too many concurrent requests for {self.name}", self.retry_after())
+            self.queued += 1
+            start = time.perf_counter()
+            try:
+                await asyncio.wait_for(self._semaphore.acquire(), timeout=self.max_wait)
+            except asyncio.TimeoutError:
+                self.rejected_timeout += 1
+                raise BulkheadRejected(503, f"Timed out waiting for capacity on {self.name}", self.retry_after())
+            finally:
+                self.queued -= 1
+                self.wait_times.append(time.perf_counter() - start)
+        self.active += 1
+        self.admitted += 1
+        return time.perf_counter()
+
+    def release(self, acquired_at: float):
+        self.active -= 1
+        self.hold_times.append(time.perf_counter() - acquired_at)
+        if self._semaphore is not None:
+            self._semaphore.release()
+
+    @asynccontextmanager
+    async def slot(self) -> AsyncIterator[None]:
+        acquired_at = await self.acquire()
+        try:
+            yield
+        finally:
+            self.release(acquired_at)
+
+    def stats(self) -> Dict:
+        waits = sorted(self.wait_times)
+        p95 = waits[min(int(len(waits) * 0.95), len(waits) - 1)] if waits else None
+        return {
+            "limit": self.limit or None,
+            "active": self.active,
+            "queued": self.queued,
+            "max_queue": self.max_queue,
+            "admitted": self.admitted,
+            "rejected_queue_full": self.rejected_queue_full,
+            "rejected_timeout": self.rejected_timeout,
+            "wait_mean_ms": round(sum(waits) / len(waits) * 1000, 1) if waits else None,
+            "wait_p95_ms": round(p95 * 1000, 1) if p95 is not None else None,
+        }
+
+
+# Per-model and per-upstream bulkheads, created on first use.
+# MODEL_CONCURRENCY_LIMITS and UPSTREAM_CONCURRENCY_LIMITS take JSON objects of
+# name -> limit; names not listed use MODEL_CONCURRENCY_DEFAULT / UPSTREAM_CONCURRENCY_DEFAULT.
+class BulkheadRegistry:
+    def __init__(
+        self,
+        model_limits: Dict[str, int],
+        upstream_limits: Dict[str, int],
+        default_model_limit: int,
+        default_upstream_limit: int,
+        queue_factor: float,
+        max_wait: float,
+    ):
+        self.model_limits = model_limits
+        self.upstream_limits = upstream_limits
+        self.default_model_limit = default_model_limit
+        self.default_upstream_limit = default_upstream_limit
+        self.queue_factor = queue_factor
+        self.max_wait = max_wait
+        self.models: Dict[str, Bulkhead] = {}
+        self.upstreams: Dict[str, Bulkhead] = {}
+
+    def _get(self, pool: Dict[str, Bulkhead], kind: str, name: str, limit: int) -> Bulkhead:
+        if name not in pool:
+            max_queue = max(1, int(limit * self.queue_factor)) if limit > 0 else 0
+            pool[name] = Bulkhead(f"{kind} {name}", limit, max_queue, self.max_wait)
+        return pool[name]
+
+    def model(self, name: str) -> Bulkhead:
+        return self._get(self.models, "model", name, self.model_limits.get(name, self.default_model_limit))
+
+    def upstream(self, name: str) -> Bulkhead:
+        return self._get(self.upstreams, "upstream", name, self.upstream_limits.get(name, self.default_upstream_limit))
+
+    def stats(self) -> Dict:
+        return {
+            "models": {name: bulkhead.stats() for name, bulkhead in self.models.items()},
+            "upstreams": {name: bulkhead.stats() for name, bulkhead in self.upstreams.items()},
+        }
+
+
+def _limits_from_env(name: str, defaults: Dict[str, int]) -> Dict[str, int]:
+    limits = dict(defaults)
+    if os.getenv(name):
+        limits.update({key: int(value) for key, value in json.loads(os.getenv(name)).items()})
+    return limits
+
+
+def registry_from_env() -> BulkheadRegistry:
+    return BulkheadRegistry(
+        model_limits=_limits_from_env("MODEL_CONCURRENCY_LIMITS", DEFAULT_MODEL_LIMITS),
+        upstream_limits=_limits_from_env("UPSTREAM_CONCURRENCY_LIMITS", DEFAULT_UPSTREAM_LIMITS),
+        default_model_limit=env_int("MODEL_CONCURRENCY_DEFAULT", 32),
+        default_upstream_limit=env_int("UPSTREAM_CONCURRENCY_DEFAULT", 32),
+        queue_factor=env_float("BULKHEAD_QUEUE_FACTOR", 2.0),
+        max_wait=env_float("BULKHEAD_MAX_WAIT", 10.0),
+    )
+
+
+bulkheads = registry_from_env()
+
+
+# Bulkhead slot held by a streamed response until it has been fully sent.
+# close() releases the slot once and closes the upstream stream, which cancels
+# the upstream call right away. relay() calls it when the body ends; the response
+# calls it again once it is over, for a client that went away before the body
+# started (the body generator then never runs, and neither does its `finally`).
+class StreamSlot:
+    def __init__(self, bulkhead: Bulkhead, acquired_at: float, upstream):
+        self.bulkhead = bulkhead
+        self.acquired_at = acquired_at
+        self.upstream = upstream
+        self.released = False
+
+    async def relay(self, stream: AsyncIterator[str]) -> AsyncIterator[str]:
+        try:
+            async for chunk in stream:
+                yield chunk
+        finally:
+            try:
+                await stream.aclose()
+            finally:
+                await self.close()
+
+    async def close(self):
+        if self.released:
+            return
+        self.released = True
+        self.bulkhead.release(self.acquired_at)
+        await self.upstream.close()
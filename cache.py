@@ -0,0 +1,134 @@
+import os
+import re
+import time
+import unicodedata
+from collections import OrderedDict
+from typing import Any, Callable, Dict, Hashable, Optional, Tuple
+
+from config import env_float, env_int
+
+_WHITESPACE = re.compile(r"\s+")
+
+
+# Normalize a search query so trivially different phrasings share a cache key.
+# NFKC folds full-width letters, digits and punctuation to half-width, casefold
+# handles case, and punctuation (ASCII and CJK alike) is treated as whitespace.
+def normalize_query(query: str) -> str:
+    text = unicodedata.normalize("NFKC", query).casefold()
+    text = "".join(" " if unicodedata.category(ch).startswith("P") else ch for ch in text)
+    return _WHITESPACE.sub(" ", text).strip()
+
+
+def _default_sizeof(value: Any) -> int:
+    if isinstance(value, str):
+        return len(value.encode("utf-8"))
+    if isinstance(value, (bytes, bytearray)):
+        return len(value)
+    return len(repr(value).encode("utf-8"))
+
+
+# Bounded LRU cache with per-entry TTL and a total byte budget.
+# OrderedDict keeps recency order, so lookups, inserts and evictions are O(1).
+class TTLCache:
+    def __init__(
+        self,
+        max_entries: int = 1000,
+        max_bytes: int = 8 * 1024 * 1024,
+        ttl: float = 300.0,
+        sizeof: Callable[[Any], int] = _default_sizeof,
+        clock: Callable[[], float] = time.monotonic,
+    ):
+        self.max_entries = max_entries
+        self.max_bytes = max_bytes
+        self.ttl = ttl
+        self.sizeof = sizeof
+        self.clock = clock
+        self._entries: "OrderedDict[Hashable, Tuple[float, Any, int]]" = OrderedDict()
+        self.total_bytes = 0
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self.expirations = 0
+
+    def __len__(self) -> int:
+        return len(self._entries)
+
+    def __contains__(self, key: Hashable) -> bool:
+        entry = self._entries.get(key)
+        return entry is not None and entry[0] > self.clock()
+
+    def _remove(self, key: Hashable):
+        _, _, size = self._entries.pop(key)
+        self.total_bytes -= size
+
+    def get(self, key: Hashable, default: Optional[Any] = None, record_stats: bool = True) -> Optional[Any]:
+        entry = self._entries.get(key)
+        if entry is None:
+            self.misses += record_stats
+            return default
+        expires_at, value, _ = entry
+        if expires_at <= self.clock():
+            self._remove(key)
+            self.expirations += 1
+            self.misses += record_stats
+            return default
+        self._entries.move_to_end(key)
+        self.hits += record_stats
+        return value
+
+    def set(self, key: Hashable, value: Any, ttl: Optional[float] = None):
+        size = self.sizeof(value)
+        if key in self._entries:
+            self._remove(key)
+        if size > self.max_bytes:
+            # A single value larger than the whole budget is never cached
+            return
+        expires_at = self.clock() + (self.ttl if ttl is None else ttl)
+        self._entries[key] = (expires_at, value, size)
+        self.total_bytes += size
+        while len(self._entries) > self.max_entries or self.total_bytes > self.max_bytes:
+            oldest = next(iter(self._entries))
+            self._remove(oldest)
+            self.evictions += 1
+
+    def delete(self, key: Hashable):
+        if key in self._entries:
+            self._remove(key)
+
+    def clear(self):
+        self._entries.clear()
+        self.total_bytes = 0
+
+    def stats(self) -> Dict:
+        lookups = self.hits + self.misses
+        return {
+            "backend": "memory",
+            "entries": len(self._entries),
+            "bytes": self.total_bytes,
+            "max_entries": self.max_entries,
+            "max_bytes": self.max_bytes,
+            "ttl_seconds": self.ttl,
+            "hits": self.hits,
+            "misses": self.misses,
+            "hit_rate": round(self.hits / lookups, 4) if lookups else 0.0,
+            "evictions": self.evictions,
+            "expirations": self.expirations,
+        }
+
+
+# Build a cache from <PREFIX>_* environment variables.
+# <PREFIX>_BACKEND selects "memory" (per process) or "sqlite" (shared by all
+# workers on the host and kept across restarts, stored at <PREFIX>_PATH).
+def cache_from_env(prefix: str, max_entries: int, max_bytes: int, ttl: float):
+    max_entries = env_int(f"{prefix}_MAX_ENTRIES", max_entries)
+    max_bytes = env_int(f"{prefix}_MAX_BYTES", max_bytes)
+    ttl = env_float(f"{prefix}_TTL", ttl)
+    backend = os.getenv(f"{prefix}_BACKEND", "memory").strip().lower()
+    if backend == "sqlite":
+        from sqlite_cache import SQLiteCache
+
+        path = os.getenv(f"{prefix}_PATH", f"{prefix.lower()}.sqlite3")
+        return SQLiteCache(path, max_entries=max_entries, max_bytes=max_bytes, ttl=ttl)
+    if backend != "memory":
+        raise ValueError(f"Unknown {prefix}_BACKEND: {backend}")
+    return TTLCache(max_entries=max_entries, max_bytes=max_bytes, ttl=ttl)
@@ -0,0 +1,223 @@
+import os
+import logging
+from dataclasses import dataclass
+from typing import TYPE_CHECKING, Dict, Optional
+
+import httpx
+
+from config import env_bool, env_float, env_int
+from metrics import UPSTREAM_ERRORS
+from resilience import CircuitBreaker, ResilientTransport
+
+# The OpenAI SDK is imported on first use, see STARTUP_MODE in startup.py
+if TYPE_CHECKING:
+    from openai import AsyncOpenAI
+
+logger = logging.getLogger(__name__)
+
+# Backoff between retries of any upstream: full jitter up to base * 2^retry, capped
+RETRY_BASE_DELAY = env_float("UPSTREAM_RETRY_BASE_DELAY", 0.2)
+RETRY_MAX_DELAY = env_float("UPSTREAM_RETRY_MAX_DELAY", 2.0)
+
+
+# Connection pool, timeout, retry and circuit breaker settings for one upstream
+@dataclass
+class UpstreamConfig:
+    name: str
+    base_url: str
+    max_connections: int = 20
+    max_keepalive_connections: int = 10
+    keepalive_expiry: float = 30.0
+    http2: bool = False
+    connect_timeout: float = 5.0
+    read_timeout: float = 30.0
+    write_timeout: float = 10.0
+    pool_timeout: float = 5.0
+    max_retries: int = 2
+    retry_budget: float = 10.0
+    breaker_threshold: int = 5
+    breaker_cooldown: float = 30.0
+
+    @classmethod
+    def from_env(cls, name: str, prefix: str, base_url: str, read_timeout: float, max_retries: int = 2,
+                 retry_budget: float = 10.0, breaker_threshold: int = 5) -> "UpstreamConfig":
+        """Build a config from <PREFIX>_* environment variables, e.g. DEEPSEEK_MAX_CONNECTIONS"""
+        return cls(
+            name=name,
+            base_url=os.getenv(f"{prefix}_BASE_URL", base_url),
+            max_connections=env_int(f"{prefix}_MAX_CONNECTIONS", 20),
+            max_keepalive_connections=env_int(f"{prefix}_MAX_KEEPALIVE", 10),
+            keepalive_expiry=env_float(f"{prefix}_KEEPALIVE_EXPIRY", 30.0),
+            http2=env_bool(f"{prefix}_HTTP2", False),
+            connect_timeout=env_float(f"{prefix}_CONNECT_TIMEOUT", 5.0),
+            read_timeout=env_float(f"{prefix}_READ_TIMEOUT", read_timeout),
+            write_timeout=env_float(f"{prefix}_WRITE_TIMEOUT", 10.0),
+            pool_timeout=env_float(f"{prefix}_POOL_TIMEOUT", 5.0),
+            max_retries=env_int(f"{prefix}_MAX_RETRIES", max_retries),
+            retry_budget=env_float(f"{prefix}_RETRY_BUDGET", retry_budget),
+            breaker_threshold=env_int(f"{prefix}_BREAKER_THRESHOLD", breaker_threshold),
+            breaker_cooldown=env_float(f"{prefix}_BREAKER_COOLDOWN", 30.0),
+        )
+
+    @property
+    def timeout(self) -> httpx.Timeout:
+        return httpx.Timeout(
+            connect=self.connect_timeout,
+            read=self.read_timeout,
+            write=self.write_timeout,
+            pool=self.pool_timeout,
+        )
+
+    @property
+    def limits(self) -> httpx.Limits:
+        return httpx.Limits(
+            max_connections=self.max_connections,
+            max_keepalive_connections=self.max_keepalive_connections,
+            keepalive_expiry=self.keepalive_expiry,
+        )
+
+
+# Default upstreams; the env prefix and read timeout differ per provider.
+# Search gets a short retry budget since a second provider can answer instead.
+UPSTREAM_CONFIGS = {
+    "serpapi": UpstreamConfig.from_env("serpapi", "SERPAPI", "https://serpapi.com", 15.0, retry_budget=5.0),
+    "google": UpstreamConfig.from_env("google", "GOOGLE_CSE", "https://www.googleapis.com", 15.0, retry_budget=5.0),
+    "perplexity": UpstreamConfig.from_env("perplexity", "PERPLEXITY", "https://api.perplexity.ai", 30.0),
+    "deepseek": UpstreamConfig.from_env("deepseek", "DEEPSEEK", "https://api.deepseek.com", 300.0),
+    "grok": UpstreamConfig.from_env("grok", "GROK", "https://api.x.ai/v1", 120.0),
+    # Job completion callbacks go to caller-supplied absolute URLs. Many hosts share
+    # these pools, so one bad host must not trip a breaker for all; no retries either.
+    "callbacks": UpstreamConfig.from_env("callbacks", "JOB_CALLBACK", "", 10.0, max_retries=0, breaker_threshold=0),
+    # Search result pages on the insurer and regulator sites, fetched by absolute URL
+    # within their own deadline
+    "pages": UpstreamConfig.from_env("pages", "PAGE_FETCH", "", 5.0, max_retries=0, breaker_threshold=0),
+}
+
+
+def _http2_available() -> bool:
+    try:
+        import h2  # noqa: F401
+        return True
+    except ImportError:
+        return False
+
+
+# A pooled httpx client for one upstream plus counters used to confirm connection reuse.
+# Requests go through a ResilientTransport holding the upstream's retry policy and
+# circuit breaker.
+class UpstreamPool:
+    def __init__(self, config: UpstreamConfig):
+        self.config = config
+        self.requests = 0
+        self.connections_opened = 0
+        self.errors = 0
+        http2 = config.http2
+        if http2 and not _http2_available():
+            logger.warning(f"HTTP/2 requested for {config.name} but the 'h2' package is not installed; using HTTP/1.1")
+            http2 = False
+        self.http2 = http2
+        self.transport = ResilientTransport(
+            httpx.AsyncHTTPTransport(limits=config.limits, http2=http2),
+            config.name,
+            CircuitBreaker(config.breaker_threshold, config.breaker_cooldown),
+            max_retries=config.max_retries,
+            budget=config.retry_budget,
+            base_delay=RETRY_BASE_DELAY,
+            max_delay=RETRY_MAX_DELAY,
+        )
+        self.client = httpx.AsyncClient(
+            base_url=config.base_url,
+            timeout=config.timeout,
+            transport=self.transport,
+            event_hooks={"request": [self._on_request], "response": [self._on_response]},
+        )
+
+    async def _trace(self, event_name: str, info: dict):
+        # httpcore only emits connect_tcp when it has to open a brand new connection
+        if event_name == "connection.connect_tcp.complete":
+            self.connections_opened += 1
+
+    async def _on_request(self, request: httpx.Request):
+        self.requests += 1
+        request.extensions["trace"] = self._trace
+
+    async def _on_response(self, response: httpx.Response):
+        if response.status_code >= 400:
+            self.errors += 1
+            UPSTREAM_ERRORS.inc(self.config.name, str(response.status_code))
+
+    def stats(self) -> Dict:
+        open_connections = 0
+        idle_connections = 0
+        pool = getattr(self.transport.transport, "_pool", None)
+        if pool is not None:
+            for connection in pool.connections:
+                open_connections += 1
+                if connection.is_idle():
+                    idle_connections += 1
+        reused = max(self.requests - self.connections_opened, 0)
+        return {
+            "base_url": self.config.base_url,
+            "http2": self.http2,
+            "max_connections": self.config.max_connections,
+            "max_keepalive_connections": self.config.max_keepalive_connections,
+            "requests": self.requests,
+            "connections_opened": self.connections_opened,
+            "connection_reuse_ratio": round(reused / self.requests, 4) if self.requests else 0.0,
+            "open_connections": open_connections,
+            "idle_connections": idle_connections,
+            "active_connections": open_connections - idle_connections,
+            "error_responses": self.errors,
+            **self.transport.stats(),
+        }
+
+    async def aclose(self):
+        await self.client.aclose()
+
+
+# Application-scoped registry of upstream clients, started and closed with the app
+class UpstreamClients:
+    def __init__(self, configs: Dict[str, UpstreamConfig]):
+        self.configs = configs
+        self.pools: Dict[str, UpstreamPool] = {}
+        self.openai_clients: Dict[str, "AsyncOpenAI"] = {}
+
+    def start(self):
+        for name, config in self.configs.items():
+            if name not in self.pools:
+                self.pools[name] = UpstreamPool(config)
+        logger.info(f"Upstream client pools started: {', '.join(self.pools)}")
+
+    def http(self, name: str) -> httpx.AsyncClient:
+        if name not in self.pools:
+            self.pools[name] = UpstreamPool(self.configs[name])
+        return self.pools[name].client
+
+    def openai(self, name: str, api_key: Optional[str]) -> "AsyncOpenAI":
+        """OpenAI-compatible client that shares the upstream's pooled httpx client"""
+        if name not in self.openai_clients:
+            from openai import AsyncOpenAI
+
+            pool_client = self.http(name)
+            config = self.configs[name]
+            self.openai_clients[name] = AsyncOpenAI(
+                api_key=api_key,
+                base_url=config.base_url,
+                timeout=config.timeout,
+                http_client=pool_client,
+                # Retries happen once, in the pool's ResilientTransport
+                max_retries=0,
+            )
+        return self.openai_clients[name]
+
+    def stats(self) -> Dict[str, Dict]:
+        return {name: pool.stats() for name, pool in self.pools.items()}
+
+    async def aclose(self):
+        for pool in self.pools.values():
+            await pool.aclose()
+        self.pools.clear()
+        self.openai_clients.clear()
+
+
+upstreams = UpstreamClients(UPSTREAM_CONFIGS)
@@ -0,0 +1,56 @@
+import hashlib
+import logging
+from typing import Any, Awaitable, Callable, Dict, List, Optional
+
+from cache import cache_from_env
+from config import env_bool
+from fast_json import dumps
+from singleflight import SingleFlight
+
+logger = logging.getLogger(__name__)
+
+
+# Canonical hash of everything that determines a completion.
+# Keys are sorted and separators fixed so dict ordering and spacing never matter.
+def completion_cache_key(endpoint: str, model: str, messages: List[Dict], context: Optional[str] = None) -> str:
+    canonical = dumps({"endpoint": endpoint, "model": model, "messages": messages, "context": context}, sort_keys=True)
+    return hashlib.sha256(canonical).hexdigest()
+
+
+# Opt-in cache for finished chat completions with in-flight dedup.
+# Repeated identical requests (double-clicks, retries, tab restores) are served
+# from the cache, and concurrent copies wait on the first upstream call.
+class CompletionCache:
+    def __init__(self, enabled: bool, cache):
+        self.enabled = enabled
+        self.cache = cache
+        self.flights = SingleFlight()
+
+    async def get_or_compute(self, key: str, compute: Callable[[], Awaitable[Any]]) -> Any:
+        if not self.enabled:
+            return await compute()
+        cached = self.cache.get(key)
+        if cached is not None:
+            logger.info(f"Completion cache hit: {key[:12]}")
+            return cached
+
+        async def compute_and_store():
+            result = await compute()
+            # Failed calls raise and are never cached
+            if result:
+                self.cache.set(key, result)
+            return result
+
+        return await self.flights.do(key, compute_and_store)
+
+    def stats(self) -> Dict:
+        stats = {"enabled": self.enabled}
+        stats.update(self.cache.stats())
+        stats["in_flight"] = self.flights.stats()
+        return stats
+
+
+completion_cache = CompletionCache(
+    enabled=env_bool("COMPLETION_CACHE_ENABLED", False),
+    cache=cache_from_env("COMPLETION_CACHE", max_entries=500, max_bytes=32 * 1024 * 1024, ttl=600.0),
+)
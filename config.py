@@ -0,0 +1,24 @@
+import os
+
+from dotenv import load_dotenv
+
+# Load .env before any module reads its settings at import time
+load_dotenv()
+
+
+# Read typed values from environment variables with a fallback default
+def env_int(name: str, default: int) -> int:
+    value = os.getenv(name)
+    return int(value) if value not in (None, "") else default
+
+
+def env_float(name: str, default: float) -> float:
+    value = os.getenv(name)
+    return float(value) if value not in (None, "") else default
+
+
+def env_bool(name: str, default: bool) -> bool:
+    value = os.getenv(name)
+    if value in (None, ""):
+        return default
+    return value.strip().lower() in ("1", "true", "yes", "on")
@@ -0,0 +1,164 @@
+import json
+import logging
+import os
+from dataclasses import dataclass
+from typing import Dict, List, Optional
+
+from config import env_int
+
+logger = logging.getLogger(__name__)
+
+# Prompt budgets in tokens per logical model; well under the context windows so
+# long sessions stop paying for history the model rarely needs
+DEFAULT_BUDGETS = {
+    "deepseek-chat": 24000,
+    "deepseek-reasoner": 16000,
+    "r1-1776": 16000,
+}
+
+CONTEXT_HEADERS = ["X-Context-Tokens", "X-Context-Tokens-Saved"]
+
+# Chat APIs add a few tokens of framing per message
+MESSAGE_OVERHEAD_TOKENS = 4
+
+
+def _is_cjk(ch: str) -> bool:
+    code = ord(ch)
+    return (
+        0x4E00 <= code <= 0x9FFF      # CJK unified ideographs
+        or 0x3400 <= code <= 0x4DBF   # extension A
+        or 0x3000 <= code <= 0x303F   # CJK punctuation
+        or 0xFF00 <= code <= 0xFFEF   # full-width forms
+        or 0x3040 <= code <= 0x30FF   # kana
+        or 0xAC00 <= code <= 0xD7AF   # hangul
+    )
+
+
+# Fast token estimate tuned on the DeepSeek tokenizer: about one token per CJK
+# character and about four characters per token for everything else.
+def estimate_tokens(text: str) -> int:
+    if not text:
+        return 0
+    cjk = sum(1 for ch in text if _is_cjk(ch))
+    return cjk + (len(text) - cjk + 3) // 4
+
+
+def message_tokens(message: Dict) -> int:
+    content = message.get("content", "")
+    if not isinstance(content, str):
+        content = json.dumps(content, ensure_ascii=False)
+    return estimate_tokens(content) + MESSAGE_OVERHEAD_TOKENS
+
+
+@dataclass
+class TrimResult:
+    messages: List[Dict]
+    tokens_before: int
+    tokens_after: int
+    dropped: int = 0
+    budget: Optional[int] = None
+
+    @property
+    def tokens_saved(self) -> int:
+        return self.tokens_before - self.tokens_after
+
+    def headers(self) -> Dict[str, str]:
+        return {"X-Context-Tokens": str(self.tokens_after), "X-Context-Tokens-Saved": str(self.tokens_saved)}
+
+
+# Fit a conversation into a per-model token budget.
+# System messages and the latest user turn are always kept. Older turns are
+# dropped oldest-first, whole user/assistant pairs at a time so the history still
+# alternates. In "digest" mode the dropped user questions are listed in one short
+# system note, so the model still knows what was discussed earlier.
+class ContextBudget:
+    def __init__(self, budgets: Dict[str, int], default_budget: int, mode: str = "drop", digest_tokens: int = 300):
+        if mode not in ("drop", "digest"):
+            raise ValueError(f"Unknown context trim mode: {mode}")
+        self.budgets = budgets
+        self.default_budget = default_budget
+        self.mode = mode
+        self.digest_tokens = digest_tokens
+
+    def budget_for(self, model: str) -> int:
+        return self.budgets.get(model, self.default_budget)
+
+    def _digest(self, dropped: List[Dict]) -> Optional[Dict]:
+        questions = [message.get("content", "") for message in dropped if message.get("role") == "user"]
+        questions = [question for question in questions if isinstance(question, str) and question.strip()]
+        if not questions:
+            return None
+        lines, used = [], 0
+        for question in questions:
+            line = "- " + " ".join(question.split())[:160]
+            cost = estimate_tokens(line)
+            if used + cost > self.digest_tokens:
+                break
+            lines.append(line)
+            used += cost
+        if not lines:
+            return None
+        return {
+            "role": "system",
+            "content": "Earlier in this conversation the user asked:\n" + "\n".join(lines),
+        }
+
+    def trim(self, model: str, messages: List[Dict]) -> TrimResult:
+        budget = self.budget_for(model)
+        costs = [message_tokens(message) for message in messages]
+        total = sum(costs)
+        if budget <= 0 or total <= budget:
+            return TrimResult(messages, total, total, budget=budget)
+
+        system_indexes = [index for index, message in enumerate(messages) if message.get("role") == "system"]
+        turn_indexes = [index for index, message in enumerate(messages) if message.get("role") != "system"]
+        used = sum(costs[index] for index in system_indexes)
+        if self.mode == "digest":
+            used += self.digest_tokens
+
+        # The latest user message and everything after it are kept even when over
+        # budget; older turns are added walking back while they still fit
+        anchor = max(
+            (position for position, index in enumerate(turn_indexes) if messages[index].get("role") == "user"),
+            default=len(turn_indexes) - 1,
+        )
+        kept = list(reversed(turn_indexes[max(anchor, 0):]))
+        used += sum(costs[index] for index in kept)
+        for position in range(anchor - 1, -1, -1):
+            index = turn_indexes[position]
+            if used + costs[index] > budget:
+                break
+            kept.append(index)
+            used += costs[index]
+        kept.reverse()
+        # History must start at a user turn so roles keep alternating
+        while len(kept) > 1 and messages[kept[0]].get("role") != "user":
+            kept.pop(0)
+
+        kept_set = set(kept)
+        dropped = [messages[index] for index in turn_indexes if index not in kept_set]
+        trimmed = [message for index, message in enumerate(messages) if index in kept_set or index in system_indexes]
+        if self.mode == "digest" and dropped:
+            digest = self._digest(dropped)
+            if digest:
+                # Place the note right before the kept turns, after the leading system messages
+                insert_at = next((i for i, message in enumerate(trimmed) if message.get("role") != "system"), len(trimmed))
+                trimmed.insert(insert_at, digest)
+        after = sum(message_tokens(message) for message in trimmed)
+        logger.info(f"Trimmed context for {model}: {total} -> {after} tokens, dropped {len(dropped)} messages")
+        return TrimResult(trimmed, total, after, dropped=len(dropped), budget=budget)
+
+
+def budget_from_env() -> ContextBudget:
+    budgets = dict(DEFAULT_BUDGETS)
+    if os.getenv("CONTEXT_BUDGETS"):
+        budgets.update({model: int(tokens) for model, tokens in json.loads(os.getenv("CONTEXT_BUDGETS")).items()})
+    return ContextBudget(
+        budgets,
+        default_budget=env_int("CONTEXT_BUDGET_DEFAULT", 24000),
+        mode=os.getenv("CONTEXT_TRIM_MODE", "drop"),
+        digest_tokens=env_int("CONTEXT_DIGEST_TOKENS", 300),
+    )
+
+
+context_budget = budget_from_env()
@@ -0,0 +1,104 @@
+import asyncio
+import logging
+import time
+from typing import Any, Awaitable, Optional
+
+from fastapi import HTTPException, Request
+
+from clients import UPSTREAM_CONFIGS
+from config import env_float
+from llm_router import expected_completion_tokens, model_label
+from metrics import LLM_TOKENS_SAVED, REQUESTS_CANCELLED
+
+logger = logging.getLogger(__name__)
+
+LLM_UPSTREAMS = ("deepseek", "perplexity", "grok")
+# Seconds a request may take when the client does not ask for less (X-Request-Timeout).
+# The default is the longest LLM read timeout (DEEPSEEK_READ_TIMEOUT, 300s), since a
+# non-streaming deepseek-reasoner answer can take minutes before its first byte and
+# the deadline must not cut short a call the upstream client would still wait for.
+REQUEST_DEADLINE = env_float(
+    "REQUEST_DEADLINE", max(UPSTREAM_CONFIGS[name].read_timeout for name in LLM_UPSTREAMS)
+)
+REQUEST_DEADLINE_MAX = max(env_float("REQUEST_DEADLINE_MAX", 600.0), REQUEST_DEADLINE)
+# Share of the deadline /api/dswithsearch gives the search stage; the LLM gets the rest
+SEARCH_DEADLINE_SHARE = env_float("SEARCH_DEADLINE_SHARE", 0.25)
+# nginx's code for a client that went away before the response was sent
+CLIENT_CLOSED_REQUEST = 499
+
+
+class RequestCancelled(HTTPException):
+    def __init__(self, stage: str, reason: str):
+        if reason == "deadline":
+            super().__init__(status_code=504, detail=f"Deadline exceeded during {stage}")
+        else:
+            super().__init__(status_code=CLIENT_CLOSED_REQUEST, detail="Client closed request")
+        self.stage = stage
+        self.reason = reason
+
+
+# Deadline and disconnect watch for one request.
+# The deadline comes from the X-Request-Timeout header (seconds, capped at
+# REQUEST_DEADLINE_MAX) or REQUEST_DEADLINE. run() awaits one stage of the
+# request and cancels it as soon as the client disconnects or the stage's share
+# of the deadline runs out; cancelling the task closes the upstream connection.
+# Use as `async with`, so the disconnect watcher is stopped before a streaming
+# response takes over the receive channel.
+class RequestDeadline:
+    def __init__(self, request: Request, endpoint: str, model: str = ""):
+        self.request = request
+        self.endpoint = endpoint
+        self.model = model
+        timeout = REQUEST_DEADLINE
+        header = request.headers.get("x-request-timeout")
+        if header:
+            try:
+                timeout = float(header)
+            except ValueError:
+                raise HTTPException(status_code=400, detail="X-Request-Timeout must be a number of seconds")
+        self.timeout = min(max(timeout, 0.0), REQUEST_DEADLINE_MAX)
+        self.expires_at = time.monotonic() + self.timeout
+        self._watcher: Optional[asyncio.Task] = None
+
+    @property
+    def expires_in(self) -> float:
+        return max(self.expires_at - time.monotonic(), 0.0)
+
+    async def _wait_for_disconnect(self):
+        # The body has been read by now, so the next message is the disconnect
+        while True:
+            message = await self.request.receive()
+            if message["type"] == "http.disconnect":
+                return
+
+    async def __aenter__(self) -> "RequestDeadline":
+        self._watcher = asyncio.ensure_future(self._wait_for_disconnect())
+        return self
+
+    async def __aexit__(self, *exc_info):
+        self._watcher.cancel()
+
+    async def run(self, stage: str, awaitable: Awaitable[Any], share: float = 1.0) -> Any:
+        task = asyncio.ensure_future(awaitable)
+        done, _ = await asyncio.wait(
+            {task, self._watcher}, timeout=self.expires_in * share, return_when=asyncio.FIRST_COMPLETED
+        )
+        if task in done:
+            return task.result()
+        task.cancel()
+        reason = "disconnect" if self._watcher in done else "deadline"
+        REQUESTS_CANCELLED.inc(self.endpoint, stage, reason)
+        if stage == "llm":
+            self.record_tokens_saved()
+        logger.info(f"Cancelled {self.endpoint} during {stage}: {reason}")
+        raise RequestCancelled(stage, reason)
+
+    # on_cancel callback for stream_openai_completion; a streamed chunk is about one token
+    def stream_cancelled(self, reason: str, chunks: int):
+        REQUESTS_CANCELLED.inc(self.endpoint, "stream", reason)
+        self.record_tokens_saved(generated=chunks)
+
+    def record_tokens_saved(self, generated: int = 0):
+        saved = expected_completion_tokens(self.model) - generated
+        if saved > 0:
+            LLM_TOKENS_SAVED.inc(model_label(self.model), amount=saved)
@@ -0,0 +1,47 @@
+import re
+from typing import Dict, FrozenSet, List, Tuple
+
+# Insurers with their own target site: aliases as written in English and Chinese
+INSURERS: Dict[str, Tuple[Tuple[str, ...], str]] = {
+    "AIA": (("aia", "友邦"), "site:aia.com.hk"),
+    "Manulife": (("manulife", "宏利"), "site:manulife.com.hk"),
+    "Prudential": (("prudential", "保誠", "保诚"), "site:prudential.com.hk"),
+    "AXA": (("axa", "安盛"), "site:axa.com.hk"),
+    "Sun Life": (("sun life", "sunlife", "永明"), "site:sunlife.com.hk"),
+    "Chubb": (("chubb", "安達", "安达"), "site:chubb.com"),
+}
+PRODUCTS: Dict[str, Tuple[str, ...]] = {
+    "critical illness": ("critical illness", "ci plan", "危疾", "重疾", "嚴重疾病", "严重疾病"),
+    "medical": ("medical", "vhis", "health insurance", "hospital", "醫療", "医疗", "自願醫保", "自愿医保"),
+    "life": ("life insurance", "term life", "whole life", "人壽", "人寿"),
+    "savings": ("savings", "endowment", "儲蓄", "储蓄"),
+    "annuity": ("annuity", "qdap", "年金"),
+    "accident": ("accident", "意外"),
+    "travel": ("travel", "旅遊", "旅游"),
+}
+
+
+# Latin aliases match whole words (optionally plural); CJK aliases match anywhere
+def alias_pattern(aliases: Tuple[str, ...]) -> re.Pattern:
+    parts = [rf"\b{re.escape(alias)}s?\b" if alias.isascii() else re.escape(alias) for alias in aliases]
+    return re.compile("|".join(parts), re.IGNORECASE)
+
+
+INSURER_PATTERNS = {name: alias_pattern(aliases) for name, (aliases, _) in INSURERS.items()}
+PRODUCT_PATTERNS = {name: alias_pattern(aliases) for name, aliases in PRODUCTS.items()}
+
+
+# Entities from `patterns` mentioned in the text, in order of first mention
+def mentions(text: str, patterns: Dict[str, re.Pattern]) -> List[str]:
+    found = []
+    for name, pattern in patterns.items():
+        match = pattern.search(text)
+        if match:
+            found.append((match.start(), name))
+    return [name for _, name in sorted(found)]
+
+
+# Every insurer and product the text names. Two queries about different entities
+# must never share search results, however similar the rest of their wording is.
+def entity_set(text: str) -> FrozenSet[str]:
+    return frozenset(mentions(text, INSURER_PATTERNS)) | frozenset(mentions(text, PRODUCT_PATTERNS))
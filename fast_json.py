@@ -0,0 +1,54 @@
+import gzip
+import json
+from typing import Any, Dict, Optional
+
+from fastapi import Response
+
+from config import env_bool, env_int
+
+# orjson parses and serializes several times faster than the stdlib and goes
+# straight to UTF-8 bytes; the stdlib is used when it is not installed
+try:
+    import orjson
+except ImportError:
+    orjson = None
+
+JSON_BACKEND = "orjson" if orjson is not None else "json"
+
+# Gzip JSON responses of at least this many bytes when the client accepts it
+RESPONSE_COMPRESSION = env_bool("RESPONSE_COMPRESSION", False)
+RESPONSE_COMPRESSION_MIN_BYTES = env_int("RESPONSE_COMPRESSION_MIN_BYTES", 1024)
+RESPONSE_COMPRESSION_LEVEL = env_int("RESPONSE_COMPRESSION_LEVEL", 5)
+
+
+def loads(data) -> Any:
+    if orjson is not None:
+        return orjson.loads(data)
+    return json.loads(data)
+
+
+# Compact UTF-8 JSON; non-ASCII text (Chinese answers) is written as-is, not escaped.
+# Both backends produce the same bytes for JSON-shaped data, so hashes stay stable.
+def dumps(value: Any, sort_keys: bool = False) -> bytes:
+    if orjson is not None:
+        return orjson.dumps(value, option=orjson.OPT_SORT_KEYS if sort_keys else 0)
+    return json.dumps(value, ensure_ascii=False, separators=(",", ":"), sort_keys=sort_keys).encode("utf-8")
+
+
+# JSON response serialized with dumps(), gzip-compressed when enabled, large
+# enough to be worth it and accepted by the client
+class FastJSONResponse(Response):
+    media_type = "application/json"
+
+    def __init__(self, content: Any, status_code: int = 200, headers: Optional[Dict[str, str]] = None,
+                 accept_encoding: str = ""):
+        body = dumps(content)
+        headers = dict(headers or {})
+        if RESPONSE_COMPRESSION and len(body) >= RESPONSE_COMPRESSION_MIN_BYTES and "gzip" in accept_encoding:
+            body = gzip.compress(body, compresslevel=RESPONSE_COMPRESSION_LEVEL)
+            headers["Content-Encoding"] = "gzip"
+            headers["Vary"] = "Accept-Encoding"
+        super().__init__(body, status_code=status_code, headers=headers)
+
+    def render(self, content: Any) -> bytes:
+        return content
@@ -0,0 +1,207 @@
+import asyncio
+import json
+import logging
+import os
+import secrets
+import time
+from typing import Awaitable, Callable, Dict, List, Optional
+from urllib.parse import urlparse
+
+from fastapi import HTTPException
+
+from cache import cache_from_env
+from clients import upstreams
+from config import env_float, env_int
+
+logger = logging.getLogger(__name__)
+
+FINISHED_STATES = ("succeeded", "failed")
+
+
+# Background job mode for completions that outlive proxy and browser timeouts.
+# POST returns a job id at once; a fixed pool of workers runs the completion and
+# keeps the outcome for `result_ttl` seconds in a TTL cache (sqlite when results
+# must be visible to every worker). Identical resubmissions and repeated
+# Idempotency-Keys return the existing job instead of running it again.
+class JobManager:
+    def __init__(
+        self,
+        run: Callable[[Dict], Awaitable[Dict]],
+        store,
+        workers: int = 4,
+        max_pending: int = 64,
+        max_result_bytes: int = 256 * 1024,
+        result_ttl: float = 3600.0,
+        job_timeout: float = 600.0,
+        callback_hosts: Optional[List[str]] = None,
+    ):
+        self.run = run
+        self.store = store
+        self.workers = workers
+        self.max_pending = max_pending
+        self.max_result_bytes = max_result_bytes
+        self.result_ttl = result_ttl
+        self.job_timeout = job_timeout
+        self.callback_hosts = callback_hosts or []
+        self._queue: Optional[asyncio.Queue] = None
+        self._tasks: List[asyncio.Task] = []
+        self.running = 0
+        self.submitted = 0
+        self.deduplicated = 0
+        self.rejected = 0
+        self.succeeded = 0
+        self.failed = 0
+        self.callbacks_failed = 0
+
+    def start(self):
+        if self._tasks:
+            return
+        self._queue = asyncio.Queue(maxsize=self.max_pending)
+        self._tasks = [asyncio.create_task(self._worker()) for _ in range(self.workers)]
+        logger.info(f"Job workers started: {self.workers} workers, {self.max_pending} pending jobs max")
+
+    def _save(self, job: Dict):
+        # Unfinished jobs must outlive their own timeout, finished ones live for the result TTL
+        ttl = self.result_ttl if job["status"] in FINISHED_STATES else self.result_ttl + self.job_timeout
+        self.store.set(f"job:{job['id']}", job, ttl=ttl)
+
+    def get(self, job_id: str) -> Optional[Dict]:
+        return self.store.get(f"job:{job_id}")
+
+    def validate_callback(self, callback_url: Optional[str]):
+        if not callback_url:
+            return
+        parsed = urlparse(callback_url)
+        if parsed.scheme not in ("http", "https") or not parsed.hostname:
+            raise HTTPException(status_code=400, detail="callback_url must be an http(s) URL")
+        # No allowlist means no callbacks: an open callback would let any client make
+        # this server POST to internal addresses such as the cloud metadata service
+        if not self.callback_hosts:
+            raise HTTPException(status_code=400, detail="Job callbacks are disabled (JOB_CALLBACK_HOSTS is not set)")
+        if parsed.hostname not in self.callback_hosts:
+            raise HTTPException(status_code=400, detail=f"callback_url host {parsed.hostname} is not allowed")
+
+    def submit(self, payload: Dict, dedupe_key: str, callback_url: Optional[str] = None) -> Dict:
+        if self._queue is None:
+            raise HTTPException(status_code=503, detail="Job workers are not running")
+        self.validate_callback(callback_url)
+        existing_id = self.store.get(f"dedupe:{dedupe_key}")
+        existing = self.get(existing_id) if existing_id else None
+        if existing is not None and existing["status"] != "failed":
+            self.deduplicated += 1
+            return {**existing, "deduplicated": True}
+
+        job = {
+            "id": secrets.token_urlsafe(12),
+            "status": "queued",
+            "model": payload.get("model"),
+            "created_at": time.time(),
+            "started_at": None,
+            "finished_at": None,
+            "result": None,
+            "error": None,
+            "callback_url": callback_url,
+            "callback_status": None,
+        }
+        try:
+            self._queue.put_nowait((job["id"], payload))
+        except asyncio.QueueFull:
+            self.rejected += 1
+            raise HTTPException(status_code=429, detail="Too many pending jobs", headers={"Retry-After": "5"})
+        self.submitted += 1
+        self._save(job)
+        self.store.set(f"dedupe:{dedupe_key}", job["id"], ttl=self.result_ttl)
+        return job
+
+    async def _worker(self):
+        while True:
+            job_id, payload = await self._queue.get()
+            try:
+                await self._run_job(job_id, payload)
+            except asyncio.CancelledError:
+                raise
+            except Exception as e:
+                logger.error(f"Job {job_id} worker error: {e}")
+            finally:
+                self._queue.task_done()
+
+    async def _run_job(self, job_id: str, payload: Dict):
+        job = self.get(job_id)
+        if job is None:
+            logger.warning(f"Job {job_id} expired before it ran")
+            return
+        job = {**job, "status": "running", "started_at": time.time()}
+        self._save(job)
+        self.running += 1
+        try:
+            result = await asyncio.wait_for(self.run(payload), timeout=self.job_timeout)
+            size = len(json.dumps(result, ensure_ascii=False).encode("utf-8"))
+            if size > self.max_result_bytes:
+                raise HTTPException(status_code=413, detail=f"Result of {size} bytes exceeds {self.max_result_bytes} bytes")
+            job.update(status="succeeded", result=result)
+            self.succeeded += 1
+        except asyncio.TimeoutError:
+            job.update(status="failed", error={"status_code": 504, "detail": f"Job exceeded {self.job_timeout}s"})
+            self.failed += 1
+        except Exception as e:
+            status_code = getattr(e, "status_code", None) or 500
+            job.update(status="failed", error={"status_code": status_code, "detail": getattr(e, "detail", None) or str(e)})
+            self.failed += 1
+        finally:
+            self.running -= 1
+        job["finished_at"] = time.time()
+        if job["callback_url"]:
+            job["callback_status"] = await self._deliver_callback(job)
+        self._save(job)
+        logger.info(f"Job {job_id} {job['status']} in {job['finished_at'] - job['started_at']:.1f}s")
+
+    async def _deliver_callback(self, job: Dict) -> str:
+        try:
+            response = await upstreams.http("callbacks").post(job["callback_url"], json=job)
+            if response.status_code >= 400:
+                self.callbacks_failed += 1
+            return str(response.status_code)
+        except Exception as e:
+            self.callbacks_failed += 1
+            logger.warning(f"Callback for job {job['id']} failed: {e}")
+            return type(e).__name__
+
+    def stats(self) -> Dict:
+        return {
+            "workers": len(self._tasks),
+            "queued": self._queue.qsize() if self._queue else 0,
+            "running": self.running,
+            "max_pending": self.max_pending,
+            "submitted": self.submitted,
+            "deduplicated": self.deduplicated,
+            "rejected": self.rejected,
+            "succeeded": self.succeeded,
+            "failed": self.failed,
+            "callbacks_failed": self.callbacks_failed,
+            "store": self.store.stats(),
+        }
+
+    async def aclose(self):
+        for task in self._tasks:
+            task.cancel()
+        await asyncio.gather(*self._tasks, return_exceptions=True)
+        self._tasks = []
+
+
+# JOB_* settings; results go to a JOB_RESULTS_* cache (JOB_RESULTS_BACKEND=sqlite
+# lets any worker answer a poll for a job another worker ran)
+def job_manager_from_env(run: Callable[[Dict], Awaitable[Dict]]) -> JobManager:
+    result_ttl = env_float("JOB_RESULT_TTL", 3600.0)
+    store = cache_from_env("JOB_RESULTS", max_entries=2000, max_bytes=64 * 1024 * 1024, ttl=result_ttl)
+    # Hosts callbacks may be sent to; when unset, requests with a callback_url are rejected
+    hosts = [host.strip().lower() for host in os.getenv("JOB_CALLBACK_HOSTS", "").split(",") if host.strip()]
+    return JobManager(
+        run,
+        store,
+        workers=env_int("JOB_WORKERS", 4),
+        max_pending=env_int("JOB_MAX_PENDING", 64),
+        max_result_bytes=env_int("JOB_MAX_RESULT_BYTES", 256 * 1024),
+        result_ttl=result_ttl,
+        job_timeout=env_float("JOB_TIMEOUT", 600.0),
+        callback_hosts=hosts,
+    )
@@ -0,0 +1,369 @@
+import asyncio
+import json
+import logging
+import os
+import sys
+import time
+from dataclasses import dataclass, field
+from typing import TYPE_CHECKING, Dict, List, Optional, Set, Tuple
+
+import httpx
+
+from bulkhead import BulkheadRejected, bulkheads
+from clients import upstreams
+from config import env_float, env_int
+from context_budget import context_budget
+from fast_json import dumps, loads
+from metrics import LLM_LATENCY, PROMPT_CACHE_TOKENS, UPSTREAM_ERRORS
+
+# The OpenAI SDK is imported on first use, see STARTUP_MODE in startup.py
+if TYPE_CHECKING:
+    import openai
+
+logger = logging.getLogger(__name__)
+
+# Logical model -> ordered (provider, upstream model) candidates that can serve it.
+# r1-1776 is Perplexity's post-trained DeepSeek-R1, so the reasoners back each other up.
+DEFAULT_MODEL_ROUTES = {
+    "deepseek-chat": [["deepseek", "deepseek-chat"], ["grok", "grok-2-latest"]],
+    "deepseek-reasoner": [["deepseek", "deepseek-reasoner"], ["perplexity", "r1-1776"]],
+    "r1-1776": [["perplexity", "r1-1776"], ["deepseek", "deepseek-reasoner"]],
+}
+
+# Model names that get their own metric series, route-health entries, usage
+# averages and bulkheads: those in the route, context budget and concurrency limit
+# tables. Any other name a client sends is grouped as "other", so made-up model
+# names cannot add metric series or grow these tables without bound.
+KNOWN_MODELS: Set[str] = set(context_budget.budgets) | set(bulkheads.model_limits)
+
+
+def model_label(model: str) -> str:
+    return model if model in KNOWN_MODELS else "other"
+
+
+# Status codes that mean the request itself is bad; retrying elsewhere will not help
+NON_RETRYABLE_STATUS = {400, 404, 413, 422}
+
+ROUTING_HEADERS = [
+    "X-LLM-Provider", "X-LLM-Model", "X-LLM-Attempts", "X-LLM-Route",
+    "X-Prompt-Cache-Hit-Tokens", "X-Prompt-Cache-Miss-Tokens",
+]
+
+
+# An OpenAI-compatible chat backend served through a pooled upstream client
+@dataclass
+class LLMProvider:
+    name: str
+    api_key: Optional[str]
+
+    @property
+    def configured(self) -> bool:
+        return bool(self.api_key)
+
+    def client(self) -> "openai.AsyncOpenAI":
+        return upstreams.openai(self.name, self.api_key)
+
+    def http(self) -> httpx.AsyncClient:
+        return upstreams.http(self.name)
+
+    @property
+    def headers(self) -> Dict[str, str]:
+        return {"Authorization": f"Bearer {self.api_key}", "Content-Type": "application/json"}
+
+
+# Rolling health of one (provider, model) pair: EWMA latency and error rate,
+# plus a cooldown after repeated consecutive failures
+class RouteHealth:
+    def __init__(self, alpha: float, failure_threshold: int, cooldown: float):
+        self.alpha = alpha
+        self.failure_threshold = failure_threshold
+        self.cooldown = cooldown
+        self.latency: Optional[float] = None
+        self.error_rate = 0.0
+        self.consecutive_failures = 0
+        self.unhealthy_until = 0.0
+        self.requests = 0
+        self.failures = 0
+
+    def record_success(self, latency: float):
+        self.requests += 1
+        self.consecutive_failures = 0
+        self.latency = latency if self.latency is None else self.alpha * latency + (1 - self.alpha) * self.latency
+        self.error_rate = (1 - self.alpha) * self.error_rate
+
+    def record_failure(self):
+        self.requests += 1
+        self.failures += 1
+        self.consecutive_failures += 1
+        self.error_rate = self.alpha + (1 - self.alpha) * self.error_rate
+        if self.consecutive_failures >= self.failure_threshold:
+            self.unhealthy_until = time.monotonic() + self.cooldown
+
+    @property
+    def healthy(self) -> bool:
+        return time.monotonic() >= self.unhealthy_until
+
+    def score(self) -> float:
+        # Expected seconds per successful answer; unknown routes are optimistic so they get sampled
+        latency = self.latency if self.latency is not None else 0.0
+        return latency / max(1.0 - self.error_rate, 0.05)
+
+    def to_dict(self) -> Dict:
+        return {
+            "healthy": self.healthy,
+            "requests": self.requests,
+            "failures": self.failures,
+            "error_rate": round(self.error_rate, 4),
+            "latency_ewma_ms": round(self.latency * 1000, 1) if self.latency is not None else None,
+            "consecutive_failures": self.consecutive_failures,
+        }
+
+
+# Prompt-cache (hit, miss) token counts from a response's usage block.
+# DeepSeek reports prompt_cache_hit_tokens/prompt_cache_miss_tokens; OpenAI-style
+# providers report prompt_tokens_details.cached_tokens instead.
+# Accepts SDK usage objects and the raw usage dicts of the pass-through path.
+def prompt_cache_tokens(usage) -> Optional[Tuple[int, int]]:
+    if usage is None:
+        return None
+    hit = _field(usage, "prompt_cache_hit_tokens")
+    miss = _field(usage, "prompt_cache_miss_tokens")
+    if hit is not None and miss is not None:
+        return hit, miss
+    cached = _field(_field(usage, "prompt_tokens_details"), "cached_tokens")
+    prompt_tokens = _field(usage, "prompt_tokens")
+    if cached is not None and prompt_tokens is not None:
+        return cached, prompt_tokens - cached
+    return None
+
+
+def _field(value, name: str):
+    if isinstance(value, dict):
+        return value.get(name)
+    return getattr(value, name, None)
+
+
+# Rolling average completion length per model, used to estimate how many tokens
+# a cancelled request did not have generated
+_completion_tokens: Dict[str, float] = {}
+
+
+def expected_completion_tokens(model: str) -> float:
+    return _completion_tokens.get(model_label(model), 0.0)
+
+
+def record_usage(provider: str, model: str, usage) -> Optional[Tuple[int, int]]:
+    model = model_label(model)
+    completion_tokens = _field(usage, "completion_tokens")
+    if completion_tokens is not None:
+        previous = _completion_tokens.get(model)
+        _completion_tokens[model] = completion_tokens if previous is None else 0.9 * previous + 0.1 * completion_tokens
+    tokens = prompt_cache_tokens(usage)
+    if tokens is not None:
+        PROMPT_CACHE_TOKENS.inc(provider, model, "hit", amount=tokens[0])
+        PROMPT_CACHE_TOKENS.inc(provider, model, "miss", amount=tokens[1])
+    return tokens
+
+
+# Outcome of a routed call, surfaced to clients as X-LLM-* response headers
+@dataclass
+class RouteDecision:
+    provider: str
+    model: str
+    attempts: int
+    tried: List[str] = field(default_factory=list)
+    prompt_cache: Optional[Tuple[int, int]] = None
+
+    def headers(self) -> Dict[str, str]:
+        headers = {
+            "X-LLM-Provider": self.provider,
+            "X-LLM-Model": self.model,
+            "X-LLM-Attempts": str(self.attempts),
+            "X-LLM-Route": ",".join(self.tried),
+        }
+        if self.prompt_cache is not None:
+            headers["X-Prompt-Cache-Hit-Tokens"] = str(self.prompt_cache[0])
+            headers["X-Prompt-Cache-Miss-Tokens"] = str(self.prompt_cache[1])
+        return headers
+
+
+# An error raised by the OpenAI SDK for an HTTP error response. If the SDK has not
+# been imported yet, nothing can have raised one, so the check never loads it.
+def is_api_status_error(error: Exception) -> bool:
+    sdk = sys.modules.get("openai")
+    return sdk is not None and isinstance(error, sdk.APIStatusError)
+
+
+def _is_api_connection_error(error: Exception) -> bool:
+    sdk = sys.modules.get("openai")
+    return sdk is not None and isinstance(error, sdk.APIConnectionError)
+
+
+def _should_fail_over(error: Exception) -> bool:
+    if is_api_status_error(error):
+        return error.status_code not in NON_RETRYABLE_STATUS
+    return _is_api_connection_error(error) or isinstance(error, asyncio.TimeoutError)
+
+
+# Routes chat completions to the healthiest compatible backend and fails over on error.
+# Policies:
+#   "priority" - use candidates in configured order, skipping unhealthy ones
+#   "latency"  - among healthy candidates, prefer the lowest latency/error score
+class LLMRouter:
+    def __init__(
+        self,
+        providers: Dict[str, LLMProvider],
+        routes: Dict[str, List[List[str]]],
+        policy: str = "priority",
+        attempt_timeout: Optional[float] = None,
+        max_attempts: int = 3,
+        alpha: float = 0.2,
+        failure_threshold: int = 3,
+        cooldown: float = 30.0,
+    ):
+        if policy not in ("priority", "latency"):
+            raise ValueError(f"Unknown LLM routing policy: {policy}")
+        self.providers = providers
+        self.routes = routes
+        self.policy = policy
+        self.attempt_timeout = attempt_timeout
+        self.max_attempts = max_attempts
+        self.alpha = alpha
+        self.failure_threshold = failure_threshold
+        self.cooldown = cooldown
+        self.health: Dict[Tuple[str, str], RouteHealth] = {}
+        self.failovers = 0
+        KNOWN_MODELS.update(routes)
+        KNOWN_MODELS.update(upstream_model for candidates in routes.values() for _, upstream_model in candidates)
+
+    # Unknown models share one ("other") entry per provider
+    def _health(self, provider: str, model: str) -> RouteHealth:
+        key = (provider, model_label(model))
+        if key not in self.health:
+            self.health[key] = RouteHealth(self.alpha, self.failure_threshold, self.cooldown)
+        return self.health[key]
+
+    def candidates(self, model: str, default_provider: str) -> List[Tuple[str, str]]:
+        """Ranked (provider, model) pairs that can serve the requested model"""
+        configured = [
+            (provider, upstream_model)
+            for provider, upstream_model in self.routes.get(model, [[default_provider, model]])
+            if provider in self.providers and self.providers[provider].configured
+        ]
+        if not configured:
+            configured = [(default_provider, model)]
+        healthy = [pair for pair in configured if self._health(*pair).healthy]
+        unhealthy = [pair for pair in configured if pair not in healthy]
+        if self.policy == "latency":
+            healthy.sort(key=lambda pair: self._health(*pair).score())
+        # Unhealthy routes are still tried last rather than failing outright
+        return (healthy + unhealthy)[:self.max_attempts]
+
+    async def _attempts(self, model: str, default_provider: str, call):
+        decision_tried = []
+        last_error: Optional[Exception] = None
+        for attempt, (provider, upstream_model) in enumerate(self.candidates(model, default_provider), start=1):
+            health = self._health(provider, upstream_model)
+            start = time.perf_counter()
+            try:
+                # For streams the upstream slot covers the call up to the first chunk
+                async with bulkheads.upstream(provider).slot():
+                    result = await asyncio.wait_for(call(self.providers[provider], upstream_model), timeout=self.attempt_timeout)
+            except BulkheadRejected as e:
+                # A saturated upstream is not unhealthy; just try the next route
+                decision_tried.append(f"{provider}:{upstream_model}=busy")
+                last_error = e
+                continue
+            except Exception as e:
+                health.record_failure()
+                LLM_LATENCY.observe(provider, model_label(upstream_model), "error", value=time.perf_counter() - start)
+                if not is_api_status_error(e):
+                    UPSTREAM_ERRORS.inc(provider, type(e).__name__)
+                decision_tried.append(f"{provider}:{upstream_model}=error")
+                logger.warning(f"LLM route {provider}:{upstream_model} failed: {str(e)}")
+                last_error = e
+                if not _should_fail_over(e):
+                    raise
+                self.failovers += 1
+                continue
+            elapsed = time.perf_counter() - start
+            health.record_success(elapsed)
+            LLM_LATENCY.observe(provider, model_label(upstream_model), "ok", value=elapsed)
+            decision_tried.append(f"{provider}:{upstream_model}=ok")
+            return result, RouteDecision(provider, upstream_model, attempt, decision_tried)
+        raise last_error
+
+    async def complete(self, model: str, messages: List[Dict], default_provider: str, **params) -> Tuple[str, RouteDecision]:
+        async def call(provider, upstream_model):
+            response = await provider.client().chat.completions.create(
+                model=upstream_model,
+                messages=messages,
+                stream=False,
+                **params
+            )
+            return response
+
+        response, decision = await self._attempts(model, default_provider, call)
+        decision.prompt_cache = record_usage(decision.provider, decision.model, response.usage)
+        return response.choices[0].message.content, decision
+
+    async def open_stream(self, model: str, messages: List[Dict], default_provider: str, **params):
+        """Open a streaming completion; failover covers errors before the first chunk"""
+        async def call(provider, upstream_model):
+            return await provider.client().chat.completions.create(
+                model=upstream_model,
+                messages=messages,
+                stream=True,
+                **params
+            )
+
+        return await self._attempts(model, default_provider, call)
+
+    async def complete_raw(self, model: str, messages: List[Dict], default_provider: str, **params) -> Tuple[Dict, RouteDecision]:
+        """Non-streaming completion as the provider's JSON, without the SDK's request and response models"""
+        async def call(provider, upstream_model):
+            body = dumps({"model": upstream_model, "messages": messages, "stream": False, **params})
+            try:
+                response = await provider.http().post("/chat/completions", content=body, headers=provider.headers)
+            except httpx.TransportError as e:
+                import openai
+                raise openai.APIConnectionError(message=str(e) or type(e).__name__, request=e.request) from e
+            if response.status_code >= 400:
+                # Raised as the SDK's error so failover and error responses match the SDK path
+                import openai
+                raise openai.APIStatusError(f"Error code: {response.status_code}", response=response, body=None)
+            return loads(response.content)
+
+        data, decision = await self._attempts(model, default_provider, call)
+        decision.prompt_cache = record_usage(decision.provider, decision.model, data.get("usage"))
+        return data, decision
+
+    # Create the SDK clients of configured providers ahead of the first request
+    def warm_clients(self):
+        for provider in self.providers.values():
+            if provider.configured:
+                provider.client()
+
+    def stats(self) -> Dict:
+        return {
+            "policy": self.policy,
+            "failovers": self.failovers,
+            "routes": {f"{provider}:{model}": health.to_dict() for (provider, model), health in self.health.items()},
+        }
+
+
+# Build the router from LLM_* settings; LLM_MODEL_ROUTES may override the route table as JSON
+def router_from_env(api_keys: Dict[str, Optional[str]]) -> LLMRouter:
+    routes = DEFAULT_MODEL_ROUTES
+    if os.getenv("LLM_MODEL_ROUTES"):
+        routes = json.loads(os.getenv("LLM_MODEL_ROUTES"))
+    attempt_timeout = env_float("LLM_ATTEMPT_TIMEOUT", 0.0)
+    return LLMRouter(
+        {name: LLMProvider(name, key) for name, key in api_keys.items()},
+        routes,
+        policy=os.getenv("LLM_ROUTING_POLICY", "priority"),
+        attempt_timeout=attempt_timeout or None,
+        max_attempts=env_int("LLM_MAX_ATTEMPTS", 3),
+        failure_threshold=env_int("LLM_FAILURE_THRESHOLD", 3),
+        cooldown=env_float("LLM_UNHEALTHY_COOLDOWN", 30.0),
+    )
@@ -0,0 +1,290 @@
+import asyncio
+import gzip
+import json
+import logging
+import math
+import os
+import struct
+import sys
+import time
+from array import array
+from collections import Counter
+from typing import Dict, List, Optional, Tuple
+
+from config import env_bool, env_float, env_int
+from entities import entity_set
+from metrics import LOCAL_INDEX_LOOKUPS
+from text_tokens import tokenize
+
+logger = logging.getLogger(__name__)
+
+FORMAT_VERSION = 2
+# File layout after gzip: three little-endian u64 lengths, a JSON header with the
+# docs and term list, then u32 arrays of posting offsets, doc ids and term frequencies
+_LENGTHS = struct.Struct("<QQQ")
+
+
+# Incremental BM25 index of search results already retrieved from the target sites.
+# Documents are keyed by link, so a page seen again replaces its older snippet.
+# lookup() answers a query locally only when enough fresh results score above the
+# thresholds; otherwise the caller falls back to live search. Postings are saved
+# as packed integer arrays; after a load each term's postings are unpacked into a
+# dict only when a query or update first touches that term, so startup is fast.
+class SnippetIndex:
+    def __init__(
+        self,
+        path: Optional[str] = None,
+        enabled: bool = False,
+        max_docs: int = 50000,
+        max_age: float = 7 * 86400.0,
+        min_score: float = 1.0,
+        min_coverage: float = 0.7,
+        min_results: int = 3,
+        top_k: int = 5,
+        k1: float = 1.2,
+        b: float = 0.75,
+    ):
+        self.path = path
+        self.enabled = enabled
+        self.max_docs = max_docs
+        self.max_age = max_age
+        self.min_score = min_score
+        self.min_coverage = min_coverage
+        self.min_results = min_results
+        self.top_k = top_k
+        self.k1 = k1
+        self.b = b
+        # doc id -> [link, title, snippet, fetched_at, length]; None marks a removed doc
+        self._docs: List[Optional[list]] = []
+        self._ids: Dict[str, int] = {}
+        self._postings: Dict[str, Dict[int, int]] = {}
+        # Postings loaded from disk and not unpacked yet: term -> slot in the arrays below
+        self._packed_terms: Dict[str, int] = {}
+        self._packed_offsets = array("I")
+        self._packed_ids = array("I")
+        self._packed_tfs = array("I")
+        self._total_length = 0
+        self.dirty = False
+
+    def __len__(self) -> int:
+        return len(self._ids)
+
+    def _get_postings(self, term: str) -> Optional[Dict[int, int]]:
+        postings = self._postings.get(term)
+        if postings is None and term in self._packed_terms:
+            slot = self._packed_terms.pop(term)
+            start, end = self._packed_offsets[slot], self._packed_offsets[slot + 1]
+            postings = self._postings[term] = dict(zip(self._packed_ids[start:end], self._packed_tfs[start:end]))
+        return postings
+
+    def _remove(self, doc_id: int):
+        link, title, snippet, _, length = self._docs[doc_id]
+        for term in set(tokenize(f"{title} {snippet}")):
+            postings = self._get_postings(term)
+            if postings is not None:
+                postings.pop(doc_id, None)
+                if not postings:
+                    del self._postings[term]
+        self._total_length -= length
+        self._docs[doc_id] = None
+        del self._ids[link]
+
+    def add(self, items: List[Dict], fetched_at: Optional[float] = None):
+        fetched_at = fetched_at or time.time()
+        for item in items:
+            link = item.get("link")
+            if not link:
+                continue
+            if link in self._ids:
+                self._remove(self._ids[link])
+            terms = Counter(tokenize(f"{item['title']} {item['snippet']}"))
+            length = sum(terms.values())
+            doc_id = len(self._docs)
+            self._docs.append([link, item["title"], item["snippet"], fetched_at, length])
+            self._ids[link] = doc_id
+            for term, count in terms.items():
+                postings = self._get_postings(term)
+                if postings is None:
+                    postings = self._postings[term] = {}
+                postings[doc_id] = count
+            self._total_length += length
+            self.dirty = True
+        # Once over the cap, drop the oldest tenth in one pass rather than one doc per add
+        if len(self._ids) > self.max_docs:
+            keep = int(self.max_docs * 0.9)
+            for doc_id in sorted(self._ids.values(), key=lambda i: self._docs[i][3])[:len(self._ids) - keep]:
+                self._remove(doc_id)
+
+    # BM25 over title and snippet; returns (score, query-term coverage, doc) best first.
+    # Coverage is weighted by IDF, so missing a rare term such as an insurer name
+    # costs far more than missing "plan"; a term no doc contains has the highest IDF.
+    def search(self, query: str, k: Optional[int] = None) -> List[Tuple[float, float, list]]:
+        terms = set(tokenize(query))
+        if not terms or not self._ids:
+            return []
+        n = len(self._ids)
+        average_length = self._total_length / n or 1.0
+        scores: Dict[int, float] = {}
+        matched: Dict[int, float] = {}
+        total_idf = 0.0
+        for term in terms:
+            postings = self._get_postings(term)
+            document_frequency = len(postings) if postings else 0
+            idf = math.log(1 + (n - document_frequency + 0.5) / (document_frequency + 0.5))
+            total_idf += idf
+            if not postings:
+                continue
+            for doc_id, tf in postings.items():
+                length = self._docs[doc_id][4]
+                norm = tf * (self.k1 + 1) / (tf + self.k1 * (1 - self.b + self.b * length / average_length))
+                scores[doc_id] = scores.get(doc_id, 0.0) + idf * norm
+                matched[doc_id] = matched.get(doc_id, 0.0) + idf
+        best = sorted(scores.items(), key=lambda entry: entry[1], reverse=True)[:k or self.top_k]
+        return [(score, matched[doc_id] / total_idf, self._docs[doc_id]) for doc_id, score in best]
+
+    # Local answer for a query as search items, or None to fall back to live search.
+    # A result must also name every insurer and product the query names, so pages
+    # about another insurer never stand in for the one asked about.
+    def lookup(self, query: str) -> Optional[List[Dict]]:
+        now = time.time()
+        results = self.search(query, k=self.top_k * 2)
+        if not results:
+            LOCAL_INDEX_LOOKUPS.inc("empty")
+            return None
+        entities = entity_set(query)
+        relevant = [
+            result for result in results
+            if result[0] >= self.min_score and result[1] >= self.min_coverage
+            and entities <= entity_set(f"{result[2][1]} {result[2][2]}")
+        ]
+        good = [result for result in relevant if now - result[2][3] <= self.max_age]
+        if len(good) < self.min_results:
+            LOCAL_INDEX_LOOKUPS.inc("stale" if len(relevant) >= self.min_results else "low_score")
+            return None
+        LOCAL_INDEX_LOOKUPS.inc("hit")
+        return [{"title": doc[1], "snippet": doc[2], "link": doc[0]} for _, _, doc in good[:self.top_k]]
+
+    # Shallow copies taken on the event loop; docs and packed arrays are never
+    # mutated in place, so the copy can be serialized safely in a thread
+    def _snapshot(self) -> Tuple:
+        postings = {term: dict(entries) for term, entries in self._postings.items()}
+        return list(self._docs), postings, dict(self._packed_terms), \
+            (self._packed_offsets, self._packed_ids, self._packed_tfs)
+
+    # Live docs renumbered densely plus packed postings
+    @staticmethod
+    def _serialize(snapshot: Tuple) -> bytes:
+        all_docs, postings, packed_terms, (packed_offsets, packed_ids, packed_tfs) = snapshot
+        renumber = {}
+        docs = []
+        for doc_id, doc in enumerate(all_docs):
+            if doc is not None:
+                renumber[doc_id] = len(docs)
+                docs.append(doc)
+        compact = len(docs) == len(all_docs)
+        terms, offsets, ids, tfs = [], array("I", [0]), array("I"), array("I")
+        for term, entries in postings.items():
+            terms.append(term)
+            ids.extend(entries if compact else (renumber[doc_id] for doc_id in entries))
+            tfs.extend(entries.values())
+            offsets.append(len(ids))
+        for term, slot in packed_terms.items():
+            start, end = packed_offsets[slot], packed_offsets[slot + 1]
+            terms.append(term)
+            ids.extend(packed_ids[start:end] if compact else (renumber[doc_id] for doc_id in packed_ids[start:end]))
+            tfs.extend(packed_tfs[start:end])
+            offsets.append(len(ids))
+        header = json.dumps({"version": FORMAT_VERSION, "docs": docs, "terms": terms},
+                            ensure_ascii=False, separators=(",", ":")).encode("utf-8")
+        if sys.byteorder != "little":
+            for packed in (offsets, ids, tfs):
+                packed.byteswap()
+        return b"".join((_LENGTHS.pack(len(header), len(offsets), len(ids)), header,
+                         offsets.tobytes(), ids.tobytes(), tfs.tobytes()))
+
+    def _deserialize(self, data: bytes):
+        header_length, offsets_length, ids_length = _LENGTHS.unpack_from(data)
+        position = _LENGTHS.size
+        header = json.loads(data[position:position + header_length])
+        if header.get("version") != FORMAT_VERSION:
+            raise ValueError(f"unsupported version {header.get('version')}")
+        position += header_length
+        packed = []
+        for length in (offsets_length, ids_length, ids_length):
+            values = array("I")
+            values.frombytes(data[position:position + length * values.itemsize])
+            if sys.byteorder != "little":
+                values.byteswap()
+            position += length * values.itemsize
+            packed.append(values)
+        self._docs = header["docs"]
+        self._ids = {doc[0]: doc_id for doc_id, doc in enumerate(self._docs)}
+        self._postings = {}
+        self._packed_terms = {term: slot for slot, term in enumerate(header["terms"])}
+        self._packed_offsets, self._packed_ids, self._packed_tfs = packed
+        self._total_length = sum(doc[4] for doc in self._docs)
+
+    def load(self):
+        if not self.path or not os.path.exists(self.path):
+            return
+        start = time.perf_counter()
+        try:
+            with gzip.open(self.path, "rb") as f:
+                self._deserialize(f.read())
+        except (OSError, ValueError, KeyError, struct.error) as e:
+            logger.error(f"Failed to load local index {self.path}: {e}")
+            return
+        logger.info(f"Loaded local index: {len(self._ids)} docs in {(time.perf_counter() - start) * 1000:.0f}ms")
+
+    def _write(self, snapshot: Tuple):
+        payload = gzip.compress(self._serialize(snapshot), compresslevel=6)
+        tmp_path = f"{self.path}.tmp"
+        with open(tmp_path, "wb") as f:
+            f.write(payload)
+        os.replace(tmp_path, self.path)
+
+    async def save(self):
+        if not self.path or not self.dirty:
+            return
+        snapshot = self._snapshot()
+        self.dirty = False
+        try:
+            await asyncio.to_thread(self._write, snapshot)
+        except OSError as e:
+            self.dirty = True
+            logger.error(f"Failed to save local index {self.path}: {e}")
+
+    async def run_persistence(self, interval: float):
+        while True:
+            await asyncio.sleep(interval)
+            await self.save()
+
+    def stats(self) -> Dict:
+        return {
+            "enabled": self.enabled,
+            "docs": len(self._ids),
+            "terms": len(self._postings) + len(self._packed_terms),
+            "max_docs": self.max_docs,
+            "path": self.path,
+            "dirty": self.dirty,
+        }
+
+
+# LOCAL_INDEX_* settings; the index is loaded from LOCAL_INDEX_PATH at import
+def index_from_env() -> SnippetIndex:
+    index = SnippetIndex(
+        path=os.getenv("LOCAL_INDEX_PATH", "local_index.bin.gz"),
+        enabled=env_bool("LOCAL_INDEX_ENABLED", False),
+        max_docs=env_int("LOCAL_INDEX_MAX_DOCS", 50000),
+        max_age=env_float("LOCAL_INDEX_MAX_AGE", 7 * 86400.0),
+        min_score=env_float("LOCAL_INDEX_MIN_SCORE", 1.0),
+        min_coverage=env_float("LOCAL_INDEX_MIN_COVERAGE", 0.7),
+        min_results=env_int("LOCAL_INDEX_MIN_RESULTS", 3),
+        top_k=env_int("LOCAL_INDEX_TOP_K", 5),
+    )
+    if index.enabled:
+        index.load()
+    return index
+
+
+snippet_index = index_from_env()
@@ -0,0 +1,125 @@
+import atexit
+import json
+import logging
+import os
+import queue
+import random
+import reprlib
+import sys
+from logging.handlers import QueueHandler, QueueListener
+from typing import Dict, Optional
+
+from config import env_bool, env_float, env_int
+
+# One switch for request/response payload logging (replaces the old IsProduction
+# print/log branches). Payloads are truncated and can be sampled per endpoint.
+LOG_PAYLOADS = env_bool("LOG_PAYLOADS", True)
+LOG_PAYLOAD_MAX_CHARS = env_int("LOG_PAYLOAD_MAX_CHARS", 2000)
+LOG_SAMPLE_RATE = env_float("LOG_SAMPLE_RATE", 1.0)
+LOG_SAMPLE_RATES: Dict[str, float] = {
+    endpoint: float(rate) for endpoint, rate in json.loads(os.getenv("LOG_SAMPLE_RATES", "{}")).items()
+}
+
+TEXT_FORMAT = "%(asctime)s - %(levelname)s - %(message)s"
+
+# Attributes every LogRecord has; anything else was passed through `extra`
+_RECORD_FIELDS = set(vars(logging.makeLogRecord({}))) | {"message", "asctime"}
+
+# Bounded repr: stops walking long message lists instead of rendering them in full
+_payload_repr = reprlib.Repr()
+_payload_repr.maxlevel = 4
+_payload_repr.maxlist = 20
+_payload_repr.maxdict = 20
+_payload_repr.maxstring = LOG_PAYLOAD_MAX_CHARS
+_payload_repr.maxother = 200
+
+
+def _extra_fields(record: logging.LogRecord) -> Dict:
+    return {key: value for key, value in vars(record).items() if key not in _RECORD_FIELDS}
+
+
+# One JSON object per line with the `extra` fields at the top level
+class JsonFormatter(logging.Formatter):
+    def format(self, record: logging.LogRecord) -> str:
+        entry = {
+            "ts": self.formatTime(record),
+            "level": record.levelname,
+            "logger": record.name,
+            "message": record.getMessage(),
+            **_extra_fields(record),
+        }
+        if record.exc_info:
+            entry["exc_info"] = self.formatException(record.exc_info)
+        return json.dumps(entry, ensure_ascii=False, default=str)
+
+
+# The existing text layout with `extra` fields appended as key=value pairs
+class TextFormatter(logging.Formatter):
+    def __init__(self):
+        super().__init__(TEXT_FORMAT)
+
+    def format(self, record: logging.LogRecord) -> str:
+        line = super().format(record)
+        fields = _extra_fields(record)
+        if fields:
+            line += " " + " ".join(f"{key}={value}" for key, value in fields.items())
+        return line
+
+
+# A full queue drops the record instead of blocking the request that logged it
+class _DroppingQueueHandler(QueueHandler):
+    dropped = 0
+
+    def enqueue(self, record: logging.LogRecord):
+        try:
+            self.queue.put_nowait(record)
+        except queue.Full:
+            _DroppingQueueHandler.dropped += 1
+
+
+# Route all records through a queue to a writer thread, so formatting and stdout
+# writes never block the event loop. LOG_FORMAT=json emits structured records.
+def configure_logging() -> QueueListener:
+    handler = logging.StreamHandler(sys.stdout)
+    handler.setFormatter(JsonFormatter() if os.getenv("LOG_FORMAT", "text") == "json" else TextFormatter())
+    log_queue: queue.Queue = queue.Queue(maxsize=env_int("LOG_QUEUE_SIZE", 10000))
+    listener = QueueListener(log_queue, handler, respect_handler_level=True)
+
+    root = logging.getLogger()
+    root.handlers = [_DroppingQueueHandler(log_queue)]
+    root.setLevel(os.getenv("LOG_LEVEL", "INFO").upper())
+    # httpx logs every upstream request at INFO; keep it quiet unless asked for
+    for name in ("httpx", "httpcore"):
+        logging.getLogger(name).setLevel(os.getenv("LOG_HTTP_CLIENT_LEVEL", "WARNING").upper())
+
+    listener.start()
+    atexit.register(listener.stop)
+    return listener
+
+
+# Short, bounded rendering of a payload for logs
+def clip(value, limit: Optional[int] = None) -> str:
+    limit = limit or LOG_PAYLOAD_MAX_CHARS
+    text = value if isinstance(value, str) else _payload_repr.repr(value)
+    if len(text) > limit:
+        return f"{text[:limit]}...(+{len(text) - limit} chars)"
+    return text
+
+
+def payload_sampled(endpoint: str) -> bool:
+    if not LOG_PAYLOADS:
+        return False
+    rate = LOG_SAMPLE_RATES.get(endpoint, LOG_SAMPLE_RATE)
+    return rate >= 1.0 or random.random() < rate
+
+
+# Log request/response payloads as one structured record: checked against the
+# level and sampling rate first, so skipped records cost no formatting at all
+def log_payload(logger: logging.Logger, endpoint: str, event: str, **payload):
+    if not logger.isEnabledFor(logging.INFO) or not payload_sampled(endpoint):
+        return
+    logger.info(event, extra={"endpoint": endpoint, **{key: clip(value) for key, value in payload.items()}})
+
+
+def dropped_records() -> int:
+    return _DroppingQueueHandler.dropped
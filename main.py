@@ -1,23 +1,47 @@
-from fastapi import FastAPI, HTTPException, Request
+# Imported first so the startup report can time every import below
+from startup import STARTUP_MODE, FirstResponseMiddleware, startup_report
+from fastapi import FastAPI, HTTPException, Request, Response
 from fastapi.middleware.cors import CORSMiddleware
+from fastapi.responses import PlainTextResponse, StreamingResponse
 import os
-import requests
 import logging
 from dotenv import load_dotenv
-from openai import OpenAI
-import httpx
-from openai import AsyncOpenAI
 from pydantic import BaseModel
-from typing import List, Dict, Optional
+from typing import Awaitable, Callable, List, Dict, Literal, Optional, Tuple
 import time
 import asyncio
+from dataclasses import replace
+from batch import BATCH_HEADERS, BATCH_MAX_CONCURRENCY, BATCH_MAX_ITEMS, BATCH_MEDIA_TYPES, SharedCalls, encode_batch, run_batch
+from bulkhead import StreamSlot, bulkheads
+from cache import cache_from_env, normalize_query
+from clients import upstreams
+from completion_cache import completion_cache, completion_cache_key
+from config import env_bool, env_float
+from context_budget import CONTEXT_HEADERS, context_budget
+from deadlines import SEARCH_DEADLINE_SHARE, RequestCancelled, RequestDeadline
+from fast_json import FastJSONResponse, loads as json_loads
+from jobs import job_manager_from_env
+from logging_setup import configure_logging, dropped_records, log_payload
+from local_index import snippet_index
+from llm_router import ROUTING_HEADERS, is_api_status_error, model_label, record_usage, router_from_env
+from metrics import CONTEXT_TOKENS, CONTEXT_TOKENS_SAVED, STAGE_LATENCY, MetricsMiddleware, registry as metrics_registry, set_request_label
+from near_duplicate import index_from_env
+from page_fetch import page_fetcher
+from query_planner import SubQuery, query_planner
+from resilience import CIRCUIT_STATES
+from search import format_search_results, google_search, search_orchestrator
+from search_gate import SEARCH_GATE_HEADERS, GateDecision, search_gate
+from singleflight import SingleFlight
+from streaming import SSE_HEADERS, ClosingStreamingResponse, rewrite_think_tags, stream_openai_completion
+
+# STARTUP_MODE=eager loads the provider SDKs now; otherwise they load on first use
+# or, by default, in the background once the server is up
+if STARTUP_MODE == "eager":
+    startup_report.load_provider_modules()
 
 # Load environment variables from .env file
 load_dotenv()
 
-# Set production flag (assumed False for development; adjust as needed)
-IsProduction = False
-
 # Initialize FastAPI application
 app = FastAPI()
 
@@ -27,13 +51,17 @@ app.add_middleware(
     allow_origins=["*"],
     allow_methods=["*"],
     allow_headers=["*"],
+    expose_headers=ROUTING_HEADERS + CONTEXT_HEADERS + SEARCH_GATE_HEADERS,
 )
 
-# Configure logging
-logging.basicConfig(
-    level=logging.INFO,
-    format='%(asctime)s - %(levelname)s - %(message)s'
-)
+# Record request counts, latency and in-flight gauges for /metrics
+app.add_middleware(MetricsMiddleware, routes=lambda: app.routes)
+# Outermost, so the first response of the process is timed as the client sees it
+app.add_middleware(FirstResponseMiddleware, report=startup_report)
+
+# Logging goes through a queue to a writer thread; LOG_PAYLOADS, LOG_SAMPLE_RATES
+# and LOG_PAYLOAD_MAX_CHARS control how much of each request is logged
+log_listener = configure_logging()
 logger = logging.getLogger(__name__)
 
 # Retrieve API keys from environment variables
@@ -44,240 +72,618 @@ GROK2_API_KEY = os.getenv("GROK2_API_KEY")
 GOOGLE_API_KEY = os.getenv("GOOGLE_API_KEY")
 GOOGLE_CX = os.getenv("GOOGLE_CX")
 
-# Global in-memory cache for search results
-search_cache = {}  # Format: {query: (timestamp, result)}
+# Where /api/dswithsearch places the per-turn search context: "context_first" or "cache_friendly"
+PROMPT_LAYOUT = os.getenv("PROMPT_LAYOUT", "context_first")
+
+# Non-streaming /api/ppxty calls Perplexity over plain HTTP with fast JSON handling
+# instead of through the OpenAI SDK; PPXTY_PASSTHROUGH=false restores the SDK path
+PPXTY_PASSTHROUGH = env_bool("PPXTY_PASSTHROUGH", True)
+# Perplexity response fields passed on to the client next to the message
+PASSTHROUGH_FIELDS = ("citations", "search_results", "usage")
+
+# Provider router behind the chat endpoints; providers without an API key are skipped
+llm_router = router_from_env({
+    "deepseek": DEEPSEEK_API_KEY,
+    "perplexity": PERPLEXITY_API_KEY,
+    "grok": GROK2_API_KEY,
+})
+
+# Global cache for search results, keyed by normalized query.
+# SEARCH_CACHE_BACKEND=sqlite shares it across hypercorn workers and restarts.
+search_cache = cache_from_env("SEARCH_CACHE", max_entries=1000, max_bytes=8 * 1024 * 1024, ttl=300.0)
+# Concurrent cache misses for the same normalized query share one search call
+search_flights = SingleFlight()
+# MinHash/LSH index over this worker's cached queries, so a near-identical
+# phrasing can reuse a fresh result (SEARCH_SIMILARITY_THRESHOLD)
+similar_queries = index_from_env()
 
 # Pydantic model for chat request payload
 class ChatRequest(BaseModel):
     messages: List[Dict]
     model: str
+    stream: bool = False  # Opt in to Server-Sent Events instead of a single JSON response
+
+# One item of a batch; search=True runs it like /api/dswithsearch
+class BatchItem(BaseModel):
+    id: Optional[str] = None
+    messages: List[Dict]
+    model: str
+    search: bool = False
 
-# Asynchronous function to fetch SerpAPI search results with caching
+# A background job: one chat item plus an optional URL to POST the finished job to
+class JobRequest(BatchItem):
+    callback_url: Optional[str] = None
+
+class BatchRequest(BaseModel):
+    items: List[BatchItem]
+    format: Literal["ndjson", "sse"] = "ndjson"
+    max_concurrency: Optional[int] = None  # Capped at BATCH_MAX_CONCURRENCY
+
+# Check the shape of a chat body without building a pydantic model per message,
+# so the messages are used as parsed rather than validated and copied again
+def parse_chat_request(body: bytes) -> ChatRequest:
+    try:
+        data = json_loads(body)
+    except ValueError:
+        raise HTTPException(status_code=422, detail="Request body is not valid JSON")
+    if not isinstance(data, dict) or not isinstance(data.get("model"), str) \
+            or not isinstance(data.get("messages"), list) \
+            or not all(isinstance(message, dict) for message in data["messages"]) \
+            or not isinstance(data.get("stream", False), bool):
+        raise HTTPException(status_code=422, detail="Expected a JSON object with model, messages and optional stream")
+    return ChatRequest.model_construct(messages=data["messages"], model=data["model"], stream=data.get("stream", False))
+
+# Latest user message content, used as the search query
+def latest_user_content(messages: List[Dict]) -> Optional[str]:
+    latest_user_message = next((msg for msg in reversed(messages) if msg.get("role") == "user"), None)
+    return latest_user_message.get("content", "") if latest_user_message else None
+
+# Add the search context as a system message when there is one.
+# PROMPT_LAYOUT=cache_friendly puts it just before the latest user message, so the
+# conversation so far stays a stable prefix the provider's prompt cache can reuse;
+# the default keeps it first, ahead of the whole conversation.
+def with_search_context(messages: List[Dict], search_context: str) -> List[Dict]:
+    if not search_context:
+        return list(messages)
+    context_message = {
+        "role": "system",
+        "content": f"Current web search context:\n{search_context}\n\nUse this information to supplement your response."
+    }
+    if PROMPT_LAYOUT == "cache_friendly":
+        latest_user = max((i for i, msg in enumerate(messages) if msg.get("role") == "user"), default=len(messages))
+        return list(messages[:latest_user]) + [context_message] + list(messages[latest_user:])
+    return [context_message] + list(messages)
+
+# Asynchronous function to fetch search results with caching.
+# SerpAPI is the primary provider; SEARCH_POLICY controls hedging to Google Custom Search.
 async def get_serpapi_search_results(query: str):
-    now = time.time()
-    # Check if query exists in cache and is within 5 minutes
-    if query in search_cache:
-        timestamp, result = search_cache[query]
-        if now - timestamp < 300:  # 5-minute expiration
-            logger.info(f"Cache hit for query: {query}")
-            return result
+    cache_key = normalize_query(query)
+    # Expired entries are dropped on lookup and the LRU bound caps the size
+    cached = search_cache.get(cache_key)
+    if cached is not None:
+        logger.info(f"Cache hit for query: {query}")
+        return cached
+    if similar_queries is not None:
+        match = similar_queries.find(cache_key)
+        if match is not None:
+            similar_key, similarity = match
+            # Counted as a similar hit only, not as a second exact lookup
+            cached = search_cache.get(similar_key, record_stats=False)
+            if cached is not None:
+                similar_queries.record_hit(similar_key)
+                logger.info(f"Similar cache hit for query: {query} ~ {similar_key} ({similarity:.2f})")
+                return cached
+            # The cached result expired; stop offering it
+            similar_queries.remove(similar_key)
     logger.info(f"Cache miss for query: {query}")
-    try:
-        # Define target sites for search filtering
-        target_sites = [
-            "site:manulife.com.hk",
-            "site:aia.com.hk",
-            "site:prudential.com.hk",
-            "site:axa.com.hk",
-            "site:sunlife.com.hk",
-            "site:chubb.com",
-            "site:scmp.com",
-            "site:hket.com",
-            "site:ft.com",
-            "site:moneyhero.com.hk",
-            "site:compareasia.com",
-            "site:policypal.com",
-            "site:ia.hk",
-            "site:sfc.hk",
-            "site:bloomberg.com",
-            "site:forbes.com"
-        ]
-        site_filter = f"({' OR '.join(target_sites)})"
-        full_query = f"{query} {site_filter}"
-        params = {
-            "engine": "google",
-            "q": full_query,
-            "api_key": SERPAPI_API_KEY,
-            "google_domain": "google.com.hk",
-            "hl": "en",
-            "gl": "hk",
-            "num": 5
-        }
-        async with httpx.AsyncClient() as client:
-            response = await client.get("https://serpapi.com/search", params=params)
-            response.raise_for_status()
-            data = response.json()
-        
-        # Process search results
-        search_context = []
-        for result in data.get("organic_results", [])[:5]:
-            context_entry = (
-                f"Title: {result.get('title', 'N/A')}\n"
-                f"Snippet: {result.get('snippet', 'No description available')}\n"
-                f"Link: {result.get('link', '')}"
-            )
-            search_context.append(context_entry)
-        print("search_context",search_context)
-        result = "\n\n".join(search_context) if search_context else "No relevant results found"
-        # Cache successful results only
-        if result != "No relevant results found":
-            search_cache[query] = (now, result)
-        return result
-    except Exception as e:
-        logger.error(f"Search failed: {str(e)}")
-        return "Search service unavailable"
+    return await search_flights.do(cache_key, lambda: fetch_serpapi_search_results(query, cache_key))
+
+# Run the search policy and fill the cache; runs once per key however many callers are waiting
+async def fetch_serpapi_search_results(query: str, cache_key: str):
+    # Comparison questions are split into per-insurer searches (see query_planner.py)
+    sub_queries = query_planner.plan(query)
+    # Previously retrieved snippets answer the query when they match well and are fresh
+    items = snippet_index.lookup(query) if snippet_index.enabled and sub_queries is None else None
+    if items is None:
+        try:
+            if sub_queries is not None:
+                items = await search_planned(sub_queries)
+            else:
+                items = await search_orchestrator.search(query)
+        except Exception as e:
+            logger.error(f"Search failed: {str(e)}")
+            return "Search service unavailable"
+        if snippet_index.enabled:
+            snippet_index.add(items)
+    result = format_search_results(items)
+    # Optional retrieval stage: the best-matching passages from the top result pages
+    if items and page_fetcher.enabled:
+        with STAGE_LATENCY.time("search", "page_fetch"):
+            excerpts = await page_fetcher.relevant_context(query, items)
+        if excerpts:
+            result = f"{result}\n\nRelevant page excerpts:\n{excerpts}"
+    log_payload(logger, "search", "Search results", query=query, search_context=result)
+    # Cache successful results only
+    if items:
+        search_cache.set(cache_key, result)
+        if similar_queries is not None:
+            similar_queries.add(cache_key)
+    return result
+
+# One sub-query of a planned search, cached on its own as result items so later
+# comparisons that share an insurer merge it again without a search
+async def search_sub_query(sub: SubQuery) -> List[Dict]:
+    cached = search_cache.get(sub.cache_key)
+    if cached is not None:
+        query_planner.record_sub_query("cached")
+        return cached
 
-# Asynchronous function to fetch Google Custom Search results (unused in active endpoints)
+    async def fetch():
+        try:
+            items = await search_orchestrator.search(sub.query, sites=sub.sites)
+        except Exception:
+            query_planner.record_sub_query("failed")
+            raise
+        query_planner.record_sub_query("searched" if items else "empty")
+        if items:
+            search_cache.set(sub.cache_key, items)
+        return items
+
+    return await search_flights.do(sub.cache_key, fetch)
+
+# Run the sub-queries concurrently and merge their results under the planner's
+# snippet budget; fails only when every sub-query failed
+async def search_planned(sub_queries: List[SubQuery]) -> List[Dict]:
+    results = await asyncio.gather(*(search_sub_query(sub) for sub in sub_queries), return_exceptions=True)
+    answered = []
+    for sub, result in zip(sub_queries, results):
+        if isinstance(result, BaseException):
+            logger.warning(f"Sub-query {sub.label!r} failed: {str(result)}")
+        else:
+            answered.append(result)
+    if not answered:
+        raise results[0]
+    logger.info(f"Planned search: {', '.join(f'{sub.label}: {sub.query}' for sub in sub_queries)}")
+    return query_planner.merge(answered)
+
+# Asynchronous function to fetch Google Custom Search results only
 async def get_google_search_results(query: str):
     """Get search results using Google Custom Search JSON API"""
-    target_sites = [
-        "site:manulife.com.hk",
-        "site:aia.com.hk",
-        "site:prudential.com.hk",
-        "site:axa.com.hk",
-        "site:sunlife.com.hk",
-        "site:chubb.com",
-        "site:scmp.com",
-        "site:hket.com",
-        "site:ft.com",
-        "site:moneyhero.com.hk",
-        "site:compareasia.com",
-        "site:policypal.com",
-        "site:ia.hk",
-        "site:sfc.hk",
-        "site:bloomberg.com",
-        "site:forbes.com"
-    ]
-    site_filter = f"({' OR '.join(target_sites)})"
-    full_query = f"{query} {site_filter}"
-    params = {
-        "key": GOOGLE_API_KEY,
-        "cx": GOOGLE_CX,
-        "q": full_query,
-        "num": 5,
-        "gl": "hk",
-        "sort": "date",
-        "fields": "items(title,link,snippet)"
-    }
     try:
-        async with httpx.AsyncClient() as client:
-            response = await client.get(
-                "https://www.googleapis.com/customsearch/v1",
-                params=params
-            )
-            response.raise_for_status()
-            data = response.json()
-        
-        search_context = []
-        for result in data.get("items", [])[:5]:
-            context_entry = (
-                f"Title: {result.get('title', 'N/A')}\n"
-                f"Snippet: {result.get('snippet', 'No description available')}\n"
-                f"Link: {result.get('link', '')}"
-            )
-            search_context.append(context_entry)
-        
-        return "\n\n".join(search_context) if search_context else "No relevant results found"
+        return format_search_results(await google_search(query))
     except Exception as e:
         logger.error(f"Google search failed: {str(e)}")
         return "Search service unavailable"
 
-# Perplexity endpoint
-@app.post("/api/ppxty")
-async def chat_endpoint(chat_request: ChatRequest):
+# Search context for the latest user turn, unless the search gate finds the turn
+# needs no new search: a reused context comes from the search cache entry of the
+# most recent earlier user turn that has one (the previous turn may have reused or
+# skipped itself), a skip answers from the conversation alone. `search` runs the
+# lookup, so callers can put it under a deadline or share it across a batch.
+async def gated_search_context(endpoint: str, messages: List[Dict], query: str,
+                               search: Callable[[str], Awaitable[str]],
+                               override: Optional[str] = None) -> Tuple[str, GateDecision]:
+    gate = search_gate.decide(messages, query, override)
+    if gate.decision == "reuse":
+        for earlier in search_gate.reuse_candidates(messages, query):
+            search_context = search_cache.get(normalize_query(earlier), record_stats=False)
+            if search_context is not None:
+                gate = replace(gate, query=earlier)
+                search_gate.record(gate)
+                return search_context, gate
+        gate = replace(gate, decision="skip")
+    search_gate.record(gate)
+    if gate.decision == "skip":
+        logger.info(f"Search skipped ({gate.reason}) for: {query}")
+        return "", gate
+    start = time.perf_counter()
+    with STAGE_LATENCY.time(endpoint, "search"):
+        search_context = await search(gate.query)
+    search_gate.record_search(time.perf_counter() - start, search_context)
+    return search_context, gate
+
+# Fit the prompt into the model's token budget before it leaves the building
+def fit_context(model: str, messages: List[Dict]):
+    trimmed = context_budget.trim(model, messages)
+    CONTEXT_TOKENS.observe(model_label(model), value=trimmed.tokens_after)
+    if trimmed.tokens_saved:
+        CONTEXT_TOKENS_SAVED.inc(model_label(model), amount=trimmed.tokens_saved)
+    return trimmed
+
+# Run a chat completion through the provider router.
+# Streaming requests get SSE; others go through the completion cache. Either way
+# the routing decision is returned in X-LLM-* headers. The per-model bulkhead
+# slot is held until the answer (or the whole stream) has been produced. With a
+# `deadline`, a stream also stops at the request deadline and its cancellations
+# are counted.
+async def routed_chat_completion(endpoint: str, chat_request: ChatRequest, messages: List[Dict], default_provider: str,
+                                 response: Response, cache_key: str, rewrite_tags: bool = False,
+                                 deadline: Optional[RequestDeadline] = None, **params):
+    set_request_label("model", model_label(chat_request.model))
+    trimmed = fit_context(chat_request.model, messages)
+    messages = trimmed.messages
+    bulkhead = bulkheads.model(model_label(chat_request.model))
+    if chat_request.stream:
+        acquired_at = await bulkhead.acquire()
+        try:
+            with STAGE_LATENCY.time(endpoint, "llm"):
+                stream, decision = await llm_router.open_stream(chat_request.model, messages, default_provider, **params)
+        except BaseException:
+            bulkhead.release(acquired_at)
+            raise
+        slot = StreamSlot(bulkhead, acquired_at, stream)
+        return ClosingStreamingResponse(
+            slot.relay(
+                stream_openai_completion(
+                    stream,
+                    lambda usage: record_usage(decision.provider, decision.model, usage),
+                    on_cancel=deadline.stream_cancelled if deadline else None,
+                    expires_at=deadline.expires_at if deadline else None,
+                )
+            ),
+            on_close=slot.close,
+            media_type="text/event-stream",
+            headers={**SSE_HEADERS, **decision.headers(), **trimmed.headers()},
+        )
+
+    async def call_llm():
+        async with bulkhead.slot():
+            with STAGE_LATENCY.time(endpoint, "llm"):
+                content, decision = await llm_router.complete(chat_request.model, messages, default_provider, **params)
+        if rewrite_tags:
+            content = rewrite_think_tags(content)
+        return {"message": content, "route": decision.headers()}
+
+    result = await completion_cache.get_or_compute(cache_key, call_llm)
+    response.headers.update(result["route"])
+    response.headers.update(trimmed.headers())
+    return {"message": result["message"]}
+
+# Non-streaming pass-through completion.
+# The provider's JSON is parsed once, the answer goes through the same <think> tag
+# rewriter as streams, and extra fields such as Perplexity's citations and usage
+# are returned next to the message. The response body is written with fast_json
+# and gzipped when RESPONSE_COMPRESSION allows.
+async def passthrough_chat_completion(endpoint: str, chat_request: ChatRequest, default_provider: str, cache_key: str,
+                                      accept_encoding: str = "", **params) -> Response:
+    set_request_label("model", model_label(chat_request.model))
+    trimmed = fit_context(chat_request.model, chat_request.messages)
+    bulkhead = bulkheads.model(model_label(chat_request.model))
+
+    async def call_llm():
+        async with bulkhead.slot():
+            with STAGE_LATENCY.time(endpoint, "llm"):
+                data, decision = await llm_router.complete_raw(chat_request.model, trimmed.messages, default_provider, **params)
+        result = {"message": rewrite_think_tags(data["choices"][0]["message"]["content"] or ""), "route": decision.headers()}
+        for name in PASSTHROUGH_FIELDS:
+            if data.get(name) is not None:
+                result[name] = data[name]
+        return result
+
+    result = await completion_cache.get_or_compute(cache_key, call_llm)
+    body = {name: value for name, value in result.items() if name != "route"}
+    return FastJSONResponse(body, headers={**result["route"], **trimmed.headers()}, accept_encoding=accept_encoding)
+
+# Perplexity endpoint.
+# The body is parsed with fast_json rather than validated into a ChatRequest, so
+# the schema is declared for the OpenAPI docs by hand.
+@app.post("/api/ppxty", openapi_extra={"requestBody": {
+    "required": True, "content": {"application/json": {"schema": ChatRequest.model_json_schema()}},
+}})
+async def chat_endpoint(request: Request, response: Response):
     try:
+        chat_request = parse_chat_request(await request.body())
         messages = chat_request.messages
         model = chat_request.model
-        logger.info(f"Received request with messages: {messages}")
-        
-        url = "https://api.perplexity.ai/chat/completions"
-        payload = {
-            "model": model,
-            "messages": messages,
-            "max_tokens": 2000,
-        }
-        headers = {
-            "Authorization": f"Bearer {PERPLEXITY_API_KEY}",
-            "Content-Type": "application/json"
-        }
-        async with httpx.AsyncClient() as client:
-            response = await client.post(url, json=payload, headers=headers, timeout=30.0)
-            response.raise_for_status()
-            result = response.json()
-            original_content = result['choices'][0]['message']['content']
-            modified_content = original_content.replace("<think>", "<AIM AI助手>").replace("</think>", "</AIM AI助手>")
-            return {"message": modified_content}
-    except httpx.HTTPStatusError as e:
-        logger.error(f"HTTP Error: {e.response.text}")
-        raise HTTPException(status_code=e.response.status_code, detail=e.response.text)
+        log_payload(logger, "/api/ppxty", "Received request", model=model, messages=messages)
+        cache_key = completion_cache_key("ppxty", model, messages)
+        async with RequestDeadline(request, "/api/ppxty", model) as deadline:
+            if PPXTY_PASSTHROUGH and not chat_request.stream:
+                return await deadline.run("llm", passthrough_chat_completion(
+                    "/api/ppxty", chat_request, "perplexity", cache_key, request.headers.get("accept-encoding", ""), max_tokens=2000
+                ))
+            return await deadline.run("llm", routed_chat_completion(
+                "/api/ppxty", chat_request, messages, "perplexity", response, cache_key, rewrite_tags=True,
+                deadline=deadline, max_tokens=2000
+            ))
+    except HTTPException:
+        raise
     except Exception as e:
+        if is_api_status_error(e):
+            logger.error(f"HTTP Error: {e.response.text}")
+            raise HTTPException(status_code=e.status_code, detail=e.response.text)
         logger.error(f"Unexpected error: {str(e)}")
         raise HTTPException(status_code=500, detail=str(e))
 
 # DeepSeek endpoint
 @app.post("/api/ds")
-async def deepseek_endpoint(chat_request: ChatRequest):
+async def deepseek_endpoint(chat_request: ChatRequest, request: Request, response: Response):
     try:
         messages = chat_request.messages
         model = chat_request.model
-        logger.info(f"Received DeepSeek request with messages: {messages}")
-        client = AsyncOpenAI(api_key=DEEPSEEK_API_KEY, base_url="https://api.deepseek.com")
-        response = await client.chat.completions.create(
-            model=model,
-            messages=messages,
-            stream=False
-        )
-        result = response.choices[0].message.content
-        logger.info(f"DeepSeek API Response: {result}")
-        return {"message": result}
+        log_payload(logger, "/api/ds", "Received DeepSeek request", model=model, messages=messages)
+        cache_key = completion_cache_key("ds", model, messages)
+        async with RequestDeadline(request, "/api/ds", model) as deadline:
+            result = await deadline.run("llm", routed_chat_completion(
+                "/api/ds", chat_request, messages, "deepseek", response, cache_key, deadline=deadline
+            ))
+        log_payload(logger, "/api/ds", "DeepSeek API response", response=result)
+        return result
+    except HTTPException:
+        raise
     except Exception as e:
         logger.error(f"Unexpected error in DeepSeek endpoint: {str(e)}")
         raise HTTPException(status_code=500, detail=str(e))
 
 # DeepSeek with search endpoint
 @app.post("/api/dswithsearch")
-async def deepseek_with_search_endpoint(chat_request: ChatRequest):
+async def deepseek_with_search_endpoint(chat_request: ChatRequest, request: Request, response: Response):
     # Extract the latest user message
-    latest_user_message = next(
-        (msg for msg in reversed(chat_request.messages) if msg.get("role") == "user"),
-        None
-    )
-    if not latest_user_message:
+    query = latest_user_content(chat_request.messages)
+    if query is None:
         raise HTTPException(status_code=400, detail="No user message found")
-    
-    # Fetch search context with caching
-    search_context = await get_serpapi_search_results(latest_user_message.get("content", ""))
-    if IsProduction:
-        logger.info(f"search_context={search_context}")
-    else:
-        print(f"search_context={search_context}")
-    
-    # Prepare messages with search context if available
-    messages = []
-    if search_context:
-        messages.append({
-            "role": "system",
-            "content": f"Current web search context:\n{search_context}\n\nUse this information to supplement your response."
-        })
-    messages.extend(chat_request.messages)
-    if IsProduction:
-        logger.info(f"messages={messages}")
-    else:
-        print(f"messages={messages}")
-    
-    print("messages",messages)
-    # Call DeepSeek API
-    try:
-        client = AsyncOpenAI(api_key=DEEPSEEK_API_KEY, base_url="https://api.deepseek.com")
-        response = await client.chat.completions.create(
-            model=chat_request.model,
-            messages=messages,
-            stream=False
+
+    async with RequestDeadline(request, "/api/dswithsearch", chat_request.model) as deadline:
+        # Fetch search context with caching, within SEARCH_DEADLINE_SHARE of the deadline
+        async def search(query: str) -> str:
+            try:
+                return await deadline.run("search", get_serpapi_search_results(query), share=SEARCH_DEADLINE_SHARE)
+            except RequestCancelled as e:
+                if e.reason != "deadline":
+                    raise
+                # Out of search budget: answer without web context rather than not at all
+                return ""
+
+        # X-Search: force|skip overrides the search gate for this request
+        search_context, gate = await gated_search_context(
+            "/api/dswithsearch", chat_request.messages, query, search, request.headers.get("x-search")
         )
-        return {"message": response.choices[0].message.content}
-    except Exception as e:
-        logger.error(f"DeepSeek error: {str(e)}")
-        raise HTTPException(status_code=500, detail="AI service error")
+        response.headers.update(gate.header)
+
+        # Prepare messages with search context if available
+        messages = with_search_context(chat_request.messages, search_context)
+        log_payload(logger, "/api/dswithsearch", "Received search request", model=chat_request.model,
+                    search_context=search_context, messages=messages)
+        # Call DeepSeek API with the rest of the deadline
+        try:
+            # The search context is part of the key so fresh search results are never masked
+            cache_key = completion_cache_key("dswithsearch", chat_request.model, chat_request.messages, search_context)
+            result = await deadline.run("llm", routed_chat_completion(
+                "/api/dswithsearch", chat_request, messages, "deepseek", response, cache_key, deadline=deadline
+            ))
+            # A stream is its own response and does not carry `response`'s headers
+            if isinstance(result, Response):
+                result.headers.update(gate.header)
+            return result
+        except HTTPException:
+            raise
+        except Exception as e:
+            logger.error(f"DeepSeek error: {str(e)}")
+            raise HTTPException(status_code=500, detail="AI service error")
+
+# Run one non-streaming chat item the way /api/ds or /api/dswithsearch would.
+# Shared by batch and job mode; `searches` lets items of one batch share lookups.
+async def run_chat_item(endpoint: str, item: BatchItem, searches: Optional[SharedCalls] = None) -> Dict:
+    chat_request = ChatRequest(messages=item.messages, model=item.model)
+    messages, search_context = item.messages, None
+    if item.search:
+        query = latest_user_content(item.messages)
+        if query is None:
+            raise HTTPException(status_code=400, detail="No user message found")
+        if searches is None:
+            search = get_serpapi_search_results
+        else:
+            async def search(query: str) -> str:
+                return await searches.do(normalize_query(query), lambda: get_serpapi_search_results(query))
+        search_context, _ = await gated_search_context(endpoint, item.messages, query, search)
+        messages = with_search_context(item.messages, search_context)
+    cache_namespace = "dswithsearch" if item.search else "ds"
+    cache_key = completion_cache_key(cache_namespace, item.model, item.messages, search_context)
+    response = Response()
+    result = await routed_chat_completion(endpoint, chat_request, messages, "deepseek", response, cache_key)
+    # Routing and context headers the single-item endpoints would have returned
+    return {"message": result["message"], "headers": {
+        name: value for name, value in response.headers.items() if name.startswith("x-")
+    }}
+
+# Batch endpoint for internal tools: runs many chat requests concurrently under a
+# fan-out limit and streams each result back (NDJSON or SSE) as soon as it finishes.
+# Items with the same search query share one lookup; a failed item is reported
+# with its own status and does not fail the batch.
+@app.post("/api/batch")
+async def batch_endpoint(batch_request: BatchRequest):
+    if not batch_request.items:
+        raise HTTPException(status_code=400, detail="No batch items")
+    if len(batch_request.items) > BATCH_MAX_ITEMS:
+        raise HTTPException(status_code=413, detail=f"At most {BATCH_MAX_ITEMS} items per batch")
+    concurrency = min(batch_request.max_concurrency or BATCH_MAX_CONCURRENCY, BATCH_MAX_CONCURRENCY)
+    searches = SharedCalls()
+
+    async def run_item(item: BatchItem) -> Dict:
+        return await run_chat_item("/api/batch", item, searches)
+
+    async def body():
+        try:
+            async for chunk in encode_batch(run_batch(batch_request.items, run_item, concurrency), batch_request.format):
+                yield chunk
+        finally:
+            searches.close()
+            logger.info(f"Batch of {len(batch_request.items)} items: {searches.calls} searches, {searches.shared} shared")
+
+    return StreamingResponse(
+        body(),
+        media_type=BATCH_MEDIA_TYPES[batch_request.format],
+        headers=BATCH_HEADERS[batch_request.format],
+    )
 
-# Startup event to initiate periodic cache cleanup
+# Background jobs run through the same path as batch items
+job_manager = job_manager_from_env(lambda payload: run_chat_item("/api/jobs", BatchItem(**payload)))
+
+# Submit a long-running completion (e.g. deepseek-reasoner) as a background job.
+# Returns 202 with the job id at once; poll GET /api/jobs/{job_id} for the result.
+# Resubmitting the same request, or the same Idempotency-Key, returns the existing job.
+@app.post("/api/jobs", status_code=202)
+async def submit_job_endpoint(job_request: JobRequest, request: Request):
+    payload = job_request.model_dump(exclude={"callback_url"})
+    idempotency_key = request.headers.get("Idempotency-Key")
+    if idempotency_key:
+        dedupe_key = f"key:{idempotency_key}"
+    else:
+        dedupe_key = completion_cache_key("job", job_request.model, job_request.messages, str(job_request.search))
+    job = job_manager.submit(payload, dedupe_key, job_request.callback_url)
+    return {"job_id": job["id"], "status": job["status"], "deduplicated": job.get("deduplicated", False)}
+
+# Status and, once finished, the result or error of a job
+@app.get("/api/jobs/{job_id}")
+async def get_job_endpoint(job_id: str):
+    job = job_manager.get(job_id)
+    if job is None:
+        raise HTTPException(status_code=404, detail="Job not found or expired")
+    return job
+
+# Startup event to open pooled upstream connections
 @app.on_event("startup")
 async def startup_event():
-    async def periodic_cleanup():
-        while True:
-            await asyncio.sleep(300)  # Run every 5 minutes
-            now = time.time()
-            # Remove entries older than 10 minutes
-            keys_to_delete = [k for k, (t, _) in search_cache.items() if now - t > 600]
-            for k in keys_to_delete:
-                del search_cache[k]
-    asyncio.create_task(periodic_cleanup())
\ No newline at end of file
+    upstreams.start()
+    job_manager.start()
+    # Persistent backends drop expired rows in the background
+    if snippet_index.enabled:
+        asyncio.create_task(snippet_index.run_persistence(env_float("LOCAL_INDEX_SAVE_INTERVAL", 300.0)))
+    for prefix, cache in (
+        ("SEARCH_CACHE", search_cache),
+        ("COMPLETION_CACHE", completion_cache.cache),
+        ("JOB_RESULTS", job_manager.store),
+        ("PAGE_CACHE", page_fetcher.cache),
+    ):
+        if hasattr(cache, "run_compaction"):
+            interval = env_float(f"{prefix}_COMPACT_INTERVAL", 300.0)
+            asyncio.create_task(cache.run_compaction(interval))
+    startup_report.mark_ready()
+    # The server starts listening once this handler returns; the SDK import and
+    # client setup then happen off the request path
+    if STARTUP_MODE == "background":
+        asyncio.create_task(startup_report.warm_up(after=llm_router.warm_clients))
+
+# Scrape-time metrics read from the counters behind the /api/*-stats endpoints
+def register_stats_metrics():
+    caches = {
+        "search": search_cache.stats,
+        "completion": completion_cache.cache.stats,
+        "pages": page_fetcher.cache.stats,
+    }
+    for field, kind, help_text in (
+        ("hits", "counter", "Cache hits"),
+        ("misses", "counter", "Cache misses"),
+        ("evictions", "counter", "Entries evicted to stay within size limits"),
+        ("entries", "gauge", "Entries currently cached"),
+        ("bytes", "gauge", "Bytes currently cached"),
+    ):
+        name = f"cache_{field}_total" if kind == "counter" else f"cache_{field}"
+        metrics_registry.callback(name, help_text, kind, ["cache"],
+                                  lambda field=field: [((cache,), stats()[field]) for cache, stats in caches.items()])
+    metrics_registry.callback("cache_similar_hits_total", "Search cache hits served from a near-duplicate query",
+                              "counter", [], lambda: [((), similar_queries.similar_hits if similar_queries else 0)])
+    metrics_registry.callback("search_coalesced_total", "Search lookups that joined an in-flight call", "counter", [],
+                              lambda: [((), search_flights.coalesced)])
+    for field, kind, help_text in (
+        ("active", "gauge", "Requests holding a bulkhead slot"),
+        ("queued", "gauge", "Requests waiting for a bulkhead slot"),
+        ("rejected_queue_full", "counter", "Requests rejected because the queue was full"),
+        ("rejected_timeout", "counter", "Requests rejected after waiting too long"),
+    ):
+        name = f"bulkhead_{field}_total" if kind == "counter" else f"bulkhead_{field}"
+        metrics_registry.callback(name, help_text, kind, ["kind", "name"], lambda field=field: [
+            ((kind, name), stats[field])
+            for kind, group in bulkheads.stats().items()
+            for name, stats in group.items()
+        ])
+    for field, kind, help_text in (
+        ("open_connections", "gauge", "Open upstream connections"),
+        ("idle_connections", "gauge", "Idle keep-alive upstream connections"),
+        ("requests", "counter", "Requests sent per upstream pool"),
+        ("connections_opened", "counter", "New upstream connections opened"),
+    ):
+        name = f"upstream_pool_{field}_total" if kind == "counter" else f"upstream_pool_{field}"
+        metrics_registry.callback(name, help_text, kind, ["upstream"], lambda field=field: [
+            ((upstream,), stats[field]) for upstream, stats in upstreams.stats().items()
+        ])
+    metrics_registry.callback("upstream_circuit_state", "Upstream circuit breaker state: 0 closed, 1 half-open, 2 open",
+                              "gauge", ["upstream"], lambda: [
+        ((upstream,), CIRCUIT_STATES[stats["circuit"]["state"]]) for upstream, stats in upstreams.stats().items()
+    ])
+    metrics_registry.callback("llm_route_error_rate", "EWMA error rate per LLM route", "gauge", ["route"], lambda: [
+        ((route,), stats["error_rate"]) for route, stats in llm_router.stats()["routes"].items()
+    ])
+    metrics_registry.callback("llm_route_healthy", "1 if the LLM route is in service", "gauge", ["route"], lambda: [
+        ((route,), int(stats["healthy"])) for route, stats in llm_router.stats()["routes"].items()
+    ])
+    metrics_registry.callback("search_provider_wins_total", "Searches answered by each provider", "counter",
+                              ["provider"], lambda: [
+        ((provider,), stats["wins"]) for provider, stats in search_orchestrator.stats()["providers"].items()
+    ])
+    metrics_registry.callback("startup_seconds", "Cold-start timings, as in /api/startup-stats", "gauge", ["phase"],
+                              lambda: [((phase,), seconds) for phase, seconds in startup_report.timings().items()])
+    metrics_registry.callback("log_records_dropped_total", "Log records dropped because the log queue was full",
+                              "counter", [], lambda: [((), dropped_records())])
+
+register_stats_metrics()
+
+# Shutdown event to close pooled upstream connections
+@app.on_event("shutdown")
+async def shutdown_event():
+    await job_manager.aclose()
+    await snippet_index.save()
+    await upstreams.aclose()
+    for cache in (search_cache, completion_cache.cache, job_manager.store, page_fetcher.cache):
+        if hasattr(cache, "close"):
+            cache.close()
+
+# Prometheus text exposition of request, stage, cache and upstream metrics
+@app.get("/metrics", response_class=PlainTextResponse)
+async def metrics_endpoint():
+    return PlainTextResponse(metrics_registry.render(), media_type="text/plain; version=0.0.4")
+
+# Connection pool usage per upstream, to confirm connections are being reused
+@app.get("/api/pool-stats")
+async def pool_stats_endpoint():
+    return upstreams.stats()
+
+# Hit, miss and eviction counters for the search cache
+@app.get("/api/cache-stats")
+async def cache_stats_endpoint():
+    return {
+        "search": search_cache.stats(),
+        "search_in_flight": search_flights.stats(),
+        "search_similar": similar_queries.stats() if similar_queries is not None else None,
+        "completion": completion_cache.stats(),
+        "pages": page_fetcher.stats(),
+        "local_index": snippet_index.stats(),
+    }
+
+# Rolling latency and error rate per LLM provider and model
+@app.get("/api/llm-stats")
+async def llm_stats_endpoint():
+    return llm_router.stats()
+
+# Active, queued and rejected requests per model and upstream bulkhead
+@app.get("/api/bulkhead-stats")
+async def bulkhead_stats_endpoint():
+    return bulkheads.stats()
+
+# Per-provider search latency, failures and hedge wins, the search gate's skip rate
+# and how comparison questions were split into sub-queries
+@app.get("/api/search-stats")
+async def search_stats_endpoint():
+    return {**search_orchestrator.stats(), "gate": search_gate.stats(), "planner": query_planner.stats()}
+
+# Background job queue depth, outcomes and result store usage
+@app.get("/api/job-stats")
+async def job_stats_endpoint():
+    return job_manager.stats()
+
+# Cold-start timeline, import time by top-level module and provider SDK warm-up
+@app.get("/api/startup-stats")
+async def startup_stats_endpoint():
+    return startup_report.stats()
+
+startup_report.mark_imported()
@@ -0,0 +1,267 @@
+import bisect
+import time
+from contextvars import ContextVar
+from typing import Callable, Dict, Iterable, List, Optional, Sequence, Tuple
+
+from starlette.routing import BaseRoute, Match
+
+DEFAULT_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0, 60.0, 120.0)
+
+# Labels an endpoint learns while handling a request (e.g. the model), read by the middleware
+request_labels: ContextVar[Optional[Dict[str, str]]] = ContextVar("request_labels", default=None)
+
+
+def set_request_label(name: str, value: str):
+    labels = request_labels.get()
+    if labels is not None:
+        labels[name] = value
+
+
+def _escape(value: str) -> str:
+    return str(value).replace("\\", "\\\\").replace("\n", "\\n").replace('"', '\\"')
+
+
+def _format_labels(names: Sequence[str], values: Sequence[str], extra: str = "") -> str:
+    pairs = [f'{name}="{_escape(value)}"' for name, value in zip(names, values)]
+    if extra:
+        pairs.append(extra)
+    return "{" + ",".join(pairs) + "}" if pairs else ""
+
+
+def _format_value(value: float) -> str:
+    if value == float("inf"):
+        return "+Inf"
+    return repr(float(value)) if isinstance(value, float) else str(value)
+
+
+# Minimal Prometheus metric types. Recording is a dict lookup plus an add
+# (and a bisect for histograms), cheap enough to leave on in production.
+class _Metric:
+    kind = "untyped"
+
+    def __init__(self, name: str, documentation: str, labelnames: Sequence[str] = ()):
+        self.name = name
+        self.documentation = documentation
+        self.labelnames = tuple(labelnames)
+
+    def header(self) -> List[str]:
+        return [f"# HELP {self.name} {self.documentation}", f"# TYPE {self.name} {self.kind}"]
+
+
+class Counter(_Metric):
+    kind = "counter"
+
+    def __init__(self, name: str, documentation: str, labelnames: Sequence[str] = ()):
+        super().__init__(name, documentation, labelnames)
+        self.values: Dict[Tuple[str, ...], float] = {}
+
+    def inc(self, *labels: str, amount: float = 1.0):
+        self.values[labels] = self.values.get(labels, 0.0) + amount
+
+    def render(self) -> List[str]:
+        lines = self.header()
+        for labels, value in self.values.items():
+            lines.append(f"{self.name}{_format_labels(self.labelnames, labels)} {_format_value(value)}")
+        return lines
+
+
+class Gauge(Counter):
+    kind = "gauge"
+
+    def dec(self, *labels: str, amount: float = 1.0):
+        self.inc(*labels, amount=-amount)
+
+    def set(self, *labels: str, value: float):
+        self.values[labels] = value
+
+
+class Histogram(_Metric):
+    kind = "histogram"
+
+    def __init__(self, name: str, documentation: str, labelnames: Sequence[str] = (), buckets: Sequence[float] = DEFAULT_BUCKETS):
+        super().__init__(name, documentation, labelnames)
+        self.buckets = tuple(sorted(buckets))
+        # labels -> [per-bucket counts (+Inf last), sum, count]
+        self.values: Dict[Tuple[str, ...], list] = {}
+
+    def observe(self, *labels: str, value: float):
+        series = self.values.get(labels)
+        if series is None:
+            series = self.values[labels] = [[0] * (len(self.buckets) + 1), 0.0, 0]
+        series[0][bisect.bisect_left(self.buckets, value)] += 1
+        series[1] += value
+        series[2] += 1
+
+    def time(self, *labels: str) -> "_Timer":
+        return _Timer(self, labels)
+
+    def render(self) -> List[str]:
+        lines = self.header()
+        for labels, (counts, total, count) in self.values.items():
+            cumulative = 0
+            for bound, bucket_count in zip(self.buckets + (float("inf"),), counts):
+                cumulative += bucket_count
+                le = f'le="{_format_value(bound)}"'
+                lines.append(f"{self.name}_bucket{_format_labels(self.labelnames, labels, le)} {cumulative}")
+            lines.append(f"{self.name}_sum{_format_labels(self.labelnames, labels)} {_format_value(total)}")
+            lines.append(f"{self.name}_count{_format_labels(self.labelnames, labels)} {count}")
+        return lines
+
+
+class _Timer:
+    def __init__(self, histogram: Histogram, labels: Tuple[str, ...]):
+        self.histogram = histogram
+        self.labels = labels
+
+    def __enter__(self):
+        self.start = time.perf_counter()
+        return self
+
+    def __exit__(self, *exc):
+        self.histogram.observe(*self.labels, value=time.perf_counter() - self.start)
+
+    async def __aenter__(self):
+        return self.__enter__()
+
+    async def __aexit__(self, *exc):
+        self.__exit__(*exc)
+
+
+# Values read from existing stats() dicts at scrape time rather than on the hot path
+class CallbackMetric(_Metric):
+    def __init__(self, name: str, documentation: str, kind: str, labelnames: Sequence[str],
+                 collect: Callable[[], Iterable[Tuple[Sequence[str], float]]]):
+        super().__init__(name, documentation, labelnames)
+        self.kind = kind
+        self.collect = collect
+
+    def render(self) -> List[str]:
+        lines = self.header()
+        for labels, value in self.collect():
+            if value is None:
+                continue
+            lines.append(f"{self.name}{_format_labels(self.labelnames, labels)} {_format_value(value)}")
+        return lines
+
+
+class Registry:
+    def __init__(self):
+        self.metrics: List[_Metric] = []
+
+    def register(self, metric):
+        self.metrics.append(metric)
+        return metric
+
+    def counter(self, name: str, documentation: str, labelnames: Sequence[str] = ()) -> Counter:
+        return self.register(Counter(name, documentation, labelnames))
+
+    def gauge(self, name: str, documentation: str, labelnames: Sequence[str] = ()) -> Gauge:
+        return self.register(Gauge(name, documentation, labelnames))
+
+    def histogram(self, name: str, documentation: str, labelnames: Sequence[str] = (),
+                  buckets: Sequence[float] = DEFAULT_BUCKETS) -> Histogram:
+        return self.register(Histogram(name, documentation, labelnames, buckets))
+
+    def callback(self, name: str, documentation: str, kind: str, labelnames: Sequence[str],
+                 collect: Callable[[], Iterable[Tuple[Sequence[str], float]]]) -> CallbackMetric:
+        return self.register(CallbackMetric(name, documentation, kind, labelnames, collect))
+
+    def render(self) -> str:
+        lines: List[str] = []
+        for metric in self.metrics:
+            lines.extend(metric.render())
+        return "\n".join(lines) + "\n"
+
+
+registry = Registry()
+
+# Metrics recorded directly on the request path
+HTTP_REQUESTS = registry.counter(
+    "http_requests_total", "HTTP requests by endpoint, model and status code", ["endpoint", "model", "status"])
+HTTP_LATENCY = registry.histogram(
+    "http_request_duration_seconds", "End-to-end request latency including streamed bodies", ["endpoint", "model"])
+HTTP_IN_FLIGHT = registry.gauge(
+    "http_requests_in_flight", "Requests currently being handled", ["endpoint"])
+STAGE_LATENCY = registry.histogram(
+    "request_stage_duration_seconds", "Latency of each stage inside a request", ["endpoint", "stage"])
+SEARCH_LATENCY = registry.histogram(
+    "search_provider_duration_seconds", "Search provider call latency", ["provider", "outcome"])
+LLM_LATENCY = registry.histogram(
+    "llm_attempt_duration_seconds", "LLM call latency per routed attempt (time to first chunk for streams)",
+    ["provider", "model", "outcome"])
+CONTEXT_TOKENS_SAVED = registry.counter(
+    "context_tokens_saved_total", "Prompt tokens removed by context trimming", ["model"])
+CONTEXT_TOKENS = registry.histogram(
+    "context_prompt_tokens", "Estimated prompt tokens sent upstream after trimming", ["model"],
+    buckets=(500, 1000, 2000, 4000, 8000, 16000, 32000, 64000, 128000))
+PAGE_FETCHES = registry.counter(
+    "page_fetches_total", "Result page lookups by outcome (fetched, cached, not_modified, timeout, ...)", ["outcome"])
+LOCAL_INDEX_LOOKUPS = registry.counter(
+    "local_index_lookups_total", "Local snippet index lookups by outcome (hit, low_score, stale, empty)", ["outcome"])
+PROMPT_CACHE_TOKENS = registry.counter(
+    "llm_prompt_cache_tokens_total", "Prompt tokens served from (hit) or missing (miss) the provider's prefix cache",
+    ["provider", "model", "result"])
+UPSTREAM_ERRORS = registry.counter(
+    "upstream_errors_total", "Upstream error responses and transport failures", ["upstream", "status"])
+REQUESTS_CANCELLED = registry.counter(
+    "requests_cancelled_total", "Requests whose upstream work was cancelled, by stage and reason (disconnect, deadline)",
+    ["endpoint", "stage", "reason"])
+LLM_TOKENS_SAVED = registry.counter(
+    "llm_completion_tokens_saved_total", "Estimated completion tokens not generated because a request was cancelled",
+    ["model"])
+UPSTREAM_RETRIES = registry.counter(
+    "upstream_retries_total", "Upstream request retries by reason (status code or error type)", ["upstream", "reason"])
+UPSTREAM_CIRCUIT_REJECTIONS = registry.counter(
+    "upstream_circuit_rejections_total", "Upstream calls failed fast because the circuit was open", ["upstream"])
+SEARCH_GATE_DECISIONS = registry.counter(
+    "search_gate_decisions_total", "Search gate decisions (search, reuse, skip) by reason", ["decision", "reason"])
+SEARCH_GATE_SECONDS_SAVED = registry.counter(
+    "search_gate_seconds_saved_total", "Estimated search latency avoided by reusing or skipping the search")
+SEARCH_SUB_QUERIES = registry.counter(
+    "search_sub_queries_total", "Sub-queries of planned comparison searches by outcome (cached, searched, empty, failed)",
+    ["outcome"])
+
+
+# Pure ASGI middleware recording request counts, latency and in-flight gauges.
+# Latency runs until the last body chunk, so streamed responses are measured in full.
+# Requests are labelled with the route template they match ("/api/jobs/{job_id}").
+class MetricsMiddleware:
+    def __init__(self, app, routes: Callable[[], Iterable[BaseRoute]]):
+        self.app = app
+        self.routes = routes
+
+    def _endpoint(self, scope) -> str:
+        # A path matched with the wrong method (a 405) still belongs to its route
+        partial = None
+        for route in self.routes():
+            match, _ = route.matches(scope)
+            if match == Match.FULL:
+                return getattr(route, "path", "other")
+            if match == Match.PARTIAL and partial is None:
+                partial = getattr(route, "path", "other")
+        # Unknown paths share one label so scanners cannot blow up cardinality
+        return partial or "other"
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http":
+            await self.app(scope, receive, send)
+            return
+        endpoint = self._endpoint(scope)
+        labels = {"model": ""}
+        token = request_labels.set(labels)
+        status = {"code": 500}
+        start = time.perf_counter()
+        HTTP_IN_FLIGHT.inc(endpoint)
+
+        async def send_wrapper(message):
+            if message["type"] == "http.response.start":
+                status["code"] = message["status"]
+            await send(message)
+
+        try:
+            await self.app(scope, receive, send_wrapper)
+        finally:
+            HTTP_IN_FLIGHT.dec(endpoint)
+            HTTP_REQUESTS.inc(endpoint, labels["model"], str(status["code"]))
+            HTTP_LATENCY.observe(endpoint, labels["model"], value=time.perf_counter() - start)
+            request_labels.reset(token)
@@ -0,0 +1,152 @@
+import random
+from collections import OrderedDict
+from typing import Dict, FrozenSet, List, Optional, Set, Tuple
+
+from config import env_bool, env_float, env_int
+from entities import entity_set
+from text_tokens import tokenize
+
+_MASK = (1 << 64) - 1
+
+
+# Fold simple English plurals so "plans" and "plan" are one shingle
+def _singular(token: str) -> str:
+    if not token.isascii() or len(token) <= 3 or token.isdigit():
+        return token
+    if token.endswith("ies") and len(token) > 4:
+        return token[:-3] + "y"
+    if token.endswith("s") and not token.endswith(("ss", "us", "is")):
+        return token[:-1]
+    return token
+
+
+# Shingles for a normalized query: word tokens (plurals folded) and CJK bigrams,
+# plus character trigrams of longer Latin words so small typos still overlap
+def shingles(text: str) -> FrozenSet[str]:
+    result: Set[str] = set()
+    for token in tokenize(text):
+        token = _singular(token)
+        result.add(token)
+        if token.isascii() and len(token) > 4:
+            result.update(f"#{token[i:i + 3]}" for i in range(len(token) - 2))
+    return frozenset(result)
+
+
+def jaccard(a: FrozenSet[str], b: FrozenSet[str]) -> float:
+    if not a or not b:
+        return 0.0
+    return len(a & b) / len(a | b)
+
+
+def _numbers(shingle_set: FrozenSet[str]) -> FrozenSet[str]:
+    return frozenset(token for token in shingle_set if token.isdigit())
+
+
+# MinHash/LSH index over cached search queries.
+# Each query gets `bands * rows` MinHash values; queries sharing any band are
+# candidates, and candidates are confirmed with exact Jaccard similarity over
+# their shingles. A lookup costs one signature plus `bands` dict probes, so it
+# stays well under a millisecond at tens of thousands of entries. Queries whose
+# numbers differ ("2023" vs "2024", plan codes) or that name different insurers
+# or products ("AIA" vs "AXA critical illness plan") never match.
+class NearDuplicateIndex:
+    def __init__(self, threshold: float = 0.8, bands: int = 16, rows: int = 4, max_entries: int = 50000, seed: int = 1):
+        self.threshold = threshold
+        self.bands = bands
+        self.rows = rows
+        self.max_entries = max_entries
+        rng = random.Random(seed)
+        # (a*x + b) mod 2**64 with odd `a` stands in for a permutation. XOR masks
+        # are cheaper but too correlated: short queries then miss close matches.
+        self._seeds = [(rng.getrandbits(64) | 1, rng.getrandbits(64)) for _ in range(bands * rows)]
+        self._buckets: List[Dict[Tuple[int, ...], Set[str]]] = [{} for _ in range(bands)]
+        # key -> (shingles, band signatures, named entities), oldest first
+        self._entries: "OrderedDict[str, Tuple[FrozenSet[str], List[Tuple[int, ...]], FrozenSet[str]]]" = OrderedDict()
+        self.lookups = 0
+        self.similar_hits = 0
+        self.candidates_checked = 0
+
+    def _signature(self, shingle_set: FrozenSet[str]) -> List[Tuple[int, ...]]:
+        hashes = [hash(shingle) & _MASK for shingle in shingle_set]
+        values = [min([(h * a + b) & _MASK for h in hashes]) for a, b in self._seeds]
+        return [tuple(values[band * self.rows:(band + 1) * self.rows]) for band in range(self.bands)]
+
+    def __len__(self) -> int:
+        return len(self._entries)
+
+    def add(self, key: str):
+        shingle_set = shingles(key)
+        if not shingle_set:
+            return
+        if key in self._entries:
+            self._entries.move_to_end(key)
+            return
+        bands = self._signature(shingle_set)
+        self._entries[key] = (shingle_set, bands, entity_set(key))
+        for band, value in enumerate(bands):
+            self._buckets[band].setdefault(value, set()).add(key)
+        while len(self._entries) > self.max_entries:
+            self.remove(next(iter(self._entries)))
+
+    def remove(self, key: str):
+        entry = self._entries.pop(key, None)
+        if entry is None:
+            return
+        for band, value in enumerate(entry[1]):
+            bucket = self._buckets[band].get(value)
+            if bucket is not None:
+                bucket.discard(key)
+                if not bucket:
+                    del self._buckets[band][value]
+
+    # Best match above the threshold as (key, similarity), or None
+    def find(self, key: str) -> Optional[Tuple[str, float]]:
+        self.lookups += 1
+        shingle_set = shingles(key)
+        if not shingle_set or not self._entries:
+            return None
+        candidates: Set[str] = set()
+        for band, value in enumerate(self._signature(shingle_set)):
+            candidates.update(self._buckets[band].get(value, ()))
+        candidates.discard(key)
+        numbers = _numbers(shingle_set)
+        entities = entity_set(key)
+        best = None
+        for candidate in candidates:
+            self.candidates_checked += 1
+            candidate_shingles, _, candidate_entities = self._entries[candidate]
+            if _numbers(candidate_shingles) != numbers or candidate_entities != entities:
+                continue
+            score = jaccard(shingle_set, candidate_shingles)
+            if score >= self.threshold and (best is None or score > best[1]):
+                best = (candidate, score)
+        return best
+
+    def record_hit(self, key: str):
+        self.similar_hits += 1
+        if key in self._entries:
+            self._entries.move_to_end(key)
+
+    def stats(self) -> Dict:
+        return {
+            "entries": len(self._entries),
+            "max_entries": self.max_entries,
+            "threshold": self.threshold,
+            "lookups": self.lookups,
+            "similar_hits": self.similar_hits,
+            "similar_hit_rate": round(self.similar_hits / self.lookups, 4) if self.lookups else 0.0,
+            "candidates_checked": self.candidates_checked,
+        }
+
+
+# SEARCH_SIMILARITY_* settings; None when disabled (the default: a near match can
+# still differ in a detail the guards above do not know about, so opt in)
+def index_from_env() -> Optional[NearDuplicateIndex]:
+    if not env_bool("SEARCH_SIMILARITY_ENABLED", False):
+        return None
+    return NearDuplicateIndex(
+        threshold=env_float("SEARCH_SIMILARITY_THRESHOLD", 0.8),
+        bands=env_int("SEARCH_SIMILARITY_BANDS", 16),
+        rows=env_int("SEARCH_SIMILARITY_ROWS", 4),
+        max_entries=env_int("SEARCH_SIMILARITY_MAX_ENTRIES", 50000),
+    )
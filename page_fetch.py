@@ -0,0 +1,276 @@
+import asyncio
+import logging
+import math
+import os
+import time
+from collections import Counter
+from html.parser import HTMLParser
+from typing import Dict, List, Optional
+from urllib.parse import urlparse
+
+import httpx
+
+from cache import cache_from_env
+from clients import upstreams
+from config import env_bool, env_float, env_int
+from metrics import PAGE_FETCHES
+from search import TARGET_SITES
+from text_tokens import tokenize
+
+logger = logging.getLogger(__name__)
+
+# Page chrome that never holds the article text
+SKIP_TAGS = {"script", "style", "noscript", "nav", "header", "footer", "aside", "form", "svg", "iframe", "template", "button"}
+BLOCK_TAGS = {
+    "p", "div", "li", "ul", "ol", "tr", "td", "th", "table", "section", "article", "main", "br",
+    "h1", "h2", "h3", "h4", "h5", "h6", "blockquote", "dd", "dt", "pre",
+}
+MIN_BLOCK_CHARS = 20
+PASSAGE_CHARS = 600
+# Domains a result page may redirect to: the searched sites and their subdomains
+REDIRECT_DOMAINS = [site.split(":", 1)[1] for site in TARGET_SITES]
+
+
+def redirect_allowed(url: str) -> bool:
+    parsed = urlparse(url)
+    host = (parsed.hostname or "").lower()
+    return parsed.scheme in ("http", "https") and any(
+        host == domain or host.endswith(f".{domain}") for domain in REDIRECT_DOMAINS)
+
+
+# Collects visible text per block element, skipping scripts, navigation and footers
+class _TextExtractor(HTMLParser):
+    def __init__(self):
+        super().__init__(convert_charrefs=True)
+        self.skip_depth = 0
+        self.blocks: List[str] = []
+        self.current: List[str] = []
+
+    def _flush(self):
+        text = " ".join("".join(self.current).split())
+        if text:
+            self.blocks.append(text)
+        self.current = []
+
+    def handle_starttag(self, tag, attrs):
+        if tag in SKIP_TAGS:
+            self.skip_depth += 1
+        elif tag in BLOCK_TAGS:
+            self._flush()
+
+    def handle_endtag(self, tag):
+        if tag in SKIP_TAGS:
+            self.skip_depth = max(self.skip_depth - 1, 0)
+        elif tag in BLOCK_TAGS:
+            self._flush()
+
+    def handle_data(self, data):
+        if not self.skip_depth:
+            self.current.append(data)
+
+
+# Main text of an HTML page as passages of up to PASSAGE_CHARS characters.
+# Short blocks (menus, labels, buttons) are dropped; neighbouring blocks are merged.
+def extract_passages(html: str) -> List[str]:
+    parser = _TextExtractor()
+    try:
+        parser.feed(html)
+        parser.close()
+    except Exception as e:
+        logger.warning(f"HTML parse error: {e}")
+    parser._flush()
+    passages: List[str] = []
+    current = ""
+    for block in parser.blocks:
+        if len(block) < MIN_BLOCK_CHARS:
+            continue
+        if current and len(current) + len(block) + 1 > PASSAGE_CHARS:
+            passages.append(current)
+            current = ""
+        current = f"{current} {block}" if current else block
+        while len(current) > PASSAGE_CHARS:
+            passages.append(current[:PASSAGE_CHARS])
+            current = current[PASSAGE_CHARS:]
+    if current:
+        passages.append(current)
+    return passages
+
+
+# Query-term overlap, damped for long passages
+def score_passage(query_terms: Counter, passage: str) -> float:
+    terms = Counter(tokenize(passage))
+    matched = sum(min(count, terms[term]) for term, count in query_terms.items() if term in terms)
+    return matched / (1.0 + math.log1p(len(terms))) if matched else 0.0
+
+
+# Optional retrieval stage behind the search context.
+# The top-N result pages are fetched concurrently, at most `per_host` at a time per
+# site and within a strict per-page timeout and an overall deadline. Redirects are
+# followed by hand, at most `max_redirects` hops and only to the searched sites,
+# so a result link cannot point the fetcher at an internal address. Extracted
+# passages are cached by URL and revalidated with ETag/Last-Modified once older than
+# `fresh_for`. The passages that best match the query are returned within
+# `context_bytes` of UTF-8.
+class PageFetcher:
+    def __init__(
+        self,
+        cache,
+        enabled: bool = False,
+        top_n: int = 3,
+        page_timeout: float = 2.5,
+        deadline: float = 3.0,
+        per_host: int = 2,
+        max_page_bytes: int = 512 * 1024,
+        max_redirects: int = 3,
+        context_bytes: int = 6000,
+        fresh_for: float = 3600.0,
+        user_agent: str = "Mozilla/5.0 (compatible; AIM-Assistant/1.0)",
+    ):
+        self.cache = cache
+        self.enabled = enabled
+        self.top_n = top_n
+        self.page_timeout = page_timeout
+        self.deadline = deadline
+        self.per_host = per_host
+        self.max_page_bytes = max_page_bytes
+        self.max_redirects = max_redirects
+        self.context_bytes = context_bytes
+        self.fresh_for = fresh_for
+        self.user_agent = user_agent
+        self._host_limits: Dict[str, asyncio.Semaphore] = {}
+
+    def _host_limit(self, host: str) -> asyncio.Semaphore:
+        if host not in self._host_limits:
+            self._host_limits[host] = asyncio.Semaphore(self.per_host)
+        return self._host_limits[host]
+
+    async def _download(self, url: str, cached: Optional[Dict]) -> Optional[Dict]:
+        headers = {"User-Agent": self.user_agent, "Accept": "text/html,application/xhtml+xml"}
+        if cached and cached.get("etag"):
+            headers["If-None-Match"] = cached["etag"]
+        if cached and cached.get("last_modified"):
+            headers["If-Modified-Since"] = cached["last_modified"]
+        client = upstreams.http("pages")
+        location = url
+        for _ in range(self.max_redirects + 1):
+            # Each hop counts against the limit of the host it goes to
+            async with self._host_limit(urlparse(location).hostname or ""):
+                async with client.stream("GET", location, headers=headers, follow_redirects=False) as response:
+                    if not response.has_redirect_location:
+                        return await self._read(url, response, cached)
+                    location = str(response.url.join(response.headers["location"]))
+            if not redirect_allowed(location):
+                PAGE_FETCHES.inc("redirect_blocked")
+                logger.warning(f"Page fetch for {url} redirected off the searched sites to {location}")
+                return None
+        PAGE_FETCHES.inc("redirect_blocked")
+        logger.warning(f"Page fetch for {url} exceeded {self.max_redirects} redirects")
+        return None
+
+    async def _read(self, url: str, response: httpx.Response, cached: Optional[Dict]) -> Optional[Dict]:
+        if response.status_code == 304 and cached:
+            PAGE_FETCHES.inc("not_modified")
+            return {**cached, "checked_at": time.time()}
+        response.raise_for_status()
+        if "html" not in response.headers.get("content-type", "html"):
+            PAGE_FETCHES.inc("skipped")
+            return None
+        body = bytearray()
+        async for chunk in response.aiter_bytes():
+            body.extend(chunk)
+            if len(body) >= self.max_page_bytes:
+                break
+        PAGE_FETCHES.inc("fetched")
+        # Parsed by fetch() in a worker thread, outside the page timeout
+        return {
+            "url": url,
+            "html": bytes(body[:self.max_page_bytes]).decode(response.encoding or "utf-8", errors="replace"),
+            "etag": response.headers.get("etag"),
+            "last_modified": response.headers.get("last-modified"),
+            "checked_at": time.time(),
+        }
+
+    async def fetch(self, url: str) -> Optional[Dict]:
+        cached = self.cache.get(url)
+        if cached is not None and time.time() - cached["checked_at"] < self.fresh_for:
+            PAGE_FETCHES.inc("cached")
+            return cached
+        try:
+            doc = await asyncio.wait_for(self._download(url, cached), timeout=self.page_timeout)
+        except asyncio.TimeoutError:
+            PAGE_FETCHES.inc("timeout")
+            return cached
+        except Exception as e:
+            PAGE_FETCHES.inc("error")
+            logger.warning(f"Page fetch failed for {url}: {e}")
+            # A stale copy is better than nothing
+            return cached
+        if doc is not None and "html" in doc:
+            # HTMLParser takes ~100 ms on a large page; keep it off the event loop
+            doc["passages"] = await asyncio.to_thread(extract_passages, doc.pop("html"))
+        if doc is not None:
+            self.cache.set(url, doc)
+        return doc
+
+    async def relevant_context(self, query: str, items: List[Dict]) -> str:
+        links = [item["link"] for item in items[:self.top_n] if item.get("link", "").startswith("http")]
+        if not links:
+            return ""
+        tasks = [asyncio.ensure_future(self.fetch(link)) for link in dict.fromkeys(links)]
+        done, pending = await asyncio.wait(tasks, timeout=self.deadline)
+        for task in pending:
+            task.cancel()
+            PAGE_FETCHES.inc("deadline")
+
+        # In search-rank order so equal scores keep a stable order
+        docs = [
+            task.result() for task in tasks
+            if task in done and not task.cancelled() and task.exception() is None and task.result()
+        ]
+        return await asyncio.to_thread(self._best_passages, query, docs)
+
+    # Scoring every passage of every page is CPU work, run in a worker thread
+    def _best_passages(self, query: str, docs: List[Dict]) -> str:
+        query_terms = Counter(tokenize(query))
+        scored = []
+        for doc in docs:
+            for passage in doc.get("passages", []):
+                score = score_passage(query_terms, passage)
+                if score > 0:
+                    scored.append((score, doc["url"], passage))
+        # Stable sort keeps rank order on ties, so the context (and its cache key) is repeatable
+        scored.sort(key=lambda entry: entry[0], reverse=True)
+
+        excerpts, used = [], 0
+        for _, url, passage in scored:
+            excerpt = f"[{url}]\n{passage}"
+            size = len(excerpt.encode("utf-8")) + 2
+            if used + size > self.context_bytes:
+                continue
+            excerpts.append(excerpt)
+            used += size
+        return "\n\n".join(excerpts)
+
+    def stats(self) -> Dict:
+        return {"enabled": self.enabled, "documents": self.cache.stats(), "hosts": len(self._host_limits)}
+
+
+# PAGE_FETCH_* settings; extracted documents live in a PAGE_CACHE_* cache
+def page_fetcher_from_env() -> PageFetcher:
+    cache = cache_from_env("PAGE_CACHE", max_entries=500, max_bytes=32 * 1024 * 1024, ttl=86400.0)
+    return PageFetcher(
+        cache,
+        enabled=env_bool("PAGE_FETCH_ENABLED", False),
+        top_n=env_int("PAGE_FETCH_TOP_N", 3),
+        page_timeout=env_float("PAGE_FETCH_TIMEOUT", 2.5),
+        deadline=env_float("PAGE_FETCH_DEADLINE", 3.0),
+        per_host=env_int("PAGE_FETCH_PER_HOST", 2),
+        max_page_bytes=env_int("PAGE_FETCH_MAX_PAGE_BYTES", 512 * 1024),
+        max_redirects=env_int("PAGE_FETCH_MAX_REDIRECTS", 3),
+        context_bytes=env_int("PAGE_CONTEXT_BYTES", 6000),
+        fresh_for=env_float("PAGE_FETCH_FRESH_FOR", 3600.0),
+        user_agent=os.getenv("PAGE_FETCH_USER_AGENT", "Mozilla/5.0 (compatible; AIM-Assistant/1.0)"),
+    )
+
+
+page_fetcher = page_fetcher_from_env()
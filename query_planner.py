@@ -0,0 +1,172 @@
+import re
+from dataclasses import dataclass
+from typing import Dict, List, Optional
+from urllib.parse import urlsplit
+
+from cache import normalize_query
+from config import env_bool, env_int
+from context_budget import estimate_tokens
+from entities import INSURER_PATTERNS, INSURERS, PRODUCT_PATTERNS, mentions
+from metrics import SEARCH_SUB_QUERIES
+from search import TARGET_SITES
+
+# Words that only say "compare"; dropped from the per-entity sub-queries
+_COMPARISON_WORDS = re.compile(r"\b(?:compare|comparison|versus|vs|between)\b\.?|比較|比较|對比|对比", re.IGNORECASE)
+_WHITESPACE = re.compile(r"\s+")
+# Joins between compared entities, removed together with the entity
+_CONJUNCTION = r"\s*(?:\b(?:and|or|with)\b|&|,|，|、|/|同|和|與|与|或)\s*"
+_COMMAS = (",", "，", "、")
+_SPACE_BEFORE_PUNCTUATION = re.compile(r"\s+([?？!！.。,，:：])")
+# A space left inside CJK text, which is written without spaces
+_CJK_GAP = re.compile(r"(?<=[㐀-䶿一-鿿，、]) (?=[㐀-䶿一-鿿])")
+# Comparison and news sites: every target site that does not belong to an insurer
+NEUTRAL_SITES = [site for site in TARGET_SITES if site not in {site for _, site in INSURERS.values()}]
+
+
+# An entity with the joins before it ("... and Manulife") and after it ("AIA and ...")
+def _removal_pattern(pattern: re.Pattern) -> re.Pattern:
+    return re.compile(rf"((?:{_CONJUNCTION})*)(?:{pattern.pattern})((?:{_CONJUNCTION})*)", re.IGNORECASE)
+
+
+# An entity joined on both sides leaves one separator: a comma if either join had
+# one ("Which is better, AXA or Chubb" -> "Which is better, Chubb"), otherwise a space
+def _removed(match: re.Match) -> str:
+    before, after = match.group(1).strip(), match.group(2).strip()
+    if before and after:
+        comma = next((char for char in before[0] + after[0] if char in _COMMAS), None)
+        if comma:
+            return f"{comma} "
+    return " "
+
+
+_REMOVAL_PATTERNS = {
+    name: _removal_pattern(pattern) for name, pattern in {**INSURER_PATTERNS, **PRODUCT_PATTERNS}.items()
+}
+
+
+@dataclass
+class SubQuery:
+    label: str  # the insurer or product it covers, or "comparison"
+    query: str
+    sites: List[str]
+
+    # Cached on its own, apart from whole-query entries, so any later comparison
+    # that shares the entity can merge it again
+    @property
+    def cache_key(self) -> str:
+        return f"sub:{','.join(self.sites)}|{normalize_query(self.query)}"
+
+
+# Links that only differ in scheme, "www.", a trailing slash or a fragment are one page
+def canonical_link(link: str) -> str:
+    parts = urlsplit(link.strip().lower())
+    host = parts.netloc[4:] if parts.netloc.startswith("www.") else parts.netloc
+    path = parts.path.rstrip("/")
+    return f"{host}{path}?{parts.query}" if parts.query else f"{host}{path}"
+
+
+# Splits comparison questions into smaller site-restricted searches.
+# "compare AIA and Manulife critical illness plans" becomes one sub-query per
+# insurer on that insurer's own site ("AIA critical illness plans" on aia.com.hk,
+# ...), so no single insurer fills every result slot, plus the whole question on
+# the comparison and news sites. One insurer and several products is split per
+# product on the insurer's site. Other queries are not planned and search as before.
+# merge() interleaves the sub-query results round-robin, drops duplicate pages and
+# stops at `snippet_tokens`, the budget shared by all sub-queries.
+class QueryPlanner:
+    def __init__(self, enabled: bool = True, max_sub_queries: int = 4, snippet_tokens: int = 1500,
+                 comparison_query: bool = True):
+        self.enabled = enabled
+        self.max_sub_queries = max_sub_queries
+        self.snippet_tokens = snippet_tokens
+        self.comparison_query = comparison_query
+        self.plans = 0
+        self.sub_queries = 0
+        self.duplicates_dropped = 0
+        self.over_budget_dropped = 0
+        self.outcomes: Dict[str, int] = {}
+
+    def plan(self, query: str) -> Optional[List[SubQuery]]:
+        if not self.enabled:
+            return None
+        insurers = mentions(query, INSURER_PATTERNS)
+        products = mentions(query, PRODUCT_PATTERNS)
+        if len(insurers) >= 2:
+            subs = [
+                SubQuery(name, self._focus(query, INSURER_PATTERNS, keep=name), [INSURERS[name][1]])
+                for name in insurers[:self.max_sub_queries]
+            ]
+        elif len(insurers) == 1 and len(products) >= 2:
+            site = INSURERS[insurers[0]][1]
+            subs = [
+                SubQuery(name, self._focus(query, PRODUCT_PATTERNS, keep=name), [site])
+                for name in products[:self.max_sub_queries]
+            ]
+        else:
+            return None
+        if self.comparison_query:
+            subs.append(SubQuery("comparison", query, NEUTRAL_SITES))
+        self.plans += 1
+        self.sub_queries += len(subs)
+        return subs
+
+    # The query with the other compared entities and the comparison words removed
+    @staticmethod
+    def _focus(query: str, patterns: Dict[str, re.Pattern], keep: str) -> str:
+        text = _COMPARISON_WORDS.sub(" ", query)
+        for name in patterns:
+            if name != keep:
+                text = _REMOVAL_PATTERNS[name].sub(_removed, text)
+        text = _SPACE_BEFORE_PUNCTUATION.sub(r"\1", _WHITESPACE.sub(" ", text))
+        text = _CJK_GAP.sub("", text)
+        return text.strip(" ,，、") or keep
+
+    def merge(self, results: List[List[Dict]]) -> List[Dict]:
+        merged: List[Dict] = []
+        seen = set()
+        tokens = 0
+        for rank in range(max((len(items) for items in results), default=0)):
+            for items in results:
+                if rank >= len(items):
+                    continue
+                item = items[rank]
+                key = canonical_link(item["link"]) if item["link"] else item["title"].lower()
+                if key in seen:
+                    self.duplicates_dropped += 1
+                    continue
+                cost = estimate_tokens(item["title"]) + estimate_tokens(item["snippet"])
+                if merged and tokens + cost > self.snippet_tokens:
+                    self.over_budget_dropped += 1
+                    continue
+                seen.add(key)
+                tokens += cost
+                merged.append(item)
+        return merged
+
+    # outcome: "cached", "searched", "empty" or "failed"
+    def record_sub_query(self, outcome: str):
+        self.outcomes[outcome] = self.outcomes.get(outcome, 0) + 1
+        SEARCH_SUB_QUERIES.inc(outcome)
+
+    def stats(self) -> Dict:
+        return {
+            "enabled": self.enabled,
+            "plans": self.plans,
+            "sub_queries": self.sub_queries,
+            "sub_query_outcomes": dict(self.outcomes),
+            "duplicates_dropped": self.duplicates_dropped,
+            "over_budget_dropped": self.over_budget_dropped,
+            "snippet_tokens": self.snippet_tokens,
+        }
+
+
+def planner_from_env() -> QueryPlanner:
+    return QueryPlanner(
+        enabled=env_bool("SEARCH_PLAN_ENABLED", True),
+        max_sub_queries=env_int("SEARCH_PLAN_MAX_SUB_QUERIES", 4),
+        snippet_tokens=env_int("SEARCH_PLAN_SNIPPET_TOKENS", 1500),
+        comparison_query=env_bool("SEARCH_PLAN_COMPARISON_QUERY", True),
+    )
+
+
+query_planner = planner_from_env()
@@ -0,0 +1,205 @@
+import asyncio
+import logging
+import random
+import time
+from email.utils import parsedate_to_datetime
+from typing import Dict, Optional
+
+import httpx
+
+from metrics import UPSTREAM_CIRCUIT_REJECTIONS, UPSTREAM_RETRIES
+
+logger = logging.getLogger(__name__)
+
+# Responses worth another attempt: rate limiting and gateway/overload errors
+RETRY_STATUSES = {429, 502, 503, 504}
+# For other methods only statuses that say the request was not processed: a 502 or
+# 504 on a completion may mean the upstream is still generating (and billing) it
+NON_IDEMPOTENT_RETRY_STATUSES = {429, 503}
+# Only safe when the request cannot have been processed or is idempotent
+IDEMPOTENT_METHODS = {"GET", "HEAD", "OPTIONS"}
+CIRCUIT_STATES = {"closed": 0, "half_open": 1, "open": 2}
+
+
+# Raised instead of calling an upstream whose circuit is open. It is a transport
+# error, so the OpenAI SDK reports it as a connection error and the router and
+# search orchestrator fail over exactly as for an unreachable host.
+class CircuitOpenError(httpx.TransportError):
+    pass
+
+
+# Per-upstream circuit breaker.
+# After `failure_threshold` consecutive failures (transport errors or 5xx) the
+# circuit opens and calls fail at once for `cooldown` seconds. Then one probe is
+# let through (half-open): success closes the circuit, failure re-opens it.
+# A threshold of 0 disables the breaker.
+class CircuitBreaker:
+    def __init__(self, failure_threshold: int = 5, cooldown: float = 30.0):
+        self.failure_threshold = failure_threshold
+        self.cooldown = cooldown
+        self.state = "closed"
+        self.consecutive_failures = 0
+        self.opened_at = 0.0
+        self.probe_in_flight = False
+        self.times_opened = 0
+        self.rejected = 0
+
+    def allow(self) -> bool:
+        if not self.failure_threshold or self.state == "closed":
+            return True
+        if self.state == "open" and time.monotonic() - self.opened_at >= self.cooldown:
+            self.state = "half_open"
+        if self.state == "half_open" and not self.probe_in_flight:
+            self.probe_in_flight = True
+            return True
+        self.rejected += 1
+        return False
+
+    def record_success(self):
+        self.consecutive_failures = 0
+        self.probe_in_flight = False
+        self.state = "closed"
+
+    def record_failure(self):
+        self.consecutive_failures += 1
+        self.probe_in_flight = False
+        if self.failure_threshold and (
+            self.state == "half_open" or self.consecutive_failures >= self.failure_threshold
+        ):
+            if self.state != "open":
+                self.times_opened += 1
+            self.state = "open"
+            self.opened_at = time.monotonic()
+
+    # A probe that ended without an outcome (cancelled) must not block the next one
+    def release_probe(self):
+        self.probe_in_flight = False
+
+    def stats(self) -> Dict:
+        return {
+            "state": self.state,
+            "consecutive_failures": self.consecutive_failures,
+            "failure_threshold": self.failure_threshold,
+            "cooldown": self.cooldown,
+            "times_opened": self.times_opened,
+            "rejected": self.rejected,
+        }
+
+
+# Seconds to wait before a retry: the server's Retry-After when present, otherwise
+# full-jitter exponential backoff (uniform between 0 and base * 2^retry, capped)
+def backoff_delay(retry: int, base: float, cap: float, response: Optional[httpx.Response] = None) -> float:
+    if response is not None and response.headers.get("retry-after"):
+        value = response.headers["retry-after"]
+        try:
+            return max(float(value), 0.0)
+        except ValueError:
+            try:
+                return max(parsedate_to_datetime(value).timestamp() - time.time(), 0.0)
+            except (TypeError, ValueError):
+                pass
+    return random.uniform(0, min(cap, base * 2 ** retry))
+
+
+# httpx transport wrapper shared by every call to one upstream, whether it comes
+# from the OpenAI SDK, the search providers or page fetches.
+# Failed attempts are retried with backoff while the total time spent stays within
+# `budget` seconds; connect failures and retryable statuses are retried for any
+# method, read errors, 502 and 504 only for idempotent ones. Every attempt passes
+# the upstream's circuit breaker first.
+class ResilientTransport(httpx.AsyncBaseTransport):
+    def __init__(
+        self,
+        transport: httpx.AsyncBaseTransport,
+        name: str,
+        breaker: CircuitBreaker,
+        max_retries: int = 2,
+        budget: float = 10.0,
+        base_delay: float = 0.2,
+        max_delay: float = 2.0,
+    ):
+        self.transport = transport
+        self.name = name
+        self.breaker = breaker
+        self.max_retries = max_retries
+        self.budget = budget
+        self.base_delay = base_delay
+        self.max_delay = max_delay
+        self.retries = 0
+        self.budget_exhausted = 0
+
+    def _retryable_error(self, request: httpx.Request, error: Exception) -> bool:
+        if isinstance(error, (httpx.ConnectError, httpx.ConnectTimeout)):
+            return True
+        if isinstance(error, (httpx.ReadError, httpx.ReadTimeout, httpx.RemoteProtocolError)):
+            return request.method in IDEMPOTENT_METHODS
+        return False
+
+    def _retryable_status(self, request: httpx.Request, status_code: int) -> bool:
+        if request.method in IDEMPOTENT_METHODS:
+            return status_code in RETRY_STATUSES
+        return status_code in NON_IDEMPOTENT_RETRY_STATUSES
+
+    async def _attempt(self, request: httpx.Request) -> httpx.Response:
+        if not self.breaker.allow():
+            UPSTREAM_CIRCUIT_REJECTIONS.inc(self.name)
+            raise CircuitOpenError(f"{self.name} circuit is open", request=request)
+        try:
+            response = await self.transport.handle_async_request(request)
+        except httpx.PoolTimeout:
+            # Local pool saturation says nothing about the upstream's health
+            self.breaker.release_probe()
+            raise
+        except httpx.TransportError:
+            self.breaker.record_failure()
+            raise
+        except BaseException:
+            # Cancelled, e.g. the losing side of a hedged search
+            self.breaker.release_probe()
+            raise
+        if response.status_code >= 500:
+            self.breaker.record_failure()
+        else:
+            self.breaker.record_success()
+        return response
+
+    async def handle_async_request(self, request: httpx.Request) -> httpx.Response:
+        start = time.monotonic()
+        retry = 0
+        while True:
+            try:
+                response = await self._attempt(request)
+            except httpx.TransportError as e:
+                if retry >= self.max_retries or not self._retryable_error(request, e):
+                    raise
+                reason, response, error = type(e).__name__, None, e
+            else:
+                if not self._retryable_status(request, response.status_code) or retry >= self.max_retries:
+                    return response
+                reason, error = str(response.status_code), None
+
+            delay = backoff_delay(retry, self.base_delay, self.max_delay, response)
+            if time.monotonic() - start + delay > self.budget:
+                self.budget_exhausted += 1
+                if error is not None:
+                    raise error
+                return response
+            if response is not None:
+                await response.aclose()
+            retry += 1
+            self.retries += 1
+            UPSTREAM_RETRIES.inc(self.name, reason)
+            logger.warning(f"Retrying {self.name} {request.method} {request.url.path} after {reason} in {delay:.2f}s")
+            await asyncio.sleep(delay)
+
+    async def aclose(self):
+        await self.transport.aclose()
+
+    def stats(self) -> Dict:
+        return {
+            "max_retries": self.max_retries,
+            "retry_budget": self.budget,
+            "retries": self.retries,
+            "retry_budget_exhausted": self.budget_exhausted,
+            "circuit": self.breaker.stats(),
+        }
@@ -0,0 +1,285 @@
+import asyncio
+import logging
+import os
+import time
+from collections import deque
+from typing import Awaitable, Callable, Dict, List, Optional
+
+import httpx
+
+from bulkhead import bulkheads
+from clients import upstreams
+from config import env_float, env_int
+from metrics import SEARCH_LATENCY, UPSTREAM_ERRORS
+
+logger = logging.getLogger(__name__)
+
+SERPAPI_API_KEY = os.getenv("SERPAPI_API_KEY")
+GOOGLE_API_KEY = os.getenv("GOOGLE_API_KEY")
+GOOGLE_CX = os.getenv("GOOGLE_CX")
+
+# Define target sites for search filtering
+TARGET_SITES = [
+    "site:manulife.com.hk",
+    "site:aia.com.hk",
+    "site:prudential.com.hk",
+    "site:axa.com.hk",
+    "site:sunlife.com.hk",
+    "site:chubb.com",
+    "site:scmp.com",
+    "site:hket.com",
+    "site:ft.com",
+    "site:moneyhero.com.hk",
+    "site:compareasia.com",
+    "site:policypal.com",
+    "site:ia.hk",
+    "site:sfc.hk",
+    "site:bloomberg.com",
+    "site:forbes.com"
+]
+
+NO_RESULTS = "No relevant results found"
+
+
+def site_filtered_query(query: str, sites: List[str] = TARGET_SITES) -> str:
+    site_filter = f"({' OR '.join(sites)})"
+    return f"{query} {site_filter}"
+
+
+# Both providers are reduced to the same {title, snippet, link} items
+def normalize_item(title: Optional[str], snippet: Optional[str], link: Optional[str]) -> Dict:
+    return {
+        "title": title or "N/A",
+        "snippet": snippet or "No description available",
+        "link": link or "",
+    }
+
+
+# Render search items as the context block given to the model
+def format_search_results(items: List[Dict]) -> str:
+    search_context = []
+    for item in items:
+        context_entry = (
+            f"Title: {item['title']}\n"
+            f"Snippet: {item['snippet']}\n"
+            f"Link: {item['link']}"
+        )
+        search_context.append(context_entry)
+    return "\n\n".join(search_context) if search_context else NO_RESULTS
+
+
+# Search the target sites (or `sites`) through SerpAPI; raises on upstream errors
+async def serpapi_search(query: str, num: int = 5, sites: Optional[List[str]] = None) -> List[Dict]:
+    params = {
+        "engine": "google",
+        "q": site_filtered_query(query, sites or TARGET_SITES),
+        "api_key": SERPAPI_API_KEY,
+        "google_domain": "google.com.hk",
+        "hl": "en",
+        "gl": "hk",
+        "num": num
+    }
+    client = upstreams.http("serpapi")
+    response = await client.get("/search", params=params)
+    response.raise_for_status()
+    data = response.json()
+    return [
+        normalize_item(result.get("title"), result.get("snippet"), result.get("link"))
+        for result in data.get("organic_results", [])[:num]
+    ]
+
+
+# Search the target sites (or `sites`) through the Google Custom Search JSON API; raises on upstream errors
+async def google_search(query: str, num: int = 5, sites: Optional[List[str]] = None) -> List[Dict]:
+    params = {
+        "key": GOOGLE_API_KEY,
+        "cx": GOOGLE_CX,
+        "q": site_filtered_query(query, sites or TARGET_SITES),
+        "num": num,
+        "gl": "hk",
+        "sort": "date",
+        "fields": "items(title,link,snippet)"
+    }
+    client = upstreams.http("google")
+    response = await client.get("/customsearch/v1", params=params)
+    response.raise_for_status()
+    data = response.json()
+    return [
+        normalize_item(result.get("title"), result.get("snippet"), result.get("link"))
+        for result in data.get("items", [])[:num]
+    ]
+
+
+# Rolling latency window and outcome counters for one provider
+class ProviderStats:
+    def __init__(self, window: int = 200):
+        self.latencies = deque(maxlen=window)
+        self.calls = 0
+        self.successes = 0
+        self.failures = 0
+        self.empty = 0
+        self.wins = 0
+
+    def percentile(self, pct: float) -> Optional[float]:
+        if not self.latencies:
+            return None
+        ordered = sorted(self.latencies)
+        index = min(int(len(ordered) * pct), len(ordered) - 1)
+        return ordered[index]
+
+    def to_dict(self) -> Dict:
+        p50 = self.percentile(0.50)
+        p95 = self.percentile(0.95)
+        return {
+            "calls": self.calls,
+            "successes": self.successes,
+            "failures": self.failures,
+            "empty_results": self.empty,
+            "wins": self.wins,
+            "latency_p50_ms": round(p50 * 1000, 1) if p50 is not None else None,
+            "latency_p95_ms": round(p95 * 1000, 1) if p95 is not None else None,
+        }
+
+
+# Search orchestration across providers.
+# Policies:
+#   "primary" - only query the primary provider
+#   "hedge"   - query the primary, and if it has not answered after its recent
+#               p95 latency (clamped to the configured bounds), also query the
+#               next provider; the first non-empty answer wins
+#   "race"    - query every provider at once and take the first non-empty answer
+# A failed or empty primary answer triggers the next provider immediately.
+class SearchOrchestrator:
+    def __init__(
+        self,
+        providers: Dict[str, Callable[..., Awaitable[List[Dict]]]],
+        primary: str,
+        policy: str = "hedge",
+        default_hedge_delay: float = 1.0,
+        min_hedge_delay: float = 0.25,
+        max_hedge_delay: float = 5.0,
+        min_samples: int = 20,
+    ):
+        if primary not in providers:
+            raise ValueError(f"Unknown primary search provider: {primary}")
+        if policy not in ("primary", "hedge", "race"):
+            raise ValueError(f"Unknown search policy: {policy}")
+        self.providers = providers
+        self.primary = primary
+        self.policy = policy
+        self.default_hedge_delay = default_hedge_delay
+        self.min_hedge_delay = min_hedge_delay
+        self.max_hedge_delay = max_hedge_delay
+        self.min_samples = min_samples
+        self.provider_stats = {name: ProviderStats() for name in providers}
+        self.hedges_fired = 0
+
+    def hedge_delay(self) -> float:
+        stats = self.provider_stats[self.primary]
+        if len(stats.latencies) < self.min_samples:
+            return self.default_hedge_delay
+        return min(max(stats.percentile(0.95), self.min_hedge_delay), self.max_hedge_delay)
+
+    async def _call(self, name: str, query: str, sites: Optional[List[str]] = None) -> List[Dict]:
+        stats = self.provider_stats[name]
+        stats.calls += 1
+        start = time.perf_counter()
+        try:
+            async with bulkheads.upstream(name).slot():
+                items = await self.providers[name](query, sites=sites)
+        except asyncio.CancelledError:
+            SEARCH_LATENCY.observe(name, "cancelled", value=time.perf_counter() - start)
+            raise
+        except Exception as e:
+            stats.failures += 1
+            SEARCH_LATENCY.observe(name, "error", value=time.perf_counter() - start)
+            # HTTP error statuses are already counted by the upstream client
+            if not isinstance(e, httpx.HTTPStatusError):
+                UPSTREAM_ERRORS.inc(name, type(e).__name__)
+            logger.warning(f"Search provider {name} failed: {str(e)}")
+            raise
+        elapsed = time.perf_counter() - start
+        SEARCH_LATENCY.observe(name, "ok" if items else "empty", value=elapsed)
+        stats.latencies.append(elapsed)
+        stats.successes += 1
+        if not items:
+            stats.empty += 1
+        return items
+
+    async def search(self, query: str, sites: Optional[List[str]] = None) -> List[Dict]:
+        """Return the first non-empty result list; [] if every provider came back empty"""
+        order = [self.primary] + [name for name in self.providers if name != self.primary]
+        if self.policy == "primary":
+            order = order[:1]
+        tasks: Dict[asyncio.Task, str] = {}
+
+        def launch(name: str):
+            tasks[asyncio.ensure_future(self._call(name, query, sites))] = name
+
+        launch(order.pop(0))
+        if self.policy == "race":
+            while order:
+                launch(order.pop(0))
+
+        pending = set(tasks)
+        last_error: Optional[BaseException] = None
+        empty_answer = False
+        try:
+            while pending:
+                timeout = self.hedge_delay() if order else None
+                done, pending = await asyncio.wait(pending, timeout=timeout, return_when=asyncio.FIRST_COMPLETED)
+                if not done:
+                    # Primary is slower than usual: fire the hedge request
+                    self.hedges_fired += 1
+                    launch(order.pop(0))
+                    pending = {task for task in tasks if not task.done()}
+                    continue
+                for task in done:
+                    if task.exception() is not None:
+                        last_error = task.exception()
+                    elif task.result():
+                        self.provider_stats[tasks[task]].wins += 1
+                        return task.result()
+                    else:
+                        empty_answer = True
+                if order and not pending:
+                    launch(order.pop(0))
+                    pending = {task for task in tasks if not task.done()}
+        finally:
+            for task in tasks:
+                if not task.done():
+                    task.cancel()
+        if empty_answer or last_error is None:
+            return []
+        raise last_error
+
+    def stats(self) -> Dict:
+        return {
+            "policy": self.policy,
+            "primary": self.primary,
+            "hedge_delay_ms": round(self.hedge_delay() * 1000, 1),
+            "hedges_fired": self.hedges_fired,
+            "providers": {name: stats.to_dict() for name, stats in self.provider_stats.items()},
+        }
+
+
+# Build the orchestrator from SEARCH_* settings; Google is only used when its keys are set
+def orchestrator_from_env() -> SearchOrchestrator:
+    providers = {"serpapi": serpapi_search}
+    if GOOGLE_API_KEY and GOOGLE_CX:
+        providers["google"] = google_search
+    primary = os.getenv("SEARCH_PRIMARY_PROVIDER", "serpapi")
+    if primary not in providers:
+        primary = "serpapi"
+    return SearchOrchestrator(
+        providers,
+        primary=primary,
+        policy=os.getenv("SEARCH_POLICY", "hedge"),
+        default_hedge_delay=env_float("SEARCH_HEDGE_DELAY", 1.0),
+        min_hedge_delay=env_float("SEARCH_HEDGE_MIN_DELAY", 0.25),
+        max_hedge_delay=env_float("SEARCH_HEDGE_MAX_DELAY", 5.0),
+        min_samples=env_int("SEARCH_HEDGE_MIN_SAMPLES", 20),
+    )
+
+
+search_orchestrator = orchestrator_from_env()
@@ -0,0 +1,236 @@
+import math
+import re
+from dataclasses import dataclass
+from typing import Dict, List, Optional
+
+from config import env_bool, env_float, env_int
+from context_budget import estimate_tokens
+from entities import entity_set
+from metrics import SEARCH_GATE_DECISIONS, SEARCH_GATE_SECONDS_SAVED
+from text_tokens import tokenize
+
+# Response header telling the client what the gate decided and why, e.g. "skip; acknowledgement"
+SEARCH_GATE_HEADERS = ["X-Search-Decision"]
+# Values of the X-Search request header; "auto" (or no header) lets the gate decide
+SEARCH_OVERRIDES = {"force": "search", "on": "search", "skip": "skip", "off": "skip"}
+
+_SPLIT = re.compile(r"[\s\W_]+")
+_QUESTION = re.compile(r"[?？]")
+_DIGITS = re.compile(r"\d")
+
+# Whole messages that only acknowledge or greet: every word must be one of these
+ACKNOWLEDGEMENTS = frozenset({
+    "thanks", "thank", "you", "thx", "ty", "ok", "okay", "k", "cool", "great", "nice", "good", "perfect",
+    "awesome", "got", "it", "noted", "sure", "yes", "no", "yep", "nope", "bye", "hi", "hello", "hey",
+    "很好", "好", "好的", "好呀", "明白", "明白了", "收到", "谢谢", "謝謝", "谢谢你", "謝謝你", "多谢", "多謝",
+    "唔該", "唔该", "冇問題", "没问题", "沒問題", "你好", "拜拜",
+})
+# Requests to rework the earlier answer rather than find something new
+_REWORK = re.compile(
+    r"\b(?:translate|summari[sz]e|rephrase|rewrite|reword|shorten|simplify|paraphrase|elaborate|expand on"
+    r"|format|bullet|tabulate|explain (?:that|this|it)|say (?:that|it) again|in (?:english|chinese|cantonese))\b"
+    r"|翻譯|翻译|總結|总结|簡化|简化|改寫|改写|重寫|重写|詳細啲|详细点|用英文|用中文|用廣東話|列表",
+    re.IGNORECASE,
+)
+# References to what is already in the conversation
+_REFER_BACK = re.compile(
+    r"\b(?:above|previous|earlier|that|this|it|those|these|your (?:answer|reply|response)|the (?:answer|list|table))\b"
+    r"|上面|以上|剛才|刚才|你的回答|呢個|这个|這個",
+    re.IGNORECASE,
+)
+_INTERROGATIVE = re.compile(
+    r"\b(?:what|which|who|when|where|why|how|is|are|does|do|can|should|compare|difference|recommend|list)\b"
+    r"|什麼|什么|點樣|点样|邊間|边间|幾多|几多|多少|如何|怎樣|怎样|怎么|哪|嗎|吗|比較|比较|推薦|推荐",
+    re.IGNORECASE,
+)
+# Facts that go stale: prices, rates, news, anything dated
+_FRESHNESS = re.compile(
+    r"\b(?:latest|current|currently|today|now|new|recent|news|price|prices|premium|premiums|rate|rates|cost|fee|fees"
+    r"|promotion|offer|20\d\d)\b"
+    r"|最新|現在|现在|今年|而家|價格|价格|保費|保费|利率|費用|费用|優惠|优惠|新聞|新闻",
+    re.IGNORECASE,
+)
+
+# Weights of the lightweight classifier: a logistic score over cheap text features,
+# tuned by hand on logged follow-ups. Positive features argue for a new search.
+WEIGHTS = {
+    "bias": -0.6,
+    "question": 1.0,
+    "interrogative": 1.0,
+    "freshness": 1.6,
+    "digits": 0.5,
+    "length": 0.08,  # per word or CJK bigram, up to 25
+    "refer_back": -1.4,
+    "rework": -2.0,
+}
+
+
+def _words(text: str) -> List[str]:
+    return [word for word in _SPLIT.split(text) if word]
+
+
+def acknowledgement(text: str) -> bool:
+    words = _words(text.lower())
+    return 0 < len(words) <= 6 and all(word in ACKNOWLEDGEMENTS for word in words)
+
+
+# Message length in words, counting CJK text (written without spaces) in bigrams
+def message_length(text: str) -> int:
+    return len(tokenize(text))
+
+
+# Probability that the message needs a new web search
+def search_score(text: str) -> float:
+    score = WEIGHTS["bias"] + WEIGHTS["length"] * min(message_length(text), 25)
+    for feature, pattern in (
+        ("question", _QUESTION),
+        ("interrogative", _INTERROGATIVE),
+        ("freshness", _FRESHNESS),
+        ("digits", _DIGITS),
+        ("refer_back", _REFER_BACK),
+        ("rework", _REWORK),
+    ):
+        if pattern.search(text):
+            score += WEIGHTS[feature]
+    return 1 / (1 + math.exp(-score))
+
+
+# User turns before the latest one, newest first; None for one without text content
+def _earlier_user_turns(messages: List[Dict]) -> List[Optional[str]]:
+    turns = []
+    for message in messages:
+        if message.get("role") == "user":
+            content = message.get("content")
+            turns.append(content if isinstance(content, str) and content.strip() else None)
+    return turns[-2::-1]
+
+
+@dataclass
+class GateDecision:
+    decision: str  # "search", "reuse" or "skip"
+    reason: str
+    query: str  # what to search for, or whose earlier search context to reuse
+    score: Optional[float] = None
+
+    @property
+    def header(self) -> Dict[str, str]:
+        return {"X-Search-Decision": f"{self.decision}; {self.reason}"}
+
+
+# Decides per turn whether /api/dswithsearch needs a new web search.
+# Rules come first: the X-Search override, acknowledgements ("thanks"), a
+# follow-up naming an insurer or product the previous user turn did not (always
+# searched: the earlier context is about something else) and requests to rework
+# the previous answer ("translate the above"). Other follow-up turns go to the
+# classifier, and a score below `threshold` skips the search.
+# A skipped follow-up reuses the search context of the most recent earlier user
+# turn that still has one cached, so the model keeps the sources it answered from;
+# nothing is sent upstream either way. The first turn of a conversation is always
+# searched.
+class SearchGate:
+    def __init__(self, enabled: bool = True, threshold: float = 0.5, reuse: bool = True,
+                 max_follow_up_words: int = 40, reuse_lookback: int = 8, alpha: float = 0.1):
+        self.enabled = enabled
+        self.threshold = threshold
+        self.reuse = reuse
+        self.max_follow_up_words = max_follow_up_words
+        self.reuse_lookback = reuse_lookback
+        self.alpha = alpha
+        self.decisions: Dict[str, int] = {"search": 0, "reuse": 0, "skip": 0}
+        self.reasons: Dict[str, int] = {}
+        # EWMA cost of a search that actually ran, to estimate what a skip saves
+        self.search_latency: Optional[float] = None
+        self.context_tokens: Optional[float] = None
+        self.seconds_saved = 0.0
+        self.tokens_saved = 0.0
+
+    def decide(self, messages: List[Dict], query: str, override: Optional[str] = None) -> GateDecision:
+        if override and override.lower() in SEARCH_OVERRIDES:
+            return GateDecision(SEARCH_OVERRIDES[override.lower()], "override", query)
+        if not self.enabled:
+            return GateDecision("search", "gate_disabled", query)
+        if acknowledgement(query):
+            return GateDecision("skip", "acknowledgement", query)
+        earlier = _earlier_user_turns(messages)
+        previous = earlier[0] if earlier else None
+        if previous is None:
+            return GateDecision("search", "first_turn", query)
+        if entity_set(query) - entity_set(previous):
+            return GateDecision("search", "new_entity", query)
+        if message_length(query) > self.max_follow_up_words:
+            return GateDecision("search", "long_message", query)
+        if _REWORK.search(query):
+            return self._without_search("rework", previous)
+        score = search_score(query)
+        if score < self.threshold:
+            return self._without_search("classifier", previous, score)
+        return GateDecision("search", "classifier", query, score)
+
+    def _without_search(self, reason: str, previous: str, score: Optional[float] = None) -> GateDecision:
+        if self.reuse:
+            return GateDecision("reuse", reason, previous, score)
+        return GateDecision("skip", reason, previous, score)
+
+    # Earlier user turns whose search context can stand in for this one, newest
+    # first. The previous turn may itself have reused or skipped and have nothing
+    # cached, so the walk goes back up to `reuse_lookback` turns; a turn only
+    # qualifies if it names every insurer and product mentioned since.
+    def reuse_candidates(self, messages: List[Dict], query: str) -> List[str]:
+        named = entity_set(query)
+        candidates = []
+        for turn in _earlier_user_turns(messages)[:self.reuse_lookback]:
+            if turn is None:
+                continue
+            entities = entity_set(turn)
+            if named <= entities:
+                candidates.append(turn)
+            named |= entities
+        return candidates
+
+    # Count a decision once it is final; a reuse whose context is no longer cached is a skip
+    def record(self, decision: GateDecision):
+        self.decisions[decision.decision] += 1
+        key = f"{decision.decision}:{decision.reason}"
+        self.reasons[key] = self.reasons.get(key, 0) + 1
+        SEARCH_GATE_DECISIONS.inc(decision.decision, decision.reason)
+        if decision.decision != "search" and self.search_latency is not None:
+            self.seconds_saved += self.search_latency
+            # A reused context is still sent, so only a skip saves prompt tokens
+            if decision.decision == "skip":
+                self.tokens_saved += self.context_tokens or 0.0
+            SEARCH_GATE_SECONDS_SAVED.inc(amount=self.search_latency)
+
+    def record_search(self, seconds: float, search_context: str):
+        tokens = estimate_tokens(search_context) if search_context else 0
+        if self.search_latency is None:
+            self.search_latency, self.context_tokens = seconds, float(tokens)
+        else:
+            self.search_latency = self.alpha * seconds + (1 - self.alpha) * self.search_latency
+            self.context_tokens = self.alpha * tokens + (1 - self.alpha) * self.context_tokens
+
+    def stats(self) -> Dict:
+        total = sum(self.decisions.values())
+        return {
+            "enabled": self.enabled,
+            "threshold": self.threshold,
+            "reuse": self.reuse,
+            "decisions": dict(self.decisions),
+            "reasons": dict(self.reasons),
+            "skip_rate": round((total - self.decisions["search"]) / total, 3) if total else 0.0,
+            "search_latency_ewma_ms": round(self.search_latency * 1000, 1) if self.search_latency is not None else None,
+            "seconds_saved": round(self.seconds_saved, 3),
+            "context_tokens_saved": round(self.tokens_saved),
+        }
+
+
+def gate_from_env() -> SearchGate:
+    return SearchGate(
+        enabled=env_bool("SEARCH_GATE_ENABLED", True),
+        threshold=env_float("SEARCH_GATE_THRESHOLD", 0.5),
+        reuse=env_bool("SEARCH_GATE_REUSE", True),
+        max_follow_up_words=env_int("SEARCH_GATE_MAX_FOLLOW_UP_WORDS", 40),
+        reuse_lookback=env_int("SEARCH_GATE_REUSE_LOOKBACK", 8),
+    )
+
+
+search_gate = gate_from_env()
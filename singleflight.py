@@ -0,0 +1,64 @@
+import asyncio
+import logging
+from typing import Any, Awaitable, Callable, Dict, Hashable
+
+logger = logging.getLogger(__name__)
+
+
+# Coalesce concurrent calls that share a key onto one upstream task.
+# The first caller starts the task; later callers await the same task until it
+# finishes. Each caller awaits through asyncio.shield, so a client that
+# disconnects only cancels its own wait and never a lookup others still wait on.
+# When the last waiter is cancelled the shared task is cancelled too, so nobody
+# pays for an upstream call whose result no one will read.
+class SingleFlight:
+    def __init__(self):
+        self._inflight: Dict[Hashable, asyncio.Task] = {}
+        self._waiters: Dict[Hashable, int] = {}
+        self.calls = 0
+        self.coalesced = 0
+        self.errors = 0
+        self.abandoned = 0
+
+    def _on_done(self, key: Hashable, task: asyncio.Task):
+        if self._inflight.get(key) is task:
+            del self._inflight[key]
+            self._waiters.pop(key, None)
+        if task.cancelled():
+            return
+        # Retrieve the exception so it is not reported as unhandled when every waiter left
+        if task.exception() is not None:
+            self.errors += 1
+            logger.warning(f"Shared call for {key!r} failed: {task.exception()}")
+
+    async def do(self, key: Hashable, fn: Callable[[], Awaitable[Any]]) -> Any:
+        task = self._inflight.get(key)
+        if task is None:
+            self.calls += 1
+            task = asyncio.ensure_future(fn())
+            self._inflight[key] = task
+            task.add_done_callback(lambda t: self._on_done(key, t))
+        else:
+            self.coalesced += 1
+        self._waiters[key] = self._waiters.get(key, 0) + 1
+        try:
+            return await asyncio.shield(task)
+        except asyncio.CancelledError:
+            if self._inflight.get(key) is task:
+                self._waiters[key] -= 1
+                if not self._waiters[key] and not task.done():
+                    self.abandoned += 1
+                    task.cancel()
+            raise
+
+    def __len__(self) -> int:
+        return len(self._inflight)
+
+    def stats(self) -> Dict:
+        return {
+            "in_flight": len(self._inflight),
+            "upstream_calls": self.calls,
+            "coalesced": self.coalesced,
+            "errors": self.errors,
+            "abandoned": self.abandoned,
+        }
@@ -0,0 +1,209 @@
+import asyncio
+import json
+import logging
+import sqlite3
+import time
+from typing import Any, Dict, Optional
+
+from config import env_int
+
+logger = logging.getLogger(__name__)
+
+_SCHEMA = """
+CREATE TABLE IF NOT EXISTS cache_entries (
+    key TEXT PRIMARY KEY,
+    value TEXT NOT NULL,
+    size INTEGER NOT NULL,
+    expires_at REAL NOT NULL,
+    accessed_at REAL NOT NULL
+);
+CREATE INDEX IF NOT EXISTS cache_entries_expires_at ON cache_entries (expires_at);
+CREATE INDEX IF NOT EXISTS cache_entries_accessed_at ON cache_entries (accessed_at);
+"""
+
+# How long a write on the event loop waits for another worker's lock before the
+# write is dropped; the compaction thread can afford to wait much longer
+REQUEST_BUSY_TIMEOUT_MS = env_int("SQLITE_CACHE_BUSY_TIMEOUT_MS", 50)
+COMPACTION_BUSY_TIMEOUT_MS = 5000
+
+
+def _connect(path: str, busy_timeout_ms: int) -> sqlite3.Connection:
+    connection = sqlite3.connect(
+        path, timeout=busy_timeout_ms / 1000, isolation_level=None, check_same_thread=False
+    )
+    # WAL lets readers in other hypercorn workers proceed while one worker writes
+    connection.execute("PRAGMA journal_mode=WAL")
+    connection.execute("PRAGMA synchronous=NORMAL")
+    connection.execute(f"PRAGMA busy_timeout={int(busy_timeout_ms)}")
+    return connection
+
+
+# Persistent cache backend with the same interface and TTL semantics as TTLCache.
+# Entries live in a SQLite file shared by every worker process and survive restarts.
+# Expiry uses wall-clock time because it is compared across processes.
+# Point lookups on the primary key take microseconds, so get/set run inline on the
+# event loop; the heavier compaction pass runs in a worker thread.
+# A hit never writes: access times are kept in memory and written in one batch by
+# the next compaction, and expired rows are left for compaction to delete. Sets
+# give up after REQUEST_BUSY_TIMEOUT_MS when another worker holds the write lock,
+# so a busy database costs a cache write rather than a stalled event loop.
+class SQLiteCache:
+    def __init__(
+        self,
+        path: str,
+        max_entries: int = 1000,
+        max_bytes: int = 8 * 1024 * 1024,
+        ttl: float = 300.0,
+    ):
+        self.path = path
+        self.max_entries = max_entries
+        self.max_bytes = max_bytes
+        self.ttl = ttl
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self.expirations = 0
+        # key -> last access time not yet written to the database
+        self._touched: Dict[str, float] = {}
+        self.dropped_writes = 0
+        self._connection = _connect(path, COMPACTION_BUSY_TIMEOUT_MS)
+        self._connection.executescript(_SCHEMA)
+        self._connection.execute(f"PRAGMA busy_timeout={int(REQUEST_BUSY_TIMEOUT_MS)}")
+
+    def __len__(self) -> int:
+        row = self._connection.execute(
+            "SELECT COUNT(*) FROM cache_entries WHERE expires_at > ?", (time.time(),)
+        ).fetchone()
+        return row[0]
+
+    def __contains__(self, key: str) -> bool:
+        row = self._connection.execute(
+            "SELECT 1 FROM cache_entries WHERE key = ? AND expires_at > ?", (key, time.time())
+        ).fetchone()
+        return row is not None
+
+    def get(self, key: str, default: Optional[Any] = None, record_stats: bool = True) -> Optional[Any]:
+        now = time.time()
+        try:
+            row = self._connection.execute(
+                "SELECT value FROM cache_entries WHERE key = ? AND expires_at > ?", (key, now)
+            ).fetchone()
+        except sqlite3.OperationalError as e:
+            logger.warning(f"Cache read from {self.path} failed: {str(e)}")
+            row = None
+        if row is None:
+            self.misses += record_stats
+            return default
+        value = row[0]
+        self._touched[key] = now
+        self.hits += record_stats
+        return json.loads(value)
+
+    def set(self, key: str, value: Any, ttl: Optional[float] = None):
+        encoded = json.dumps(value, ensure_ascii=False)
+        size = len(encoded.encode("utf-8"))
+        if size > self.max_bytes:
+            self.delete(key)
+            return
+        now = time.time()
+        expires_at = now + (self.ttl if ttl is None else ttl)
+        self._write(
+            "INSERT OR REPLACE INTO cache_entries (key, value, size, expires_at, accessed_at) "
+            "VALUES (?, ?, ?, ?, ?)",
+            (key, encoded, size, expires_at, now),
+        )
+
+    def delete(self, key: str):
+        self._touched.pop(key, None)
+        self._write("DELETE FROM cache_entries WHERE key = ?", (key,))
+
+    # Writes are best effort: a locked database drops the write instead of waiting
+    def _write(self, sql: str, params: tuple):
+        try:
+            self._connection.execute(sql, params)
+        except sqlite3.OperationalError as e:
+            self.dropped_writes += 1
+            logger.warning(f"Cache write to {self.path} dropped: {str(e)}")
+
+    # Write the access times collected since the last flush, in one transaction
+    def _flush_access_times(self, connection: sqlite3.Connection):
+        touched, self._touched = self._touched, {}
+        if touched:
+            connection.execute("BEGIN")
+            connection.executemany(
+                "UPDATE cache_entries SET accessed_at = MAX(accessed_at, ?) WHERE key = ?",
+                [(accessed_at, key) for key, accessed_at in touched.items()],
+            )
+            connection.execute("COMMIT")
+
+    def clear(self):
+        self._touched.clear()
+        self._connection.execute("DELETE FROM cache_entries")
+
+    def compact(self) -> int:
+        """Delete expired rows, then least recently used rows beyond the entry and byte limits"""
+        connection = _connect(self.path, COMPACTION_BUSY_TIMEOUT_MS)
+        try:
+            # Recency must be current before least recently used rows are evicted
+            self._flush_access_times(connection)
+            removed = connection.execute(
+                "DELETE FROM cache_entries WHERE expires_at <= ?", (time.time(),)
+            ).rowcount
+            self.expirations += removed
+            evicted = connection.execute(
+                "DELETE FROM cache_entries WHERE key IN ("
+                "SELECT key FROM cache_entries ORDER BY accessed_at DESC LIMIT -1 OFFSET ?)",
+                (self.max_entries,),
+            ).rowcount
+            # Walk entries newest-first and drop everything past the byte budget
+            evicted += connection.execute(
+                "DELETE FROM cache_entries WHERE key IN ("
+                "SELECT key FROM (SELECT key, SUM(size) OVER (ORDER BY accessed_at DESC) AS running "
+                "FROM cache_entries) WHERE running > ?)",
+                (self.max_bytes,),
+            ).rowcount
+            self.evictions += evicted
+            connection.execute("PRAGMA wal_checkpoint(PASSIVE)")
+            return removed + evicted
+        finally:
+            connection.close()
+
+    async def run_compaction(self, interval: float):
+        while True:
+            await asyncio.sleep(interval)
+            try:
+                removed = await asyncio.to_thread(self.compact)
+                if removed:
+                    logger.info(f"Compacted {removed} rows from {self.path}")
+            except sqlite3.Error as e:
+                logger.error(f"Cache compaction failed: {str(e)}")
+
+    def stats(self) -> Dict:
+        row = self._connection.execute(
+            "SELECT COUNT(*), COALESCE(SUM(size), 0) FROM cache_entries"
+        ).fetchone()
+        lookups = self.hits + self.misses
+        return {
+            "backend": "sqlite",
+            "path": self.path,
+            "entries": row[0],
+            "bytes": row[1],
+            "max_entries": self.max_entries,
+            "max_bytes": self.max_bytes,
+            "ttl_seconds": self.ttl,
+            "hits": self.hits,
+            "misses": self.misses,
+            "hit_rate": round(self.hits / lookups, 4) if lookups else 0.0,
+            "evictions": self.evictions,
+            "expirations": self.expirations,
+            "dropped_writes": self.dropped_writes,
+            "pending_access_times": len(self._touched),
+        }
+
+    def close(self):
+        try:
+            self._connection.execute(f"PRAGMA busy_timeout={COMPACTION_BUSY_TIMEOUT_MS}")
+            self._flush_access_times(self._connection)
+        except sqlite3.Error as e:
+            logger.warning(f"Could not save cache access times to {self.path}: {str(e)}")
+        self._connection.close()
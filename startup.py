@@ -0,0 +1,169 @@
+import asyncio
+import builtins
+import importlib
+import logging
+import os
+import sys
+import time
+from collections import defaultdict
+from typing import Callable, Dict, List, Optional
+
+from dotenv import load_dotenv
+
+logger = logging.getLogger(__name__)
+
+# main.py imports this module before config.py, so .env is loaded here as well;
+# otherwise a STARTUP_MODE set in .env would be ignored
+load_dotenv()
+
+# How provider SDKs are loaded:
+#   "eager"      - at import time, before the server listens
+#   "lazy"       - on the first request that needs them
+#   "background" - in a thread right after startup, so the first request rarely waits
+STARTUP_MODE = os.getenv("STARTUP_MODE", "background")
+# Modules that are slow to import and only needed once a provider is called
+PROVIDER_MODULES = ("openai",)
+
+
+# Wall-clock time the process started (Linux), else when this module was imported
+def _process_started_at() -> float:
+    try:
+        with open("/proc/self/stat") as f:
+            start_ticks = int(f.read().rsplit(")", 1)[1].split()[19])
+        with open("/proc/uptime") as f:
+            uptime = float(f.read().split()[0])
+        return time.time() - uptime + start_ticks / os.sysconf("SC_CLK_TCK")
+    except (OSError, ValueError, IndexError):
+        return time.time()
+
+
+# Times every import while installed and attributes it to the top-level package.
+# Time spent in nested imports of other modules is subtracted, so each package is
+# charged only for its own module bodies, like the "self" column of -X importtime.
+class ImportTimer:
+    def __init__(self):
+        self.self_times: Dict[str, float] = defaultdict(float)
+        self._stack: List[float] = []
+        self._original = None
+
+    def _import(self, name, globals=None, locals=None, fromlist=(), level=0):
+        if level or (name in sys.modules and not fromlist):
+            return self._original(name, globals, locals, fromlist, level)
+        start = time.perf_counter()
+        self._stack.append(0.0)
+        try:
+            return self._original(name, globals, locals, fromlist, level)
+        finally:
+            elapsed = time.perf_counter() - start
+            nested = self._stack.pop()
+            self.self_times[name.partition(".")[0]] += elapsed - nested
+            if self._stack:
+                self._stack[-1] += elapsed
+
+    def install(self):
+        if self._original is None:
+            self._original = builtins.__import__
+            builtins.__import__ = self._import
+
+    def uninstall(self):
+        if self._original is not None:
+            builtins.__import__ = self._original
+            self._original = None
+
+    def top(self, limit: int = 15) -> Dict[str, float]:
+        ranked = sorted(self.self_times.items(), key=lambda entry: entry[1], reverse=True)[:limit]
+        return {name: round(seconds * 1000, 1) for name, seconds in ranked}
+
+
+# Cold-start timeline: process start, app module imported, startup handlers done,
+# first response sent, plus the provider SDK warm-up
+class StartupReport:
+    def __init__(self, mode: str):
+        self.mode = mode
+        self.process_started_at = _process_started_at()
+        self.import_started_at = time.time()
+        self.imports = ImportTimer()
+        self.imported_at: Optional[float] = None
+        self.ready_at: Optional[float] = None
+        self.first_response_at: Optional[float] = None
+        self.warmup_seconds: Optional[float] = None
+        self.warmup_error: Optional[str] = None
+
+    def mark_imported(self):
+        self.imported_at = time.time()
+
+    def mark_ready(self):
+        self.ready_at = time.time()
+        # Imports after this point are request-time work, not cold start
+        self.imports.uninstall()
+        logger.info(
+            f"Startup ({self.mode}): imports {self.imported_at - self.import_started_at:.2f}s, "
+            f"ready {self.ready_at - self.process_started_at:.2f}s after process start"
+        )
+
+    def mark_first_response(self):
+        self.first_response_at = time.time()
+        logger.info(f"First response {self.first_response_at - self.process_started_at:.2f}s after process start")
+
+    def load_provider_modules(self):
+        start = time.perf_counter()
+        try:
+            for name in PROVIDER_MODULES:
+                importlib.import_module(name)
+        except ImportError as e:
+            self.warmup_error = str(e)
+            logger.error(f"Provider SDK warm-up failed: {e}")
+        self.warmup_seconds = time.perf_counter() - start
+
+    # Run the warm-up in a thread once the server is accepting requests
+    async def warm_up(self, after: Optional[Callable[[], None]] = None):
+        await asyncio.to_thread(self.load_provider_modules)
+        if after is not None:
+            after()
+        logger.info(f"Provider SDKs warmed up in {self.warmup_seconds:.2f}s")
+
+    # Seconds per milestone: process start to interpreter ready, app import duration,
+    # and process start to ready / first response. Milestones not reached yet are left out.
+    def timings(self) -> Dict[str, float]:
+        timings = {
+            "process_to_import": self.import_started_at - self.process_started_at,
+            "import": self.imported_at - self.import_started_at if self.imported_at else None,
+            "ready": self.ready_at - self.process_started_at if self.ready_at else None,
+            "first_response": self.first_response_at - self.process_started_at if self.first_response_at else None,
+        }
+        return {phase: round(seconds, 3) for phase, seconds in timings.items() if seconds is not None}
+
+    def stats(self) -> Dict:
+        return {
+            "mode": self.mode,
+            **{f"{phase}_s": seconds for phase, seconds in self.timings().items()},
+            "provider_sdks_loaded": all(name in sys.modules for name in PROVIDER_MODULES),
+            "warmup_s": round(self.warmup_seconds, 3) if self.warmup_seconds is not None else None,
+            "warmup_error": self.warmup_error,
+            "import_ms_by_module": self.imports.top(),
+        }
+
+
+# Pure ASGI middleware that records when the first HTTP response starts
+class FirstResponseMiddleware:
+    def __init__(self, app, report: StartupReport):
+        self.app = app
+        self.report = report
+
+    async def __call__(self, scope, receive, send):
+        if self.report.first_response_at is not None or scope["type"] != "http":
+            await self.app(scope, receive, send)
+            return
+
+        async def send_wrapper(message):
+            if message["type"] == "http.response.start" and self.report.first_response_at is None:
+                self.report.mark_first_response()
+            await send(message)
+
+        await self.app(scope, receive, send_wrapper)
+
+
+# main.py imports this module first, so the timer sees every later import;
+# that is also why nothing but the standard library and python-dotenv is used here
+startup_report = StartupReport(STARTUP_MODE)
+startup_report.imports.install()
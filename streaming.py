@@ -0,0 +1,145 @@
+import asyncio
+import json
+import logging
+import time
+from typing import AsyncIterator, Awaitable, Callable, Dict, Optional
+
+from starlette.responses import StreamingResponse
+
+logger = logging.getLogger(__name__)
+
+# Tag rewrites applied to model output before it reaches the client
+THINK_TAG_REPLACEMENTS = {
+    "<think>": "<AIM AI助手>",
+    "</think>": "</AIM AI助手>",
+}
+
+SSE_HEADERS = {
+    "Cache-Control": "no-cache",
+    "Connection": "keep-alive",
+    "X-Accel-Buffering": "no",
+}
+
+
+# Incremental version of the <think> -> <AIM AI助手> rewrite.
+# Text that could be the start of a tag is held back until the next chunk
+# arrives, so tags split across chunk boundaries are still replaced.
+class ThinkTagRewriter:
+    def __init__(self, replacements: Dict[str, str] = THINK_TAG_REPLACEMENTS):
+        self.replacements = replacements
+        self.pending = ""
+        self.max_tag_length = max(len(tag) for tag in replacements)
+
+    def _held_back_length(self, text: str) -> int:
+        # Longest suffix of text that is a proper prefix of any tag
+        start = text.rfind("<")
+        while start != -1:
+            suffix = text[start:]
+            if len(suffix) >= self.max_tag_length:
+                break
+            if any(tag.startswith(suffix) and tag != suffix for tag in self.replacements):
+                return len(suffix)
+            start = text.rfind("<", 0, start)
+        return 0
+
+    def feed(self, chunk: str) -> str:
+        text = self.pending + chunk
+        for tag, replacement in self.replacements.items():
+            text = text.replace(tag, replacement)
+        held = self._held_back_length(text)
+        if held:
+            self.pending = text[-held:]
+            return text[:-held]
+        self.pending = ""
+        return text
+
+    def flush(self) -> str:
+        text, self.pending = self.pending, ""
+        return text
+
+
+def rewrite_think_tags(text: str) -> str:
+    rewriter = ThinkTagRewriter()
+    return rewriter.feed(text) + rewriter.flush()
+
+
+# StreamingResponse that always awaits `on_close` when it is over: after the
+# last chunk, on error, or when the client disconnected before the body started
+class ClosingStreamingResponse(StreamingResponse):
+    def __init__(self, content, on_close: Callable[[], Awaitable[None]], **kwargs):
+        super().__init__(content, **kwargs)
+        self.on_close = on_close
+
+    async def __call__(self, scope, receive, send):
+        try:
+            await super().__call__(scope, receive, send)
+        finally:
+            await self.on_close()
+
+
+# Format one Server-Sent Events frame
+def sse_event(data, event: Optional[str] = None) -> str:
+    payload = data if isinstance(data, str) else json.dumps(data, ensure_ascii=False)
+    frame = f"event: {event}\n" if event else ""
+    return frame + f"data: {payload}\n\n"
+
+
+# Next chunk of an upstream stream, waiting no later than `expires_at` (monotonic);
+# raises StopAsyncIteration at the end and asyncio.TimeoutError past the deadline
+async def _next_chunk(chunks: AsyncIterator, expires_at: Optional[float]):
+    if expires_at is None:
+        return await chunks.__anext__()
+    return await asyncio.wait_for(chunks.__anext__(), max(expires_at - time.monotonic(), 0.0))
+
+
+# Relay an OpenAI-compatible streaming completion (DeepSeek) as SSE.
+# deepseek-reasoner sends its chain of thought in reasoning_content; it is
+# forwarded as separate "reasoning" events so the message text is unchanged.
+# The stream ends with an error event once `expires_at` (monotonic) passes, even
+# while the upstream is stalled between chunks, and on_cancel(reason,
+# chunks_relayed) reports a deadline or client disconnect.
+async def stream_openai_completion(stream, on_usage: Optional[Callable] = None,
+                                   on_cancel: Optional[Callable[[str, int], None]] = None,
+                                   expires_at: Optional[float] = None) -> AsyncIterator[str]:
+    rewriter = ThinkTagRewriter()
+    chunks = 0
+    upstream = stream.__aiter__()
+    try:
+        while True:
+            try:
+                chunk = await _next_chunk(upstream, expires_at)
+            except StopAsyncIteration:
+                break
+            except asyncio.TimeoutError:
+                if on_cancel is not None:
+                    on_cancel("deadline", chunks)
+                yield sse_event({"detail": "Deadline exceeded"}, event="error")
+                return
+            chunks += 1
+            # The usage block, when the provider sends one, rides on the final chunk
+            if on_usage is not None and getattr(chunk, "usage", None) is not None:
+                on_usage(chunk.usage)
+            if not chunk.choices:
+                continue
+            delta = chunk.choices[0].delta
+            reasoning = getattr(delta, "reasoning_content", None)
+            if reasoning:
+                yield sse_event({"delta": reasoning}, event="reasoning")
+            if delta.content:
+                text = rewriter.feed(delta.content)
+                if text:
+                    yield sse_event({"delta": text})
+        tail = rewriter.flush()
+        if tail:
+            yield sse_event({"delta": tail})
+        yield sse_event("[DONE]")
+    except (asyncio.CancelledError, GeneratorExit):
+        # The client went away mid-stream; closing the stream below stops the upstream
+        if on_cancel is not None:
+            on_cancel("disconnect", chunks)
+        raise
+    except Exception as e:
+        logger.error(f"Streaming completion failed: {str(e)}")
+        yield sse_event({"detail": "AI service error"}, event="error")
+    finally:
+        await stream.close()
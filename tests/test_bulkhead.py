@@ -0,0 +1,63 @@
+import asyncio
+
+import pytest
+
+from bulkhead import Bulkhead, StreamSlot
+from streaming import ClosingStreamingResponse
+
+
+class StubUpstream:
+    def __init__(self):
+        self.closes = 0
+
+    async def close(self):
+        self.closes += 1
+
+
+async def body(started: list):
+    started.append(True)
+    for text in ("data: a\n\n", "data: b\n\n"):
+        yield text
+
+
+def scope(spec_version: str = "2.4"):
+    return {"type": "http", "asgi": {"spec_version": spec_version}}
+
+
+async def respond(send, spec_version: str = "2.4"):
+    bulkhead = Bulkhead("model test", limit=1, max_queue=1, max_wait=1.0)
+    upstream, started = StubUpstream(), []
+    slot = StreamSlot(bulkhead, await bulkhead.acquire(), upstream)
+    response = ClosingStreamingResponse(slot.relay(body(started)), on_close=slot.close, media_type="text/event-stream")
+
+    async def receive():
+        await asyncio.Event().wait()
+
+    try:
+        await response(scope(spec_version), receive, send)
+    except Exception:
+        pass
+    return bulkhead, upstream, started
+
+
+def test_slot_is_released_once_after_the_body_is_sent():
+    sent = []
+
+    async def send(message):
+        sent.append(message)
+
+    bulkhead, upstream, started = asyncio.run(respond(send))
+    assert started and sent[-1] == {"type": "http.response.body", "body": b"", "more_body": False}
+    assert bulkhead.active == 0 and upstream.closes == 1
+    assert not bulkhead._semaphore.locked()
+
+
+@pytest.mark.parametrize("spec_version", ["2.4", "2.0"])
+def test_slot_is_released_when_the_client_is_gone_before_the_body_starts(spec_version):
+    async def send(message):
+        raise OSError("connection reset")
+
+    bulkhead, upstream, started = asyncio.run(respond(send, spec_version))
+    assert not started
+    assert bulkhead.active == 0 and upstream.closes == 1
+    assert not bulkhead._semaphore.locked()
@@ -0,0 +1,62 @@
+import time
+
+from local_index import SnippetIndex
+
+
+def item(site: str, insurer: str, index: int, product: str = "critical illness plan") -> dict:
+    return {
+        "title": f"{insurer} {product} {index}",
+        "snippet": f"{insurer} {product} covers early stage cancer, heart attack and stroke with premium waiver.",
+        "link": f"https://www.{site}/plans/{index}",
+    }
+
+
+def filler(index: int) -> dict:
+    return {
+        "title": f"Hong Kong market news {index}",
+        "snippet": f"Stocks, property and interest rates in brief, issue {index}.",
+        "link": f"https://www.scmp.com/news/{index}",
+    }
+
+
+def mixed_index(**settings) -> SnippetIndex:
+    index = SnippetIndex(enabled=True, **settings)
+    index.add([filler(i) for i in range(40)])
+    index.add([item("aia.com.hk", "AIA", i) for i in range(5)])
+    index.add([item("axa.com.hk", "AXA", i) for i in range(3)])
+    return index
+
+
+def test_lookup_returns_only_the_insurer_asked_about():
+    index = mixed_index()
+    results = index.lookup("AXA critical illness plan")
+    assert results is not None
+    assert all("axa.com.hk" in result["link"] for result in results)
+    results = index.lookup("AIA critical illness plan")
+    assert results is not None
+    assert all("aia.com.hk" in result["link"] for result in results)
+
+
+def test_lookup_falls_back_when_the_insurer_has_no_pages():
+    index = mixed_index()
+    assert index.lookup("Manulife critical illness plan") is None
+    assert index.lookup("Prudential critical illness plan") is None
+
+
+def test_lookup_requires_the_product_asked_about():
+    index = mixed_index()
+    assert index.lookup("AIA medical plan") is None
+
+
+def test_coverage_is_weighted_by_idf():
+    index = mixed_index()
+    coverage = {doc[0]: coverage for _, coverage, doc in index.search("AXA critical illness plan", k=20)}
+    # 3 of 4 terms match the AIA pages, but the one missing is the rarest
+    assert max(value for link, value in coverage.items() if "aia.com.hk" in link) < 0.7
+    assert min(value for link, value in coverage.items() if "axa.com.hk" in link) == 1.0
+
+
+def test_stale_pages_are_not_served():
+    index = SnippetIndex(enabled=True, max_age=60)
+    index.add([item("aia.com.hk", "AIA", i) for i in range(5)], fetched_at=time.time() - 3600)
+    assert index.lookup("AIA critical illness plan") is None
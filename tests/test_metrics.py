@@ -0,0 +1,44 @@
+import pytest
+from fastapi import FastAPI
+from fastapi.testclient import TestClient
+
+from metrics import HTTP_REQUESTS, MetricsMiddleware
+
+
+@pytest.fixture
+def client():
+    app = FastAPI()
+
+    @app.get("/api/jobs/{job_id}")
+    async def get_job(job_id: str):
+        return {"id": job_id}
+
+    @app.post("/api/ds")
+    async def ds():
+        return {}
+
+    app.add_middleware(MetricsMiddleware, routes=lambda: app.routes)
+    HTTP_REQUESTS.values.clear()
+    return TestClient(app)
+
+
+def requests_for(endpoint: str):
+    return {labels[2]: value for labels, value in HTTP_REQUESTS.values.items() if labels[0] == endpoint}
+
+
+def test_parameterised_route_is_labelled_with_its_template(client):
+    client.get("/api/jobs/abc")
+    client.get("/api/jobs/def")
+    assert requests_for("/api/jobs/{job_id}") == {"200": 2.0}
+    assert requests_for("other") == {}
+
+
+def test_wrong_method_keeps_the_route_label(client):
+    assert client.get("/api/ds").status_code == 405
+    assert requests_for("/api/ds") == {"405": 1.0}
+
+
+def test_unknown_paths_share_one_label(client):
+    client.get("/wp-login.php")
+    client.get("/.env")
+    assert requests_for("other") == {"404": 2.0}
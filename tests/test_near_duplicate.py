@@ -0,0 +1,55 @@
+from near_duplicate import NearDuplicateIndex, shingles
+
+
+def index_with(*keys: str) -> NearDuplicateIndex:
+    index = NearDuplicateIndex(threshold=0.8)
+    for key in keys:
+        index.add(key)
+    return index
+
+
+def test_rephrasing_matches():
+    index = index_with("aia critical illness plan")
+    assert index.find("aia critical illness plan") is None  # the same key is an exact hit, not a near one
+    match = index.find("critical illness plan aia")
+    assert match is not None and match[0] == "aia critical illness plan"
+
+
+def test_plural_matches_singular():
+    index = index_with("aia critical illness plan")
+    match = index.find("aia critical illness plans")
+    assert match == ("aia critical illness plan", 1.0)
+
+
+def test_different_insurer_never_matches():
+    index = index_with("aia critical illness plan")
+    assert index.find("axa critical illness plan") is None
+    assert index.find("宏利 critical illness plan") is None
+
+
+def test_different_product_never_matches():
+    index = index_with("manulife critical illness plan review")
+    assert index.find("manulife medical plan review") is None
+
+
+def test_insurer_named_in_chinese_matches_its_own_entries():
+    index = index_with("友邦 危疾 保障 計劃 比較")
+    assert index.find("友邦 危疾 保障 計劃 比較 推介") is not None
+    assert index.find("宏利 危疾 保障 計劃 比較 推介") is None
+
+
+def test_different_numbers_never_match():
+    index = index_with("aia critical illness premium 2023")
+    assert index.find("aia critical illness premium 2024") is None
+
+
+def test_removed_entries_are_not_found():
+    index = index_with("aia critical illness plan")
+    index.remove("aia critical illness plan")
+    assert index.find("aia critical illness plans") is None
+    assert len(index) == 0
+
+
+def test_plural_folding_keeps_words_ending_in_ss():
+    assert "illness" in shingles("critical illness")
+    assert "policy" in shingles("policies")
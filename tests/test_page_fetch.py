@@ -0,0 +1,105 @@
+import asyncio
+import threading
+
+import httpx
+import pytest
+
+import page_fetch
+from cache import TTLCache
+from page_fetch import PageFetcher
+
+ARTICLE = "<html><body><nav>Home | Plans</nav><p>{text}</p><footer>Contact us</footer></body></html>"
+
+
+@pytest.fixture
+def serve(monkeypatch):
+    def install(handler):
+        client = httpx.AsyncClient(transport=httpx.MockTransport(handler))
+        monkeypatch.setattr(page_fetch.upstreams, "http", lambda name: client)
+    return install
+
+
+def fetcher(**kwargs) -> PageFetcher:
+    return PageFetcher(TTLCache(max_entries=100), enabled=True, **kwargs)
+
+
+def test_pages_are_parsed_and_scored_off_the_event_loop(serve, monkeypatch):
+    serve(lambda request: httpx.Response(200, html=ARTICLE.format(text="AIA critical illness cover pays out on diagnosis.")))
+    threads = []
+    extract, best = page_fetch.extract_passages, PageFetcher._best_passages
+
+    def recording_extract(html):
+        threads.append(threading.get_ident())
+        return extract(html)
+
+    def recording_best(self, query, docs):
+        threads.append(threading.get_ident())
+        return best(self, query, docs)
+
+    monkeypatch.setattr(page_fetch, "extract_passages", recording_extract)
+    monkeypatch.setattr(PageFetcher, "_best_passages", recording_best)
+
+    async def run():
+        return threading.get_ident(), await fetcher().relevant_context(
+            "aia critical illness", [{"link": "https://www.aia.com.hk/ci"}])
+
+    loop_thread, context = asyncio.run(run())
+    assert context == "[https://www.aia.com.hk/ci]\nAIA critical illness cover pays out on diagnosis."
+    assert len(threads) == 2 and loop_thread not in threads
+
+
+def test_fetched_documents_are_cached_without_html(serve):
+    serve(lambda request: httpx.Response(200, html=ARTICLE.format(text="Manulife medical plans cover ward upgrades."),
+                                         headers={"etag": '"v1"'}))
+    page = fetcher()
+    doc = asyncio.run(page.fetch("https://www.manulife.com.hk/medical"))
+    assert doc["passages"] == ["Manulife medical plans cover ward upgrades."]
+    assert "html" not in page.cache.get("https://www.manulife.com.hk/medical")
+
+
+def redirecting(routes):
+    requested = []
+
+    def handler(request):
+        requested.append(str(request.url))
+        target = routes.get(str(request.url))
+        if target is not None:
+            return httpx.Response(302, headers={"location": target})
+        return httpx.Response(200, html=ARTICLE.format(text="Prudential savings plans guarantee part of the return."))
+    return handler, requested
+
+
+def test_redirect_within_the_searched_sites_is_followed(serve):
+    handler, requested = redirecting({"https://prudential.com.hk/savings": "https://www.prudential.com.hk/en/savings"})
+    serve(handler)
+    page = fetcher()
+    doc = asyncio.run(page.fetch("https://prudential.com.hk/savings"))
+    assert doc["url"] == "https://prudential.com.hk/savings"
+    assert doc["passages"] == ["Prudential savings plans guarantee part of the return."]
+    assert requested == ["https://prudential.com.hk/savings", "https://www.prudential.com.hk/en/savings"]
+    assert set(page._host_limits) == {"prudential.com.hk", "www.prudential.com.hk"}
+
+
+@pytest.mark.parametrize("target", [
+    "http://169.254.169.254/latest/meta-data/",
+    "http://localhost:8000/admin",
+    "https://aia.com.hk.attacker.example/ci",
+    "file:///etc/passwd",
+])
+def test_redirect_off_the_searched_sites_is_not_followed(serve, target):
+    handler, requested = redirecting({"https://www.aia.com.hk/ci": target})
+    serve(handler)
+    page = fetcher()
+    assert asyncio.run(page.fetch("https://www.aia.com.hk/ci")) is None
+    assert requested == ["https://www.aia.com.hk/ci"]
+    assert page.cache.get("https://www.aia.com.hk/ci") is None
+
+
+def test_redirect_chains_are_capped(serve):
+    handler, requested = redirecting({
+        "https://www.axa.com.hk/a": "https://www.axa.com.hk/b",
+        "https://www.axa.com.hk/b": "https://www.axa.com.hk/a",
+    })
+    serve(handler)
+    assert asyncio.run(fetcher(max_redirects=2).fetch("https://www.axa.com.hk/a")) is None
+    assert len(requested) == 3
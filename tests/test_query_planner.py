@@ -0,0 +1,93 @@
+import pytest
+
+from entities import INSURER_PATTERNS, PRODUCT_PATTERNS
+from query_planner import NEUTRAL_SITES, QueryPlanner, canonical_link
+
+
+def planned(query: str, **kwargs):
+    subs = QueryPlanner(**kwargs).plan(query)
+    return None if subs is None else [(sub.label, sub.query, sub.sites) for sub in subs]
+
+
+def test_two_insurers_split_per_insurer_site():
+    assert planned("compare AIA and Manulife critical illness plans") == [
+        ("AIA", "AIA critical illness plans", ["site:aia.com.hk"]),
+        ("Manulife", "Manulife critical illness plans", ["site:manulife.com.hk"]),
+        ("comparison", "compare AIA and Manulife critical illness plans", NEUTRAL_SITES),
+    ]
+
+
+def test_chinese_insurers_split():
+    assert planned("友邦同宏利危疾計劃邊個好？", comparison_query=False) == [
+        ("AIA", "友邦危疾計劃邊個好？", ["site:aia.com.hk"]),
+        ("Manulife", "宏利危疾計劃邊個好？", ["site:manulife.com.hk"]),
+    ]
+
+
+def test_one_insurer_two_products_split_per_product_on_its_site():
+    assert planned("AIA critical illness or medical plan, which is better?", comparison_query=False) == [
+        ("critical illness", "AIA critical illness plan, which is better?", ["site:aia.com.hk"]),
+        ("medical", "AIA medical plan, which is better?", ["site:aia.com.hk"]),
+    ]
+
+
+@pytest.mark.parametrize("query", ["AIA critical illness plan", "best critical illness plans 2024", "how does VHIS work?"])
+def test_single_entity_is_not_planned(query):
+    assert planned(query) is None
+
+
+def test_disabled_planner_does_not_plan():
+    assert planned("compare AIA and Manulife", enabled=False) is None
+
+
+def test_sub_queries_are_capped():
+    subs = planned("compare AIA, AXA, Chubb, Manulife and Prudential medical", max_sub_queries=2, comparison_query=False)
+    assert [label for label, _, _ in subs] == ["AIA", "AXA"]
+
+
+@pytest.mark.parametrize("query,keep,expected", [
+    ("Which is better, AXA or Chubb savings?", "Chubb", "Which is better, Chubb savings?"),
+    ("Which is better, AXA or Chubb savings?", "AXA", "Which is better, AXA savings?"),
+    ("Between Prudential and Sun Life, which savings plan pays more?", "Prudential",
+     "Prudential, which savings plan pays more?"),
+    ("compare AIA, AXA and Chubb medical", "AXA", "AXA medical"),
+    ("AIA vs AXA?", "AXA", "AXA?"),
+    ("友邦、宏利同保誠嘅危疾計劃比較", "宏利", "宏利嘅危疾計劃"),
+])
+def test_focus_on_one_insurer(query, keep, expected):
+    name = next(name for name, pattern in INSURER_PATTERNS.items() if pattern.search(keep))
+    assert QueryPlanner._focus(query, INSURER_PATTERNS, keep=name) == expected
+
+
+def test_focus_on_one_product():
+    query = "AIA critical illness or medical plan, which is better?"
+    assert QueryPlanner._focus(query, PRODUCT_PATTERNS, keep="medical") == "AIA medical plan, which is better?"
+
+
+def result(link: str, snippet: str = "snippet", title: str = "title"):
+    return {"title": title, "link": link, "snippet": snippet}
+
+
+def test_merge_interleaves_and_drops_duplicate_pages():
+    planner = QueryPlanner()
+    merged = planner.merge([
+        [result("https://www.aia.com.hk/ci"), result("https://aia.com.hk/medical")],
+        [result("http://aia.com.hk/ci/"), result("https://manulife.com.hk/ci#top")],
+    ])
+    assert [item["link"] for item in merged] == [
+        "https://www.aia.com.hk/ci", "https://aia.com.hk/medical", "https://manulife.com.hk/ci#top",
+    ]
+    assert planner.duplicates_dropped == 1
+
+
+def test_merge_stops_at_the_snippet_budget_but_keeps_one_result():
+    planner = QueryPlanner(snippet_tokens=10)
+    long_snippet = "premium " * 200
+    merged = planner.merge([[result("https://a.com/1", long_snippet)], [result("https://b.com/1", long_snippet)]])
+    assert [item["link"] for item in merged] == ["https://a.com/1"]
+    assert planner.over_budget_dropped == 1
+
+
+def test_canonical_link():
+    assert canonical_link("HTTPS://www.AIA.com.hk/ci/#plans") == canonical_link("http://aia.com.hk/ci")
+    assert canonical_link("https://aia.com.hk/ci?id=1") != canonical_link("https://aia.com.hk/ci?id=2")
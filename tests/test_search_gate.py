@@ -0,0 +1,135 @@
+import asyncio
+
+import pytest
+
+from search_gate import SearchGate, message_length
+
+FIRST_QUESTION = "What does AIA's critical illness plan cover?"
+
+
+def follow_up(query: str, first: str = FIRST_QUESTION):
+    gate = SearchGate(threshold=0.5)
+    messages = [
+        {"role": "user", "content": first},
+        {"role": "assistant", "content": "It covers cancer, heart attack and stroke."},
+        {"role": "user", "content": query},
+    ]
+    return gate.decide(messages, query)
+
+
+@pytest.mark.parametrize("query", [
+    "tell me about AXA critical illness plans",
+    "show me Prudential medical plans",
+    "介紹一下宏利危疾計劃",
+    "and for AIA medical cover?",
+])
+def test_new_insurer_or_product_is_searched(query):
+    decision = follow_up(query)
+    assert decision.decision == "search"
+    assert decision.reason == "new_entity"
+    assert decision.query == query
+
+
+@pytest.mark.parametrize("query", ["thanks!", "ok thank you", "謝謝", "好的"])
+def test_acknowledgements_skip(query):
+    assert follow_up(query).decision == "skip"
+
+
+@pytest.mark.parametrize("query", ["translate the above into English", "將上面翻譯成英文", "summarise that in 3 bullets"])
+def test_rework_reuses_the_previous_search(query):
+    decision = follow_up(query)
+    assert decision.decision == "reuse"
+    assert decision.reason == "rework"
+    assert decision.query == FIRST_QUESTION
+
+
+def test_same_insurer_follow_up_can_reuse():
+    decision = follow_up("tell me more about AIA's plan")
+    assert decision.decision == "reuse"
+
+
+def test_time_sensitive_follow_up_is_searched():
+    decision = follow_up("what is the latest premium for a 40 year old?")
+    assert decision.decision == "search"
+    assert decision.reason == "classifier"
+
+
+def test_chinese_length_counts_bigrams():
+    assert message_length("介紹一下宏利危疾計劃") == 9
+    assert message_length("compare AIA and Manulife") == 4
+
+
+def test_chinese_follow_up_question_is_searched():
+    decision = follow_up("友邦危疾計劃今年嘅保費係幾多？", first="友邦危疾計劃保障啲乜？")
+    assert decision.decision == "search"
+
+
+def test_first_turn_is_always_searched():
+    gate = SearchGate()
+    query = "tell me more"
+    assert gate.decide([{"role": "user", "content": query}], query).reason == "first_turn"
+
+
+@pytest.mark.parametrize("override,expected", [("force", "search"), ("skip", "skip"), ("FORCE", "search")])
+def test_override(override, expected):
+    gate = SearchGate()
+    query = "thanks"
+    decision = gate.decide([{"role": "user", "content": "AIA plans"}, {"role": "user", "content": query}], query, override)
+    assert decision.decision == expected
+    assert decision.reason == "override"
+
+
+def test_disabled_reuse_skips_instead():
+    gate = SearchGate(reuse=False)
+    messages = [{"role": "user", "content": FIRST_QUESTION}, {"role": "user", "content": "translate the above"}]
+    assert gate.decide(messages, "translate the above").decision == "skip"
+
+
+def conversation(*user_turns: str):
+    messages = []
+    for turn in user_turns:
+        messages += [{"role": "user", "content": turn}, {"role": "assistant", "content": "..."}]
+    return messages[:-1]
+
+
+def test_reuse_candidates_walk_back_newest_first():
+    messages = conversation(FIRST_QUESTION, "translate the above into English", "summarise that in 3 bullets")
+    assert SearchGate().reuse_candidates(messages, "summarise that in 3 bullets") == [
+        "translate the above into English", FIRST_QUESTION,
+    ]
+
+
+def test_reuse_candidates_stop_at_another_insurer():
+    messages = conversation(FIRST_QUESTION, "show me AXA critical illness plans", "translate that")
+    assert SearchGate().reuse_candidates(messages, "translate that") == ["show me AXA critical illness plans"]
+
+
+def test_reuse_candidates_are_bounded():
+    turns = [FIRST_QUESTION] + [f"translate that again ({n})" for n in range(10)]
+    assert SearchGate(reuse_lookback=3).reuse_candidates(conversation(*turns), turns[-1]) == turns[-2:-5:-1]
+
+
+def test_follow_up_chain_keeps_reusing_the_last_search():
+    import main
+    from cache import normalize_query
+
+    searched = []
+
+    async def search(query: str) -> str:
+        searched.append(query)
+        context = f"results for {query}"
+        main.search_cache.set(normalize_query(query), context)
+        return context
+
+    async def turn(*user_turns: str):
+        messages = conversation(*user_turns)
+        return await main.gated_search_context("/api/dswithsearch", messages, user_turns[-1], search)
+
+    first = "What does AIA's Critical Illness plan cover in 2025?"
+    chain = [first, "translate the above into English", "now summarise that in 3 bullets"]
+    decisions = [asyncio.run(turn(*chain[:n])) for n in (1, 2, 3)]
+    assert searched == [first]
+    assert [(gate.decision, gate.query) for _, gate in decisions] == [
+        ("search", first), ("reuse", first), ("reuse", first),
+    ]
+    assert all(context == f"results for {first}" for context, _ in decisions)
@@ -0,0 +1,68 @@
+import asyncio
+import time
+from types import SimpleNamespace
+
+from streaming import sse_event, stream_openai_completion
+
+
+def chunk(text: str):
+    return SimpleNamespace(choices=[SimpleNamespace(delta=SimpleNamespace(content=text, reasoning_content=None))],
+                           usage=None)
+
+
+# Upstream stream stub: sends `texts`, then either ends or hangs like a stalled upstream
+class StubStream:
+    def __init__(self, texts, hang: bool = False):
+        self.texts = list(texts)
+        self.hang = hang
+        self.closed = False
+
+    def __aiter__(self):
+        return self
+
+    async def __anext__(self):
+        if self.texts:
+            return chunk(self.texts.pop(0))
+        if self.hang:
+            await asyncio.Event().wait()
+        raise StopAsyncIteration
+
+    async def close(self):
+        self.closed = True
+
+
+def relay(stream, expires_at=None):
+    cancels = []
+
+    async def run():
+        events = [event async for event in stream_openai_completion(
+            stream, on_cancel=lambda reason, chunks: cancels.append((reason, chunks)),
+            expires_at=None if expires_at is None else time.monotonic() + expires_at)]
+        return events
+    return asyncio.run(run()), cancels
+
+
+def test_complete_stream_is_relayed():
+    stream = StubStream(["Hello", " <think>x</think>"])
+    events, cancels = relay(stream, expires_at=5.0)
+    assert events == [
+        sse_event({"delta": "Hello"}),
+        sse_event({"delta": " <AIM AI助手>x</AIM AI助手>"}),
+        sse_event("[DONE]"),
+    ]
+    assert cancels == [] and stream.closed
+
+
+def test_stalled_stream_ends_at_the_deadline():
+    stream = StubStream(["Hello"], hang=True)
+    started = time.monotonic()
+    events, cancels = relay(stream, expires_at=0.2)
+    assert time.monotonic() - started < 1.0
+    assert events == [sse_event({"delta": "Hello"}), sse_event({"detail": "Deadline exceeded"}, event="error")]
+    assert cancels == [("deadline", 1)]
+    assert stream.closed
+
+
+def test_no_deadline_waits_for_the_stream():
+    events, cancels = relay(StubStream(["a", "b"]))
+    assert events[-1] == sse_event("[DONE]") and cancels == []
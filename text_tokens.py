@@ -0,0 +1,20 @@
+import re
+from typing import List
+
+# Latin words/numbers, or runs of CJK characters (split into bigrams below)
+_TOKEN_PATTERN = re.compile(r"[a-z0-9]+|[㐀-䶿一-鿿぀-ヿ가-힯]+")
+
+
+# Lowercased word tokens for Latin text and overlapping bigrams for CJK runs,
+# since Chinese has no spaces: "危疾保障" -> ["危疾", "疾保", "保障"]
+def tokenize(text: str) -> List[str]:
+    tokens: List[str] = []
+    for match in _TOKEN_PATTERN.finditer(text.lower()):
+        token = match.group()
+        if token[0].isascii():
+            tokens.append(token)
+        elif len(token) == 1:
+            tokens.append(token)
+        else:
+            tokens.extend(token[i:i + 2] for i in range(len(token) - 1))
+    return tokens